@@ -0,0 +1,114 @@
+"""
+Fleet-wide monitoring: every host runs its own monitor with --snapshot-dir pointing to a shared spool directory, and
+this aggregator merges the latest snapshot of every host to run the alert warden and the display on the combined
+traffic.
+Run it from the Console_Monitor directory, for example: python Aggregator.py --spool /var/spool/http-monitor
+"""
+
+import argparse
+from logging import getLogger
+import glob
+import os
+import sys
+import time
+from Buffer import BucketedLogsBuffer
+from Snapshot import WindowSnapshot
+from Warden import AlertWarden
+from DisplayHelper import get_formatted_stats, format_alert_message, format_alert_status
+from datetime import datetime
+
+logger = getLogger(__name__)
+
+
+def load_snapshots(spool_dir, max_age):
+    """
+    :param spool_dir: (str) directory where the monitors write their snapshots
+    :param max_age: (float) snapshots not updated for that many seconds are ignored (their monitor stopped)
+    :return: (dict) {node name: WindowSnapshot}
+    """
+    snapshots = {}
+    now = time.time()
+    for path in sorted(glob.glob(os.path.join(spool_dir, "*.snap"))):
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                continue
+            snapshots[os.path.basename(path)[:-len(".snap")]] = WindowSnapshot.load(path)
+        except (IOError, OSError, ValueError) as error:
+            logger.warning("Skipping the snapshot %s: %s", path, error)
+    return snapshots
+
+
+def merge_snapshots(snapshots):
+    """
+    :param snapshots: (iterable) WindowSnapshot of every node
+    :return: (WindowSnapshot) sum of all of them
+    """
+    merged = WindowSnapshot()
+    for snapshot in snapshots:
+        merged = merged.merge(snapshot)
+    return merged
+
+
+def combined_buffer(snapshot, period, now):
+    """
+    :param snapshot: (WindowSnapshot) merged snapshot of the fleet
+    :param period: (int) time frame of the statistics, in minutes
+    :param now: (float) now timestamp
+    :return: (BucketedLogsBuffer) buffer holding the counts of the snapshot that are within the period
+    """
+    monitor_buffer = BucketedLogsBuffer(period)
+    for partial in snapshot.partials():
+        monitor_buffer.add_counts(*partial)
+    monitor_buffer.clean_old_entries(now)
+    return monitor_buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the snapshots of several monitors and monitor the fleet")
+    parser.add_argument("--spool", required=True, type=str,
+                        help="Spool directory where the monitors write their snapshots (their --snapshot-dir)")
+    parser.add_argument("-s", "--summary", default="alerts.txt", type=str,
+                        help="File where to write events we need to archive")
+    parser.add_argument("-p", "--period", default=2, type=int,
+                        help="Time frame (int, in minutes) of the monitoring statistics")
+    parser.add_argument("-r", "--refresh", default=10, type=int,
+                        help="Refresh rate (int, in seconds) for the console output of monitoring statistics")
+    parser.add_argument("-t", "--top", default=10, type=int,
+                        help="Maximum amount of sections and users displayed")
+    parser.add_argument("-i", "--interval", default=1., type=float,
+                        help="Time (in seconds) between two merges of the snapshots")
+    args = parser.parse_args()
+
+    alert_warden = AlertWarden(args.period)
+    next_display = time.mktime(time.gmtime()) + args.refresh
+    with open(args.summary, 'a') as alert_logs:
+        while True:
+            now = time.mktime(time.gmtime())
+            snapshots = load_snapshots(args.spool, args.period * 60)
+            monitor_buffer = combined_buffer(merge_snapshots(snapshots.values()), args.period, now)
+            message_type, data = alert_warden.update(monitor_buffer.get_total_hits(), now)
+            alert_state = format_alert_message(message_type, data)
+            if alert_state:
+                alert_logs.write(alert_state)
+                alert_logs.flush()
+                print(alert_state)
+
+            if now > next_display:
+                readable_now = datetime.fromtimestamp(now).strftime('%H:%M:%S')
+                print(get_formatted_stats(readable_now, format_alert_status(alert_warden.status()),
+                                          monitor_buffer.get_total_hits(),
+                                          monitor_buffer.get_total_sections(),
+                                          monitor_buffer.get_popular_sections(args.top),
+                                          monitor_buffer.get_status_classes(),
+                                          monitor_buffer.get_total_success(),
+                                          monitor_buffer.get_total_users(),
+                                          monitor_buffer.get_user_traffic(args.top),
+                                          monitor_buffer.get_total_traffic()
+                                          ) + "%d nodes: %s\n" % (len(snapshots), " ".join(sorted(snapshots))))
+                while next_display < now:
+                    next_display += args.refresh
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Adaptive baseline anomaly detection, alongside the fixed threshold of the AlertWarden
+The hits of every minute are compared to a Holt-Winters forecast: a level and a trend smoothed exponentially, plus a
+seasonal component for every minute of the season (a day by default), so that the daily peak is expected while a
+burst at midnight is not. The deviation is measured in standard deviations of the past forecast errors, themselves
+smoothed exponentially, and an anomaly is raised beyond a given amount of them.
+Every update costs O(1) per minute and per detector, whatever the traffic. Detectors watch the whole traffic and,
+optionally, the busiest sections.
+"""
+
+import math
+from array import array
+from collections import Counter
+from datetime import datetime
+from DisplayHelper import format_period
+
+_SEASON_MINUTES = 1440
+# Smoothing factors of the level, the trend, the seasonal components and the variance of the forecast errors
+_LEVEL_WEIGHT = .1
+_TREND_WEIGHT = .01
+_SEASONAL_WEIGHT = .3
+_VARIANCE_WEIGHT = .05
+_SIGMAS = 4.
+_RECOVERY_SIGMAS = 2.
+# Minutes learned by a detector before it may raise an anomaly
+_WARMUP_MINUTES = 60
+# Time a minute is kept open after its end, for the late entries
+_GRACE_SECONDS = 5
+
+
+class HoltWinters(object):
+    __slots__ = ("level", "trend", "seasonal", "variance", "updates")
+
+    def __init__(self, season=_SEASON_MINUTES):
+        """
+        Additive Holt-Winters baseline of a series of per-minute values
+        :param season: (int) length of the season, in minutes
+        """
+        self.level = None
+        self.trend = 0.
+        self.seasonal = array('d', [0.]) * season
+        self.variance = 0.
+        self.updates = 0
+
+    def forecast(self, index):
+        """
+        :param index: (int) index of the minute in the season
+        :return: (tuple) (expected value, standard deviation of the forecast errors), the deviation being at least the
+                         one of a Poisson process of the expected rate plus one, so that a quiet or flat series does
+                         not alert on a few hits
+        """
+        if self.level is None:
+            return 0., 1.
+        expected = max(self.level + self.trend + self.seasonal[index], 0.)
+        return expected, max(math.sqrt(self.variance), 1. + math.sqrt(expected))
+
+    def update(self, value, index, clamp=None):
+        """
+        :param value: (float) value of the minute
+        :param index: (int) index of the minute in the season
+        :param clamp: (float) largest deviation from the forecast learned, so that an anomaly is not absorbed into the
+                      baseline at once (a lasting change of the traffic still is, progressively), None for no limit.
+                      The deviations beyond it are not learned into the variance of the forecast errors either.
+        """
+        self.updates += 1
+        if self.level is None:
+            self.level = float(value)
+            return
+        expected = self.level + self.trend + self.seasonal[index]
+        error = value - expected
+        if clamp is not None and abs(error) > clamp:
+            error = clamp if error > 0 else -clamp
+            value = expected + error
+        else:
+            self.variance += _VARIANCE_WEIGHT * (error * error - self.variance)
+        level = _LEVEL_WEIGHT * (value - self.seasonal[index]) + (1 - _LEVEL_WEIGHT) * (self.level + self.trend)
+        self.trend = _TREND_WEIGHT * (level - self.level) + (1 - _TREND_WEIGHT) * self.trend
+        self.seasonal[index] += _SEASONAL_WEIGHT * (value - level - self.seasonal[index])
+        self.level = level
+
+
+class AnomalyDetector:
+    def __init__(self, season=_SEASON_MINUTES, sigmas=_SIGMAS, recovery_sigmas=_RECOVERY_SIGMAS,
+                 warmup=_WARMUP_MINUTES):
+        """
+        Alert state of a series of per-minute hits, against its Holt-Winters baseline
+        :param season: (int) length of the season, in minutes
+        :param sigmas: (float) deviation from the baseline, in standard deviations, from which an anomaly is raised
+        :param recovery_sigmas: (float) deviation under which the anomaly recovers (lower, to avoid flapping)
+        :param warmup: (int) minutes learned before an anomaly may be raised
+        """
+        self.season = season
+        self.sigmas = sigmas
+        self.recovery_sigmas = recovery_sigmas
+        self.warmup = warmup
+        self.baseline = HoltWinters(season)
+        self.in_alert_since = None
+        self.peak = None
+
+    def update(self, hits, minute):
+        """
+        Compare the hits of a minute to the baseline, then learn them
+        :param hits: (int) hits of the minute
+        :param minute: (int) timestamp of the start of the minute
+        :return: (tuple) (message_type, data) as AlertWarden.update, message_type being 0: recover, 1: alert,
+                         2: nothing, and data:
+            - for an alert: (readable time, hits, expected hits, deviation in standard deviations)
+            - for a recovery: (duration, peak hits, deviation of the peak in standard deviations)
+        """
+        index = minute // 60 % self.season
+        expected, sigma = self.baseline.forecast(index)
+        deviation = (hits - expected) / sigma
+        warm = self.baseline.updates >= self.warmup
+        self.baseline.update(hits, index, sigma if warm else None)
+        if not warm:
+            return 2, ()
+        if self.in_alert_since is None:
+            if abs(deviation) >= self.sigmas:
+                self.in_alert_since = minute
+                self.peak = (hits, deviation)
+                readable_now = datetime.fromtimestamp(minute).strftime('%Y-%m-%d %H:%M:%S')
+                return 1, (readable_now, hits, expected, deviation)
+        else:
+            if abs(deviation) > abs(self.peak[1]):
+                self.peak = (hits, deviation)
+            if abs(deviation) < self.recovery_sigmas:
+                duration = format_period(minute + 60 - self.in_alert_since)
+                self.in_alert_since = None
+                return 0, (duration,) + self.peak
+        return 2, ()
+
+
+class AnomalyEngine:
+    def __init__(self, sections=0, season=_SEASON_MINUTES, sigmas=_SIGMAS, recovery_sigmas=_RECOVERY_SIGMAS,
+                 warmup=_WARMUP_MINUTES, grace=_GRACE_SECONDS):
+        """
+        Anomaly detectors of the whole traffic and of the busiest sections, fed per minute
+        The engine receives the entries like a buffer (add_entry, add_counts, clean_old_entries), so that it can be
+        fed by the ingestion pipeline next to the monitor buffer.
+        :param sections: (int) amount of sections watched, on top of the whole traffic: the busiest ones of the
+                         minutes, until that amount is reached
+        :param season: (int) length of the season, in minutes
+        :param sigmas: (float) deviation from the baseline, in standard deviations, from which an anomaly is raised
+        :param recovery_sigmas: (float) deviation under which the anomaly recovers
+        :param warmup: (int) minutes learned by a detector before it may raise an anomaly
+        :param grace: (int) time a minute is kept open after its end, in seconds
+        """
+        self.max_sections = sections
+        self.season = season
+        self.settings = (season, sigmas, recovery_sigmas, warmup)
+        self.grace = grace
+        self.traffic = AnomalyDetector(*self.settings)
+        self.sections = {}
+        self.open_minutes = {}
+        self.last_minute = None
+
+    def _get_minute(self, second):
+        """
+        :param second: (int) timestamp of an entry
+        :return: (list) [hits, Counter of the sections] of its minute, None if the minute was already evaluated
+        """
+        minute = second - second % 60
+        if self.last_minute is not None and minute <= self.last_minute:
+            return None
+        counts = self.open_minutes.get(minute)
+        if counts is None:
+            counts = self.open_minutes[minute] = [0, Counter()]
+        return counts
+
+    def add_entry(self, parsed_entry):
+        """
+        :param parsed_entry: (NamedTuple) ParsedLine(section, status, host, utc_ts, traffic)
+        """
+        counts = self._get_minute(int(parsed_entry.utc_ts))
+        if counts is not None:
+            counts[0] += 1
+            if self.max_sections:
+                counts[1][parsed_entry.section] += 1
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Add counts pre-aggregated elsewhere, as BucketedLogsBuffer.add_counts
+        """
+        counts = self._get_minute(second)
+        if counts is not None:
+            counts[0] += hits
+            if self.max_sections:
+                counts[1].update(sections)
+
+    def clean_old_entries(self, now):
+        """
+        The minutes are evaluated by update, nothing expires here
+        """
+
+    def update(self, now):
+        """
+        Evaluate the minutes that are over, the minutes without any entry counting as 0 hits
+        :param now: (float) now timestamp
+        :return: (list) tuples (section, message_type, data) of the detectors whose state changed, as
+                        AnomalyDetector.update, section being None for the whole traffic
+        """
+        end = int(now) - self.grace - 60
+        end -= end % 60
+        if self.last_minute is None:
+            if not self.open_minutes:
+                return []
+            self.last_minute = min(self.open_minutes) - 60
+        # After a long gap, only the last season is worth learning
+        start = max(self.last_minute + 60, end - (self.season - 1) * 60)
+        changes = []
+        for minute in range(start, end + 1, 60):
+            hits, sections = self.open_minutes.pop(minute, (0, None))
+            changes += self._evaluate(minute, hits, sections)
+            self.last_minute = minute
+        for minute in [minute for minute in self.open_minutes if minute <= self.last_minute]:
+            del self.open_minutes[minute]
+        return changes
+
+    def _evaluate(self, minute, hits, sections):
+        """
+        :param minute: (int) timestamp of the start of the minute
+        :param hits: (int) hits of the minute
+        :param sections: (Counter) hits of the sections in the minute, None if there were none
+        :return: (list) tuples (section, message_type, data) of the detectors whose state changed
+        """
+        changes = []
+        message_type, data = self.traffic.update(hits, minute)
+        if message_type != 2:
+            changes.append((None, message_type, data))
+        if sections and len(self.sections) < self.max_sections:
+            for section, _ in sections.most_common(self.max_sections - len(self.sections)):
+                if section not in self.sections:
+                    self.sections[section] = AnomalyDetector(*self.settings)
+        for section, detector in self.sections.items():
+            message_type, data = detector.update(sections.get(section, 0) if sections else 0, minute)
+            if message_type != 2:
+                changes.append((section, message_type, data))
+        return changes
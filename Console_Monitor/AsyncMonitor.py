@@ -0,0 +1,144 @@
+"""
+Asynchronous core of the monitor, run by an asyncio event loop (Python 3 only):
+    - the reader task pulls batches of lines from the blocking Tailer in a dedicated thread, and queues them
+    - the ingestion task parses the queued batches into the buffer
+    - timer tasks run the warden check and the display on time, whether lines arrive or not
+    - every sink (alert file, console) writes its messages from its own task and thread, through a bounded queue, so
+      that a slow sink never stalls the parsing
+An error of a timer callback or of a sink is logged and the task goes on, so that one bad tick or message does not
+silence it for the rest of the run.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Batches read and waiting to be parsed: the reader waits when the parsing falls that much behind
+_MAX_PENDING_BATCHES = 64
+# Messages waiting to be written by a sink: the oldest ones are dropped when a sink falls that much behind
+_MAX_PENDING_MESSAGES = 1000
+
+
+class Sink:
+    def __init__(self, name, write, metrics, max_pending=_MAX_PENDING_MESSAGES):
+        """
+        Destination of the messages of the monitor (alerts, statistics), written from a thread of its own
+        Must be built inside the running event loop.
+        :param name: (str) name of the sink, in the self-metrics
+        :param write: (function) blocking function writing a message
+        :param metrics: (SelfMetrics) where to count the dropped messages
+        :param max_pending: (int) maximum amount of messages waiting to be written
+        """
+        self.name = name
+        self.write = write
+        self.metrics = metrics
+        self.queue = asyncio.Queue(max_pending)
+        self.executor = ThreadPoolExecutor(1)
+
+    def publish(self, message):
+        """
+        Queue a message to be written, without ever waiting: the oldest message is dropped if the queue is full
+        :param message: (str) message to write
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.metrics.incr("%s_dropped" % self.name)
+        self.queue.put_nowait(message)
+
+    async def run(self):
+        """
+        Write the queued messages, forever, a message that cannot be written being logged and counted as an error
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            message = await self.queue.get()
+            try:
+                await loop.run_in_executor(self.executor, self.write, message)
+            except Exception:
+                logger.exception("The sink %s failed to write a message", self.name)
+                self.metrics.incr("%s_errors" % self.name)
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def read_batches(batches, queue):
+    """
+    Pull the batches of a blocking generator from a dedicated thread, and queue them
+    :param batches: (generator) batches of lines, as yielded by Tailer.read_batches
+    :param queue: (asyncio.Queue) where to put the batches, None being put once the generator is exhausted
+    """
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(1)
+    try:
+        while True:
+            batch = await loop.run_in_executor(executor, next, batches, None)
+            if batch is None:
+                break
+            await queue.put(batch)
+    finally:
+        executor.shutdown(wait=False)
+    await queue.put(None)
+
+
+async def ingest_batches(queue, process, on_ingested):
+    """
+    Process the queued batches until the reader is done
+    :param queue: (asyncio.Queue) batches put by read_batches
+    :param process: (function) taking a batch, adding it to the buffer, and returning tuples (now, malformed)
+    :param on_ingested: (function) called with (now, malformed) after every ingested batch
+    """
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return
+        for now, malformed in process(batch):
+            on_ingested(now, malformed)
+
+
+async def every(interval, callback):
+    """
+    Call a function at a fixed rate, skipping the ticks missed while the loop was busy, and logging its errors
+    :param interval: (float) time between two calls, in seconds
+    :param callback: (function) function to call, without arguments
+    """
+    loop = asyncio.get_event_loop()
+    next_tick = loop.time() + interval
+    while True:
+        await asyncio.sleep(max(next_tick - loop.time(), 0))
+        try:
+            callback()
+        except Exception:
+            logger.exception("The timer %s failed", getattr(callback, "__name__", callback))
+        now = loop.time()
+        while next_tick <= now:
+            next_tick += interval
+
+
+async def run_monitor(batches, process, on_ingested, timers, sinks):
+    """
+    Run the monitor until the batches are exhausted (the tailer was stopped), then flush the sinks
+    :param batches: (generator) batches of lines, as yielded by Tailer.read_batches
+    :param process: (function) taking a batch, adding it to the buffer, and returning tuples (now, malformed)
+    :param on_ingested: (function) called with (now, malformed) after every ingested batch
+    :param timers: (list) tuples (interval, callback) of the functions to call at a fixed rate
+    :param sinks: (list) Sink receiving the messages of the monitor
+    """
+    queue = asyncio.Queue(_MAX_PENDING_BATCHES)
+    background = [asyncio.ensure_future(every(interval, callback)) for interval, callback in timers]
+    background += [asyncio.ensure_future(sink.run()) for sink in sinks]
+    try:
+        await asyncio.gather(read_batches(batches, queue), ingest_batches(queue, process, on_ingested))
+        for sink in sinks:
+            await sink.queue.join()
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        for sink in sinks:
+            sink.close()
@@ -0,0 +1,358 @@
+"""
+Reproducible benchmarks of the monitor
+    - micro benchmarks of the Tailer, the Parser and the parsers compiled from log formats
+    - end-to-end runs over logs pregenerated by the simulator, at fixed sizes, measuring the throughput, the time spent
+      in every stage (tail, parse, buffer, warden, render) and the peak RSS
+    - latency between a burst of lines being written and the alert being raised
+    - memory used per buffered line, by a deque of ParsedLine (the former LogsBuffer storage) and by LogsBuffer
+Results are written to a JSON file, to be compared across versions.
+Run it from the Console_Monitor directory, for example: python Benchmark.py --sizes 100000 1000000
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from itertools import islice
+from Buffer import LogsBuffer, BucketedLogsBuffer, SketchLogsBuffer
+import NumpyBuffer
+from DisplayHelper import get_formatted_stats, format_alert_status
+from LogFormat import compile_format
+from Parser import parse_lines, parse_logline, _HTTP_LOG_PATTERN, _ParsedLine
+from Tailer import Tailer
+from Warden import AlertWarden
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Logs_Simulator"))
+from SimulateServer import LoadGenerator
+
+_SAMPLE_LINE = '192.168.1.3 - - [20/12/2015:21:15:44 +01.000] "GET /api/browse/id" 404 1978\n'
+_SAMPLE_COMBINED_LINE = ('192.168.1.3 - - [20/Dec/2015:21:15:44 +0100] "GET /api/browse/id HTTP/1.1" 404 1978 '
+                         '"http://example.com/" "Mozilla/5.0 (X11; Linux x86_64)"')
+_RESULT_TEMPLATE = "%-24s %12d lines/s"
+_STAGES = ("tail", "parse", "buffer", "warden", "render")
+_BUFFERS = {"deque": LogsBuffer, "buckets": BucketedLogsBuffer, "sketch": SketchLogsBuffer,
+            "numpy": NumpyBuffer.make_buffer}
+# Fixed start of the pregenerated logs, so that every run works on the same file
+_SIMULATION_START = 1450983600
+
+
+def write_sample_logs(path, nb_lines):
+    """
+    Write a log file made of nb_lines copies of a typical log line
+    :param path: (str) Where to write the logs
+    :param nb_lines: (int) Amount of lines to write
+    """
+    with open(path, 'w') as log_file:
+        log_file.write(_SAMPLE_LINE * nb_lines)
+
+
+def lines_per_second(nb_lines, start, end):
+    """
+    :return: (int) throughput in lines per second, for nb_lines processed between start and end
+    """
+    return int(nb_lines / max(end - start, 1e-9))
+
+
+def bench_tailer_readline(path, nb_lines):
+    """
+    Measure the throughput of the line by line Tailer.read generator
+    :return: (int) lines per second
+    """
+    tailer = Tailer(path, 0.01, from_start=True)
+    count = 0
+    start = time.time()
+    for _ in tailer.read():
+        count += 1
+        if count == nb_lines:
+            break
+    return lines_per_second(nb_lines, start, time.time())
+
+
+def bench_tailer_batches(path, nb_lines):
+    """
+    Measure the throughput of the block based Tailer.read_batches generator
+    :return: (int) lines per second
+    """
+    tailer = Tailer(path, 0.01, from_start=True)
+    count = 0
+    start = time.time()
+    for batch in tailer.read_batches():
+        count += len(batch)
+        if count >= nb_lines:
+            break
+    return lines_per_second(nb_lines, start, time.time())
+
+
+def parse_logline_legacy(new_entry):
+    """
+    Reference implementation of the parser before the fast path and the timestamp caches: full regexp, strptime and
+    three mktime calls for every line
+    """
+    properties = _HTTP_LOG_PATTERN.match(new_entry)
+    local_time_offset = time.mktime(time.localtime()) - time.mktime(time.gmtime())
+    local_ts = time.mktime(time.strptime(properties.group("date"), "%d/%m/%Y:%H:%M:%S"))
+    utc_ts = local_ts - float(properties.group("offsetGMT")) * 3600 + local_time_offset
+    return _ParsedLine(properties.group("section"), properties.group("status"), properties.group("remoteHost"),
+                       utc_ts, int(properties.group("bytes")))
+
+
+def bench_parser(lines, parse):
+    """
+    Measure the throughput of a line by line parsing function
+    :param lines: (list) log lines to parse
+    :param parse: (function) parsing a single line
+    :return: (int) lines per second
+    """
+    start = time.time()
+    for line in lines:
+        parse(line)
+    return lines_per_second(len(lines), start, time.time())
+
+
+def bench_parse_lines(lines, batch_size=4096, parse=parse_lines):
+    """
+    Measure the throughput of the bulk parsing API, fed with batches like the ones read by the Tailer
+    :param parse: (function) parsing a batch of lines, Parser.parse_lines or a parser compiled from a log format
+    :return: (int) lines per second
+    """
+    start = time.time()
+    for i in range(0, len(lines), batch_size):
+        parse(lines[i:i + batch_size])
+    return lines_per_second(len(lines), start, time.time())
+
+
+def pregenerate_logs(path, nb_lines, rate, nb_hosts, nb_sections, seed):
+    """
+    Write a reproducible log file with the load generator of the simulator
+    """
+    with open(path, 'w') as log_file:
+        LoadGenerator(rate, "spikes", nb_hosts, nb_sections, seed).pregenerate(log_file, nb_lines, _SIMULATION_START)
+
+
+def render(monitor_buffer, alert_warden, now, top=10):
+    """
+    :return: (str) the statistics, as displayed by the monitor
+    """
+    return get_formatted_stats(str(now), format_alert_status(alert_warden.status()),
+                               monitor_buffer.get_total_hits(),
+                               monitor_buffer.get_total_sections(),
+                               monitor_buffer.get_popular_sections(top),
+                               monitor_buffer.get_status_classes(),
+                               monitor_buffer.get_total_success(),
+                               monitor_buffer.get_total_users(),
+                               monitor_buffer.get_user_traffic(top),
+                               monitor_buffer.get_total_traffic())
+
+
+def bench_pipeline(path, nb_lines, buffer_name, refresh=10):
+    """
+    Run the monitor pipeline over a log file, timing every stage. The clock is driven by the log timestamps, and the
+    statistics are rendered every refresh seconds of that clock.
+    Meant to run in its own process, so that the peak RSS only accounts for this run.
+    :return: (dict) lines, lines_per_second, seconds spent in every stage, peak_rss_kb
+    """
+    tailer = Tailer(path, .01, from_start=True)
+    monitor_buffer, alert_warden = _BUFFERS[buffer_name](2), AlertWarden(2)
+    stages = dict.fromkeys(_STAGES, 0.)
+    batches = tailer.read_batches()
+    count, next_display, now = 0, None, None
+    start = time.time()
+    while count < nb_lines:
+        t0 = time.time()
+        batch = next(batches)
+        t1 = time.time()
+        parsed_lines = parse_lines(batch)
+        t2 = time.time()
+        if parsed_lines:
+            now = parsed_lines[-1].utc_ts
+            monitor_buffer.clean_old_entries(now)
+            for parsed_line in parsed_lines:
+                monitor_buffer.add_entry(parsed_line)
+        t3 = time.time()
+        alert_warden.update(monitor_buffer.get_total_hits(), now)
+        t4 = time.time()
+        if next_display is None:
+            next_display = now + refresh
+        if now > next_display:
+            render(monitor_buffer, alert_warden, now)
+            next_display += refresh
+        t5 = time.time()
+        for stage, elapsed in zip(_STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            stages[stage] += elapsed
+        count += len(batch)
+    total = time.time() - start
+    batches.close()
+    return {"lines": count,
+            "lines_per_second": lines_per_second(count, start, start + total),
+            "stages": stages,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def bench_pipeline_isolated(path, nb_lines, buffer_name):
+    """
+    :return: (dict) result of bench_pipeline, run in a fresh process
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(bench_pipeline, (path, nb_lines, buffer_name))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def bench_alert_latency(path, buffer_name, period=1):
+    """
+    Tail an idle log file, write a burst of lines crossing the alert threshold at once, and measure how long the
+    monitor takes to raise the alert
+    :return: (float) latency in milliseconds
+    """
+    open(path, 'w').close()
+    alert_warden = AlertWarden(period)
+    monitor_buffer = _BUFFERS[buffer_name](period)
+    burst = LoadGenerator(1000, seed=0).lines_at(time.time(), int(alert_warden.alert_threshold) + 1)
+    written_at = []
+
+    def write_burst():
+        time.sleep(.5)
+        with open(path, 'a') as log_file:
+            written_at.append(time.time())
+            log_file.write("".join(burst))
+
+    writer = threading.Thread(target=write_burst)
+    writer.start()
+    tailer = Tailer(path, .5)
+    for batch in tailer.read_batches():
+        parsed_lines = parse_lines(batch)
+        for parsed_line in parsed_lines:
+            monitor_buffer.add_entry(parsed_line)
+        if parsed_lines and alert_warden.update(monitor_buffer.get_total_hits(), parsed_lines[-1].utc_ts)[0] == 1:
+            break
+    latency = time.time() - written_at[0]
+    writer.join()
+    return 1000 * latency
+
+
+def bench_memory(path, nb_lines):
+    """
+    Measure the memory used per buffered line, by a deque of ParsedLine and by the columns of LogsBuffer
+    Meant to run in its own process.
+    :param path: (str) log file to buffer
+    :param nb_lines: (int) amount of lines of the log file to buffer, from its start
+    :return: (dict) {storage: bytes per buffered line}
+    """
+    results = {}
+    for name, make_buffer in (("ParsedLine deque", deque), ("LogsBuffer", lambda: LogsBuffer(10 ** 6))):
+        tracemalloc.start()
+        monitor_buffer = make_buffer()
+        add = getattr(monitor_buffer, "add_entry", None) or monitor_buffer.append
+        with open(path, 'r') as log_file:
+            lines = islice(log_file, nb_lines)
+            for batch in iter(lambda: list(islice(lines, 8192)), []):
+                for parsed_line in parse_lines(batch):
+                    add(parsed_line)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = float(used) / max(len(monitor_buffer), 1)
+        del monitor_buffer, add
+    return results
+
+
+def bench_memory_isolated(path, nb_lines):
+    """
+    :return: (dict) result of bench_memory, run in a fresh process
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(bench_memory, (path, nb_lines))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def git_revision():
+    """
+    :return: (str) revision of the benchmarked code, None if it is not known
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the monitor and write the results to a JSON file")
+    parser.add_argument("--sizes", default=[100000, 1000000], type=int, nargs="+",
+                        help="Amounts of log lines of the end-to-end runs")
+    parser.add_argument("-b", "--buffer", default="deque", choices=sorted(_BUFFERS),
+                        help="Buffer used by the end-to-end runs")
+    parser.add_argument("--rate", default=2000, type=float,
+                        help="Lines per second simulated in the pregenerated logs")
+    parser.add_argument("--hosts", default=1000, type=int,
+                        help="Amount of distinct hosts in the pregenerated logs")
+    parser.add_argument("--sections", default=50, type=int,
+                        help="Amount of distinct sections in the pregenerated logs")
+    parser.add_argument("--seed", default=42, type=int,
+                        help="Seed of the pregenerated logs")
+    parser.add_argument("--memory-lines", default=1000000, type=int,
+                        help="Amount of buffered lines of the memory benchmark, 0 to skip it")
+    parser.add_argument("-o", "--output", default="bench_results.json", type=str,
+                        help="JSON file where to write the results")
+    args = parser.parse_args()
+
+    results = {"revision": git_revision(), "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+               "python": platform.python_version(), "buffer": args.buffer, "rate": args.rate, "hosts": args.hosts,
+               "sections": args.sections, "seed": args.seed, "micro": {}, "end_to_end": []}
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "logs.txt")
+        micro_lines = min(args.sizes)
+        write_sample_logs(path, micro_lines)
+        with open(path, 'r') as log_file:
+            lines = log_file.read().splitlines()
+        micro = results["micro"]
+        micro["Tailer.read"] = bench_tailer_readline(path, micro_lines)
+        micro["Tailer.read_batches"] = bench_tailer_batches(path, micro_lines)
+        micro["parse_logline (legacy)"] = bench_parser(lines, parse_logline_legacy)
+        micro["parse_logline"] = bench_parser(lines, parse_logline)
+        micro["parse_lines"] = bench_parse_lines(lines)
+        micro["parse_lines (combined)"] = bench_parse_lines([_SAMPLE_COMBINED_LINE] * micro_lines,
+                                                            parse=compile_format("combined"))
+        for name in sorted(micro):
+            print(_RESULT_TEMPLATE % (name, micro[name]))
+
+        for size in args.sizes:
+            pregenerate_logs(path, size, args.rate, args.hosts, args.sections, args.seed)
+            run = bench_pipeline_isolated(path, size, args.buffer)
+            run["size"] = size
+            results["end_to_end"].append(run)
+            print(_RESULT_TEMPLATE % ("end-to-end %d" % size, run["lines_per_second"]) + "  peak RSS %d kB  %s" %
+                  (run["peak_rss_kb"], " ".join("%s=%.2fs" % (stage, run["stages"][stage]) for stage in _STAGES)))
+
+        results["alert_latency_ms"] = bench_alert_latency(path, args.buffer)
+        print("%-24s %12.1f ms" % ("alert latency", results["alert_latency_ms"]))
+
+        if args.memory_lines:
+            pregenerate_logs(path, args.memory_lines, args.rate, args.hosts, args.sections, args.seed)
+            results["bytes_per_line"] = bench_memory_isolated(path, args.memory_lines)
+            for name, bytes_per_line in sorted(results["bytes_per_line"].items()):
+                print("%-24s %12.1f bytes/line at %d lines" % (name, bytes_per_line, args.memory_lines))
+    finally:
+        shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
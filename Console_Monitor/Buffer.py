@@ -1,45 +1,410 @@
 """
 Buffer Class, containing all the log lines during the period time frame
+BucketedLogsBuffer is a lighter alternative, aggregating the log lines of every second of the period
+SketchLogsBuffer bounds the memory used whatever the amount of distinct sections and hosts, with approximate statistics
+FanoutBuffer feeds other consumers of the entries next to the buffer
+PercentileBuffer is such a consumer, keeping the quantiles of the response sizes and times of every section
+PathTreeBuffer is another one, counting the hits and bytes of every prefix of the paths, down to a given depth
 """
 
+import heapq
+import math
+from array import array
 from collections import Counter, deque
+from Parser import _ParsedLine
+from Sketches import CountMinSketch, DDSketch, HyperLogLog, SpaceSaving, hash64
+from Snapshot import WindowSnapshot
 
+_MAX_CACHED_HASHES = 100000
+# Amount of expired entries from which LogsBuffer compacts its columns
+_MIN_COMPACTED_ENTRIES = 4096
+# Sections for which PercentileBuffer keeps sketches of their own, the other ones are counted together
+_MAX_PERCENTILE_SECTIONS = 64
+_OTHER_SECTIONS = "(other)"
+# Pseudo-host under which the degraded mode of the ingestion (see Pipeline.LoadShedder) counts the hits and traffic of
+# the sampled lines: it is no host, so the consumers keeping per-host statistics (rules, rollups) ignore it
+SAMPLED_HOSTS = "(sampled)"
+_QUANTILES = (.5, .95, .99)
+# Bounds of PathTreeBuffer: segments of the paths counted, children of a node and nodes of the whole tree, the next
+# children of a node being counted together as _OTHER_PATHS
+_PATH_TREE_DEPTH = 3
+_MAX_PATH_CHILDREN = 32
+_MAX_PATH_NODES = 4096
+_OTHER_PATHS = "(other)"
 
-class LogsBuffer(deque):
+
+class _Interner:
+    def __init__(self):
+        """
+        Dictionary encoding of the strings of the buffered entries: every distinct string is stored once, and
+        referred to by its index
+        The identifiers of the released strings are given to the next new strings.
+        """
+        self.ids = {}
+        self.values = []
+        self.released = []
+
+    def intern(self, value):
+        """
+        :param value: (str) string to encode
+        :return: (int) identifier of the string
+        """
+        identifier = self.ids.get(value)
+        if identifier is None:
+            if self.released:
+                identifier = self.ids[value] = self.released.pop()
+                self.values[identifier] = value
+            else:
+                identifier = self.ids[value] = len(self.values)
+                self.values.append(value)
+        return identifier
+
+    def release(self, identifier):
+        """
+        Forget a string no longer referred to, its identifier being recycled
+        :param identifier: (int) identifier of the string
+        """
+        del self.ids[self.values[identifier]]
+        self.values[identifier] = None
+        self.released.append(identifier)
+
+
+class LogsBuffer:
     def __init__(self, period=2):
-        deque.__init__(self)
+        """
+        Buffer of every entry of the period, stored in parallel array columns rather than as one object per entry
+        Sections, statuses and hosts are dictionary encoded, so an entry costs about 28 bytes instead of a few
+        hundred for a ParsedLine and its strings. The strings that leave the period are released along with their
+        counters, so the memory used does not grow with the amount of distinct hosts or sections over time.
+        :param period: (int) time frame of the buffer, in minutes
+        """
+        self.utc_ts = array('d')
+        self.section_ids = array('I')
+        self.status_ids = array('I')
+        self.host_ids = array('I')
+        self.traffic = array('q')
+        # Index of the oldest entry of the period in the columns, the ones before it are expired
+        self.head = 0
+        self.section_names = _Interner()
+        self.status_names = _Interner()
+        self.host_names = _Interner()
         self.hits = Counter()
         self.statuses = Counter()
+        self.status_classes = Counter()
+        self.host_hits = Counter()
         self.host_traffic = Counter()
+        self.total_traffic = 0
         self.period = period*60
 
+    def __len__(self):
+        return len(self.utc_ts) - self.head
+
+    def __getitem__(self, index):
+        """
+        :param index: (int) position of the entry, from the oldest one (negative from the newest one)
+        :return: (ParsedLine) the entry
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("LogsBuffer index out of range")
+        index += self.head
+        return _ParsedLine(self.section_names.values[self.section_ids[index]],
+                           self.status_names.values[self.status_ids[index]],
+                           self.host_names.values[self.host_ids[index]], self.utc_ts[index], self.traffic[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
     def add_entry(self, parsed_entry):
         """
         Add an entry to the buffer
         :param parsed_entry: (NamedTuple) containing the relevant information about a new entry
                                           ParsedLine(section, status, host, utc_ts, traffic)
         """
-        self.append(parsed_entry)
+        section, status, host, utc_ts, traffic = parsed_entry[:5]
+        self.utc_ts.append(utc_ts)
+        self.section_ids.append(self.section_names.intern(section))
+        self.status_ids.append(self.status_names.intern(status))
+        self.host_ids.append(self.host_names.intern(host))
+        self.traffic.append(traffic)
+        self.hits[section] += 1
+        self.statuses[status] += 1
+        self.status_classes[status[:1]] += 1
+        self.host_hits[host] += 1
+        self.host_traffic[host] += traffic
+        self.total_traffic += traffic
+
+    def clean_old_entries(self, now):
+        """
+        Remove all entries that are older than the period from the buffer, the sections, statuses and hosts left
+        without entries being dropped from the counters and released by the interners
+        :param now: (float) now timestamp
+        """
+        limit = now - self.period
+        utc_ts, head, end = self.utc_ts, self.head, len(self.utc_ts)
+        sections, statuses, hosts = self.section_names.values, self.status_names.values, self.host_names.values
+        while head < end and utc_ts[head] < limit:
+            section_id, status_id, host_id = self.section_ids[head], self.status_ids[head], self.host_ids[head]
+            section, status, host = sections[section_id], statuses[status_id], hosts[host_id]
+            traffic = self.traffic[head]
+            self.total_traffic -= traffic
+            if self.hits[section] > 1:
+                self.hits[section] -= 1
+            else:
+                del self.hits[section]
+                self.section_names.release(section_id)
+            if self.statuses[status] > 1:
+                self.statuses[status] -= 1
+            else:
+                del self.statuses[status]
+                self.status_names.release(status_id)
+            if self.status_classes[status[:1]] > 1:
+                self.status_classes[status[:1]] -= 1
+            else:
+                del self.status_classes[status[:1]]
+            if self.host_hits[host] > 1:
+                self.host_hits[host] -= 1
+                self.host_traffic[host] -= traffic
+            else:
+                del self.host_hits[host], self.host_traffic[host]
+                self.host_names.release(host_id)
+            head += 1
+        self.head = head
+        # Drop the expired entries from the columns once they are the bigger part of them, so that it is amortized
+        if head > _MIN_COMPACTED_ENTRIES and 2 * head > end:
+            for column in (self.utc_ts, self.section_ids, self.status_ids, self.host_ids, self.traffic):
+                del column[:head]
+            self.head = 0
+
+    def get_total_hits(self):
+        """
+        :return: (int) the number of hits in the buffer (ie during the period)
+        """
+        return len(self)
+
+    def get_total_sections(self):
+        """
+        :return: (int) amount of sections registered in the buffer (ie hit during the period)
+        """
+        return len(self.hits)
+
+    def get_popular_sections(self, n=None):
+        """
+        :param n: (int) amount of sections to return, all of them if None
+        :return: (deque): Ordered list of tuples representing the most commonly hit sections (section, amount of hits)
+        """
+        return deque(self.hits.most_common(n))
+
+    def get_statuses(self):
+        """
+        :return: (Counter): the Counter {status number: amount of hits)
+        """
+        return self.statuses
+
+    def get_status_classes(self):
+        """
+        :return: (Counter): the Counter {first digit of the status: amount of hits}, maintained incrementally
+        """
+        return self.status_classes
+
+    def get_total_success(self):
+        """
+        :return: (int) amount of successful hits
+        """
+        return self.status_classes["2"]
+
+    def get_total_users(self):
+        """
+        :return: (int) amount of users registered in the buffer (ie that sent at least one request during the period)
+        """
+        return len(self.host_traffic)
+
+    def get_user_traffic(self, n=None):
+        """
+        :param n: (int) amount of users to return, all of them if None
+        :return: (deque) Ordered list of tuples representing the users generating most trafic (user, traffic)
+        """
+        return deque(self.host_traffic.most_common(n))
+
+    def get_total_traffic(self):
+        """
+        :return: (int) Total amount of Bytes transferred during the period
+        """
+        return self.total_traffic
+
+    def snapshot(self):
+        """
+        :return: (WindowSnapshot) mergeable per-second counters of the entries of the buffer
+        """
+        return WindowSnapshot.from_entries(self)
+
+
+class _Bucket(object):
+    __slots__ = ("second", "hits", "traffic", "sections", "statuses", "host_hits", "host_traffic")
+
+    def __init__(self, second):
+        """
+        Counters of all the entries received during one second
+        :param second: (int) timestamp of the second aggregated in this bucket
+        """
+        self.second = second
+        self.hits = 0
+        self.traffic = 0
+        self.sections = Counter()
+        self.statuses = Counter()
+        self.host_hits = Counter()
+        self.host_traffic = Counter()
+
+
+def _subtract(window_counter, bucket_counter):
+    """
+    Remove the counts of a bucket from the window totals, dropping the keys that are no longer present
+    :param window_counter: (Counter) totals over the period
+    :param bucket_counter: (Counter) counts of the bucket being expired
+    """
+    for key, count in bucket_counter.items():
+        left = window_counter[key] - count
+        if left:
+            window_counter[key] = left
+        else:
+            window_counter.pop(key, None)
+
+
+class BucketedLogsBuffer:
+    def __init__(self, period=2):
+        """
+        Alternative to LogsBuffer that keeps per-second buckets of counters in a fixed ring instead of every entry.
+        Memory scales with period seconds x distinct keys instead of with the amount of requests, and a whole second
+        is expired at once.
+        :param period: (int) time frame of the buffer, in minutes
+        """
+        self.period = period*60
+        self.ring = [None] * (self.period + 1)
+        self.oldest_second = None
+        self.total_hits = 0
+        self.total_traffic = 0
+        self.hits = Counter()
+        self.statuses = Counter()
+        self.status_classes = Counter()
+        self.host_hits = Counter()
+        self.host_traffic = Counter()
+
+    def _get_bucket(self, second):
+        """
+        :param second: (int) timestamp of the bucket
+        :return: (_Bucket) the bucket of that second, created if needed, or None if the second is already too old to
+                           fit in the ring
+        """
+        index = second % len(self.ring)
+        bucket = self.ring[index]
+        if bucket is not None and bucket.second != second:
+            if bucket.second > second:
+                return None
+            self._expire(index)
+            bucket = None
+        if bucket is None:
+            bucket = self.ring[index] = _Bucket(second)
+            if self.oldest_second is None or second < self.oldest_second:
+                self.oldest_second = second
+        return bucket
+
+    def _expire(self, index):
+        """
+        Remove the bucket at this index of the ring, and its counts from the period totals
+        :param index: (int) index of the bucket in the ring
+        """
+        bucket = self.ring[index]
+        self.ring[index] = None
+        self.total_hits -= bucket.hits
+        self.total_traffic -= bucket.traffic
+        _subtract(self.hits, bucket.sections)
+        _subtract(self.statuses, bucket.statuses)
+        for status, count in bucket.statuses.items():
+            self.status_classes[status[:1]] -= count
+        _subtract(self.host_hits, bucket.host_hits)
+        _subtract(self.host_traffic, bucket.host_traffic)
+
+    def add_entry(self, parsed_entry):
+        """
+        Add an entry to the bucket of its second
+        :param parsed_entry: (NamedTuple) containing the relevant information about a new entry
+                                          ParsedLine(section, status, host, utc_ts, traffic)
+        """
+        bucket = self._get_bucket(int(parsed_entry.utc_ts))
+        if bucket is None:
+            return
+        bucket.hits += 1
+        bucket.traffic += parsed_entry.traffic
+        bucket.sections[parsed_entry.section] += 1
+        bucket.statuses[parsed_entry.status] += 1
+        bucket.host_hits[parsed_entry.host] += 1
+        bucket.host_traffic[parsed_entry.host] += parsed_entry.traffic
+        self.total_hits += 1
+        self.total_traffic += parsed_entry.traffic
         self.hits[parsed_entry.section] += 1
         self.statuses[parsed_entry.status] += 1
+        self.status_classes[parsed_entry.status[:1]] += 1
+        self.host_hits[parsed_entry.host] += 1
         self.host_traffic[parsed_entry.host] += parsed_entry.traffic
 
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Merge counts pre-aggregated elsewhere (by a worker process for example) into the bucket of their second
+        :param second: (int) timestamp of the second the counts belong to
+        :param hits: (int) amount of entries counted
+        :param sections: (dict) {section: amount of hits}
+        :param statuses: (dict) {status: amount of hits}
+        :param host_hits: (dict) {host: amount of hits}
+        :param host_traffic: (dict) {host: amount of bytes}
+        """
+        bucket = self._get_bucket(second)
+        if bucket is None:
+            return
+        traffic = sum(host_traffic.values())
+        bucket.hits += hits
+        bucket.traffic += traffic
+        bucket.sections.update(sections)
+        bucket.statuses.update(statuses)
+        bucket.host_hits.update(host_hits)
+        bucket.host_traffic.update(host_traffic)
+        self.total_hits += hits
+        self.total_traffic += traffic
+        self.hits.update(sections)
+        self.statuses.update(statuses)
+        for status, count in statuses.items():
+            self.status_classes[status[:1]] += count
+        self.host_hits.update(host_hits)
+        self.host_traffic.update(host_traffic)
+
     def clean_old_entries(self, now):
         """
-        Remove all entries that are older than the period from the buffer
+        Remove all the buckets of seconds that are older than the period
         :param now: (float) now timestamp
         """
-        while len(self) != 0 and self[0].utc_ts < now - self.period:
-            oldest = self.popleft()
-            self.hits[oldest.section] -= 1
-            self.statuses[oldest.status] -= 1
-            self.host_traffic[oldest.host] -= oldest.traffic
+        if self.oldest_second is None:
+            return
+        limit = int(math.ceil(now - self.period))
+        if limit - self.oldest_second >= len(self.ring):
+            seconds = range(len(self.ring))
+        else:
+            seconds = range(self.oldest_second, limit)
+        for second in seconds:
+            index = second % len(self.ring)
+            bucket = self.ring[index]
+            if bucket is not None and bucket.second < limit:
+                self._expire(index)
+        if self.total_hits == 0:
+            self.oldest_second = None
+        else:
+            self.oldest_second = max(self.oldest_second, limit)
 
     def get_total_hits(self):
         """
         :return: (int) the number of hits in the buffer (ie during the period)
         """
-        return len(self)
+        return self.total_hits
 
     def get_total_sections(self):
         """
@@ -47,11 +412,12 @@ class LogsBuffer(deque):
         """
         return len(self.hits)
 
-    def get_popular_sections(self):
+    def get_popular_sections(self, n=None):
         """
+        :param n: (int) amount of sections to return, all of them if None
         :return: (deque): Ordered list of tuples representing the most commonly hit sections (section, amount of hits)
         """
-        return deque(self.hits.most_common())
+        return deque(self.hits.most_common(n))
 
     def get_statuses(self):
         """
@@ -59,26 +425,513 @@ class LogsBuffer(deque):
         """
         return self.statuses
 
+    def get_status_classes(self):
+        """
+        :return: (Counter): the Counter {first digit of the status: amount of hits}, maintained incrementally
+        """
+        return self.status_classes
+
     def get_total_success(self):
         """
         :return: (int) amount of successful hits
         """
-        return sum(v if k.startswith("2") else 0 for k, v in self.statuses.iteritems())
+        return self.status_classes["2"]
 
     def get_total_users(self):
         """
         :return: (int) amount of users registered in the buffer (ie that sent at least one request during the period)
         """
-        return len(self.host_traffic)
+        return len(self.host_hits)
+
+    def get_user_traffic(self, n=None):
+        """
+        :param n: (int) amount of users to return, all of them if None
+        :return: (deque) Ordered list of tuples representing the users generating most trafic (user, traffic)
+        """
+        return deque(self.host_traffic.most_common(n))
+
+    def get_total_traffic(self):
+        """
+        :return: (int) Total amount of Bytes transferred during the period
+        """
+        return self.total_traffic
+
+    def snapshot(self):
+        """
+        :return: (WindowSnapshot) mergeable copy of the buckets of the ring
+        """
+        return WindowSnapshot(dict((bucket.second, [bucket.hits, dict(bucket.sections), dict(bucket.statuses),
+                                                    dict(bucket.host_hits), dict(bucket.host_traffic)])
+                                   for bucket in self.ring if bucket is not None))
+
+
+class _SketchSlice(object):
+    __slots__ = ("start", "hits", "traffic", "statuses", "sections", "section_counts", "section_users",
+                 "host_traffic", "host_counts", "users")
+
+    def __init__(self, start, top_error, distinct_error):
+        """
+        Sketches of all the entries received during a slice of the period
+        :param start: (int) timestamp of the first second of the slice
+        :param top_error: (float) maximum over-estimation of the hits of a section or the traffic of a host, as a
+                                  fraction of the slice totals
+        :param distinct_error: (float) relative standard error on the amount of distinct sections and hosts
+        """
+        self.start = start
+        self.hits = 0
+        self.traffic = 0
+        self.statuses = Counter()
+        self.sections = SpaceSaving.from_error(top_error)
+        self.section_counts = CountMinSketch.from_error(top_error)
+        self.section_users = HyperLogLog.from_error(distinct_error)
+        self.host_traffic = SpaceSaving.from_error(top_error)
+        self.host_counts = CountMinSketch.from_error(top_error)
+        self.users = HyperLogLog.from_error(distinct_error)
+
+
+class SketchLogsBuffer:
+    def __init__(self, period=2, top_error=0.005, distinct_error=0.02, slice_seconds=5):
+        """
+        Alternative to LogsBuffer keeping bounded-memory approximations of the per section and per host statistics.
+        The period is cut in slices of slice_seconds, each with its own sketches, so that old data can be expired.
+        Total hits, statuses and traffic stay exact, but entries are expired a whole slice at a time.
+        :param period: (int) time frame of the buffer, in minutes
+        :param top_error: (float) maximum over-estimation of the hits of a section or the traffic of a host, as a
+                                  fraction of the period totals
+        :param distinct_error: (float) relative standard error on the amount of distinct sections and users
+        :param slice_seconds: (int) width of a slice of the period, in seconds
+        """
+        self.period = period*60
+        self.top_error = top_error
+        self.distinct_error = distinct_error
+        self.slice_seconds = slice_seconds
+        self.slices = deque()
+        self.total_hits = 0
+        self.total_traffic = 0
+        self.statuses = Counter()
+        self.status_classes = Counter()
+        self.hashes = {}
 
-    def get_user_traffic(self):
+    def _hash(self, key):
+        """
+        :param key: (str) section or host
+        :return: (int) 64 bits hash of the key, memoized in a bounded cache
         """
+        hashed = self.hashes.get(key)
+        if hashed is None:
+            if len(self.hashes) >= _MAX_CACHED_HASHES:
+                self.hashes.clear()
+            hashed = self.hashes[key] = hash64(key)
+        return hashed
+
+    def _get_slice(self, second):
+        """
+        :param second: (int) timestamp of an entry
+        :return: (_SketchSlice) the slice of this second, created if needed, or None if it is older than every slice
+        """
+        start = second - second % self.slice_seconds
+        if not self.slices or self.slices[-1].start < start:
+            self.slices.append(_SketchSlice(start, self.top_error, self.distinct_error))
+            return self.slices[-1]
+        for sketch_slice in reversed(self.slices):
+            if sketch_slice.start == start:
+                return sketch_slice
+        return None
+
+    def add_entry(self, parsed_entry):
+        """
+        Add an entry to the sketches of its slice
+        :param parsed_entry: (NamedTuple) containing the relevant information about a new entry
+                                          ParsedLine(section, status, host, utc_ts, traffic)
+        """
+        sketch_slice = self._get_slice(int(parsed_entry.utc_ts))
+        if sketch_slice is None:
+            return
+        section_hash, host_hash = self._hash(parsed_entry.section), self._hash(parsed_entry.host)
+        sketch_slice.hits += 1
+        sketch_slice.traffic += parsed_entry.traffic
+        sketch_slice.statuses[parsed_entry.status] += 1
+        sketch_slice.sections.add(parsed_entry.section)
+        sketch_slice.section_counts.add(section_hash)
+        sketch_slice.section_users.add(section_hash)
+        sketch_slice.host_traffic.add(parsed_entry.host, parsed_entry.traffic)
+        sketch_slice.host_counts.add(host_hash, parsed_entry.traffic)
+        sketch_slice.users.add(host_hash)
+        self.total_hits += 1
+        self.total_traffic += parsed_entry.traffic
+        self.statuses[parsed_entry.status] += 1
+        self.status_classes[parsed_entry.status[:1]] += 1
+
+    def clean_old_entries(self, now):
+        """
+        Remove all the slices that only contain entries older than the period
+        :param now: (float) now timestamp
+        """
+        while self.slices and self.slices[0].start + self.slice_seconds <= now - self.period:
+            oldest = self.slices.popleft()
+            self.total_hits -= oldest.hits
+            self.total_traffic -= oldest.traffic
+            _subtract(self.statuses, oldest.statuses)
+            for status, count in oldest.statuses.items():
+                self.status_classes[status[:1]] -= count
+
+    def _top(self, summary_name, counts_name, n):
+        """
+        Merge the summaries of every slice, and tighten their over-estimated counts with the Count-Min sketches
+        :param summary_name: (str) name of the SpaceSaving attribute of the slices
+        :param counts_name: (str) name of the CountMinSketch attribute of the slices
+        :param n: (int) amount of keys to return, all the tracked ones if None
+        :return: (deque) ordered tuples (key, estimated count)
+        """
+        merged = SpaceSaving.from_error(self.top_error)
+        for sketch_slice in self.slices:
+            merged.merge(getattr(sketch_slice, summary_name))
+        refined = []
+        for key, count in merged.counts.items():
+            hashed = self._hash(key)
+            estimate = sum(getattr(sketch_slice, counts_name).estimate(hashed) for sketch_slice in self.slices)
+            refined.append((key, int(min(count, estimate))))
+        refined.sort(key=lambda item: item[1], reverse=True)
+        return deque(refined if n is None else refined[:n])
+
+    def _distinct(self, sketch_name):
+        """
+        :param sketch_name: (str) name of the HyperLogLog attribute of the slices
+        :return: (int) estimated amount of distinct keys over the period
+        """
+        merged = HyperLogLog.from_error(self.distinct_error)
+        for sketch_slice in self.slices:
+            merged.merge(getattr(sketch_slice, sketch_name))
+        return merged.count()
+
+    def get_total_hits(self):
+        """
+        :return: (int) the number of hits in the buffer (ie during the period)
+        """
+        return self.total_hits
+
+    def get_total_sections(self):
+        """
+        :return: (int) estimated amount of sections registered in the buffer (ie hit during the period)
+        """
+        return self._distinct("section_users")
+
+    def get_popular_sections(self, n=None):
+        """
+        :param n: (int) amount of sections to return, all the tracked ones if None
+        :return: (deque): Ordered list of tuples representing the most commonly hit sections (section, amount of hits)
+        """
+        return self._top("sections", "section_counts", n)
+
+    def get_statuses(self):
+        """
+        :return: (Counter): the Counter {status number: amount of hits)
+        """
+        return self.statuses
+
+    def get_status_classes(self):
+        """
+        :return: (Counter): the Counter {first digit of the status: amount of hits}, maintained incrementally
+        """
+        return self.status_classes
+
+    def get_total_success(self):
+        """
+        :return: (int) amount of successful hits
+        """
+        return self.status_classes["2"]
+
+    def get_total_users(self):
+        """
+        :return: (int) estimated amount of users registered in the buffer (ie that sent at least one request during
+                       the period)
+        """
+        return self._distinct("users")
+
+    def get_user_traffic(self, n=None):
+        """
+        :param n: (int) amount of users to return, all the tracked ones if None
         :return: (deque) Ordered list of tuples representing the users generating most trafic (user, traffic)
         """
-        return deque(self.host_traffic.most_common())
+        return self._top("host_traffic", "host_counts", n)
 
     def get_total_traffic(self):
         """
         :return: (int) Total amount of Bytes transferred during the period
         """
-        return sum(self.host_traffic.values())
+        return self.total_traffic
+
+
+class FanoutBuffer:
+    def __init__(self, monitor_buffer, *consumers):
+        """
+        Feed other consumers of the entries (a RuleEngine for example) next to the monitor buffer, whose statistics
+        are served by this object
+        :param monitor_buffer: (LogsBuffer or alike) buffer serving the statistics
+        :param consumers: objects with add_entry, add_counts and clean_old_entries methods
+        """
+        self.monitor_buffer = monitor_buffer
+        self.buffers = (monitor_buffer,) + consumers
+
+    def add_entry(self, parsed_entry):
+        for monitor_buffer in self.buffers:
+            monitor_buffer.add_entry(parsed_entry)
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        for monitor_buffer in self.buffers:
+            monitor_buffer.add_counts(second, hits, sections, statuses, host_hits, host_traffic)
+
+    def clean_old_entries(self, now):
+        for monitor_buffer in self.buffers:
+            monitor_buffer.clean_old_entries(now)
+
+    def __getattr__(self, name):
+        return getattr(self.monitor_buffer, name)
+
+
+class PercentileBuffer:
+    def __init__(self, period=2, relative_accuracy=0.01, max_sections=_MAX_PERCENTILE_SECTIONS):
+        """
+        Quantiles of the response sizes and times of every section during the period, fed next to the monitor buffer
+        Every second has one DDSketch per section, which is merged into the sketches of the period when the entries
+        arrive and removed from them when the second leaves the period. The amount of sections is bounded by
+        max_sections (the next ones are counted together as _OTHER_SECTIONS) and every sketch has a bounded amount of
+        bins, so the memory used does not depend on the traffic.
+        :param period: (int) time frame of the buffer, in minutes
+        :param relative_accuracy: (float) maximum relative error of the quantiles
+        :param max_sections: (int) maximum amount of sections with sketches of their own
+        """
+        self.period = period*60
+        self.relative_accuracy = relative_accuracy
+        self.max_sections = max_sections
+        # {second: {section: (size sketch, response time sketch)}} and the heap of those seconds
+        self.second_sketches = {}
+        self.seconds = []
+        self.oldest = None
+        self.sections = {}
+
+    def _new_sketches(self):
+        return DDSketch(self.relative_accuracy), DDSketch(self.relative_accuracy)
+
+    def add_entry(self, parsed_entry):
+        """
+        :param parsed_entry: (NamedTuple) ParsedLine(section, status, host, utc_ts, traffic, response_time)
+        """
+        second = int(parsed_entry.utc_ts)
+        if self.oldest is not None and second < self.oldest:
+            return
+        section = parsed_entry.section
+        if section not in self.sections:
+            if len(self.sections) >= self.max_sections:
+                section = _OTHER_SECTIONS
+            if section not in self.sections:
+                self.sections[section] = self._new_sketches()
+        sketches = self.second_sketches.get(second)
+        if sketches is None:
+            sketches = self.second_sketches[second] = {}
+            heapq.heappush(self.seconds, second)
+        if section not in sketches:
+            sketches[section] = self._new_sketches()
+        for sketch in sketches[section][0], self.sections[section][0]:
+            sketch.add(parsed_entry.traffic)
+        if parsed_entry.response_time is not None:
+            for sketch in sketches[section][1], self.sections[section][1]:
+                sketch.add(parsed_entry.response_time)
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Pre-aggregated counts carry no response size or time: they are ignored
+        """
+
+    def clean_old_entries(self, now):
+        """
+        Remove the sketches of the seconds older than the period from the ones of the period
+        :param now: (float) now timestamp
+        """
+        self.oldest = int(math.ceil(now - self.period))
+        while self.seconds and self.seconds[0] < self.oldest:
+            for section, (sizes, times) in self.second_sketches.pop(heapq.heappop(self.seconds)).items():
+                section_sizes, section_times = self.sections[section]
+                section_sizes.merge(sizes, -1)
+                section_times.merge(times, -1)
+                if not section_sizes.count:
+                    del self.sections[section]
+
+    def get_percentiles(self, n=None, quantiles=_QUANTILES):
+        """
+        :param n: (int) amount of sections to return, all of them if None
+        :param quantiles: (tuple) quantiles to estimate, between 0 and 1
+        :return: (list) tuples (section, hits, size quantiles, response time quantiles or None if no entry of the
+                        section had one), most commonly hit sections first
+        """
+        ordered = sorted(self.sections.items(), key=lambda item: item[1][0].count, reverse=True)
+        return [_percentiles(section, sizes, times, quantiles)
+                for section, (sizes, times) in (ordered if n is None else ordered[:n])]
+
+    def get_total_percentiles(self, quantiles=_QUANTILES):
+        """
+        :param quantiles: (tuple) quantiles to estimate, between 0 and 1
+        :return: (tuple) (None, hits, size quantiles, response time quantiles) of every section of the period
+        """
+        sizes, times = self._new_sketches()
+        for section_sizes, section_times in self.sections.values():
+            sizes.merge(section_sizes)
+            times.merge(section_times)
+        return _percentiles(None, sizes, times, quantiles)
+
+
+def _percentiles(section, sizes, times, quantiles):
+    """
+    :return: (tuple) (section, hits, size quantiles, response time quantiles or None if times is empty)
+    """
+    return (section, sizes.count, tuple(sizes.quantile(q) for q in quantiles),
+            tuple(times.quantile(q) for q in quantiles) if times.count else None)
+
+
+class _PathNode(object):
+    __slots__ = ("name", "parent", "children", "hits", "traffic")
+
+    def __init__(self, name, parent):
+        """
+        Prefix of the paths in a PathTreeBuffer
+        :param name: (str) last segment of the prefix, _OTHER_PATHS for the children collapsed together
+        :param parent: (_PathNode) node of the prefix without its last segment, None for the root
+        """
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.hits = 0
+        self.traffic = 0
+
+
+class PathTreeBuffer:
+    def __init__(self, period=2, depth=_PATH_TREE_DEPTH, max_children=_MAX_PATH_CHILDREN, max_nodes=_MAX_PATH_NODES):
+        """
+        Hits and bytes of every prefix of the paths during the period, fed next to the monitor buffer
+        The paths are split on their slashes into a tree whose first level is the sections: an entry is added to the
+        nodes of its first depth segments, and every second keeps the counts of the deepest nodes it reached, which are
+        subtracted along their way up to the root when the second leaves the period. So adding and expiring an entry
+        cost O(depth), and a node is removed once it has no hit left.
+        A node has at most max_children children, the next ones being counted together as _OTHER_PATHS, which has no
+        children of its own. The tree has at most max_nodes nodes: once it is full, the new prefixes are counted as
+        _OTHER_PATHS if their parent already has such a child, and only in their parent otherwise.
+        :param period: (int) time frame of the buffer, in minutes
+        :param depth: (int) amount of segments of the paths counted, 1 only counting the sections
+        :param max_children: (int) maximum amount of children of a node, _OTHER_PATHS included
+        :param max_nodes: (int) maximum amount of nodes of the tree
+        """
+        self.period = period*60
+        self.depth = depth
+        self.max_children = max_children
+        self.max_nodes = max_nodes
+        self.root = _PathNode(None, None)
+        self.nodes = 1
+        # {second: {deepest node: [hits, traffic]}} and the heap of those seconds
+        self.second_counts = {}
+        self.seconds = []
+        self.oldest = None
+
+    def _child(self, node, name):
+        """
+        :param node: (_PathNode) node to descend from
+        :param name: (str) segment of the path under the node
+        :return: (_PathNode) child of the node for the segment, created or collapsed into _OTHER_PATHS if need be, None
+                             if the tree is full and the node has no _OTHER_PATHS child
+        """
+        child = node.children.get(name)
+        if child is None:
+            full = self.nodes >= self.max_nodes
+            if full or len(node.children) >= self.max_children - 1:
+                name = _OTHER_PATHS
+                child = node.children.get(name)
+            if child is None and not full:
+                child = node.children[name] = _PathNode(name, node)
+                self.nodes += 1
+        return child
+
+    def add_entry(self, parsed_entry):
+        """
+        :param parsed_entry: (NamedTuple) ParsedLine(section, status, host, utc_ts, traffic, response_time, path)
+        """
+        second = int(parsed_entry.utc_ts)
+        if self.oldest is not None and second < self.oldest:
+            return
+        path = parsed_entry.path
+        if path is None:
+            segments = (parsed_entry.section,)
+        else:
+            segments = path.split("?", 1)[0].split("/", self.depth + 1)[1:self.depth + 1]
+            # A trailing slash does not make a deeper prefix
+            while len(segments) > 1 and not segments[-1]:
+                segments.pop()
+        traffic = parsed_entry.traffic
+        node = self.root
+        node.hits += 1
+        node.traffic += traffic
+        for segment in segments:
+            child = self._child(node, segment)
+            if child is None:
+                break
+            node = child
+            node.hits += 1
+            node.traffic += traffic
+            if node.name is _OTHER_PATHS:
+                break
+        counts = self.second_counts.get(second)
+        if counts is None:
+            counts = self.second_counts[second] = {}
+            heapq.heappush(self.seconds, second)
+        node_counts = counts.get(node)
+        if node_counts is None:
+            counts[node] = [1, traffic]
+        else:
+            node_counts[0] += 1
+            node_counts[1] += traffic
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Pre-aggregated counts carry no path: they are ignored
+        """
+
+    def clean_old_entries(self, now):
+        """
+        Subtract the counts of the seconds older than the period from the nodes, removing the nodes left without hits
+        :param now: (float) now timestamp
+        """
+        self.oldest = int(math.ceil(now - self.period))
+        while self.seconds and self.seconds[0] < self.oldest:
+            for node, (hits, traffic) in self.second_counts.pop(heapq.heappop(self.seconds)).items():
+                while node is not None:
+                    node.hits -= hits
+                    node.traffic -= traffic
+                    if not node.hits and node.parent is not None:
+                        del node.parent.children[node.name]
+                        self.nodes -= 1
+                    node = node.parent
+
+    def get_total_hits(self):
+        """
+        :return: (int) hits counted in the tree
+        """
+        return self.root.hits
+
+    def get_subtrees(self, sections=None, n=None):
+        """
+        :param sections: (int) amount of sections to return, all of them if None
+        :param n: (int) amount of children returned under every node, all of them if None
+        :return: (list) the most popular sections first, as tuples (segment, hits, traffic, children), children
+                        being a list of such tuples, the most popular ones first
+        """
+        return _subtrees(self.root, sections, n)
+
+
+def _subtrees(node, limit, n):
+    """
+    :param node: (_PathNode) node whose children to return
+    :param limit: (int) amount of children to return, all of them if None
+    :param n: (int) amount of children returned under every child, all of them if None
+    :return: (list) tuples (segment, hits, traffic, children), as PathTreeBuffer.get_subtrees
+    """
+    ordered = sorted(node.children.values(), key=lambda child: child.hits, reverse=True)
+    return [(child.name, child.hits, child.traffic, _subtrees(child, n, n))
+            for child in (ordered if limit is None else ordered[:limit])]
@@ -0,0 +1,289 @@
+"""
+Bulk ingestion of existing logs (a multi-GB backlog, compressed archives), as fast as the disks and the cores allow
+    - plain files are memory-mapped and split into line-aligned chunks, parsed in parallel by a pool of processes
+    - .gz and .zst archives are streamed through their decompressor with large reads, and their lines are parsed by
+      the pool batch by batch
+Every chunk is pre-aggregated per second by the process that parsed it, keeping only the seconds that may still be
+part of the period of the buffer, and the per-second counts are merged in order into the buffer.
+Run it from the Console_Monitor directory to get the statistics of the last period of some logs and the ingestion
+throughput, for example: python Bulk.py access.log access.log.1.gz -w 4 -f combined
+"""
+
+import argparse
+import gzip
+import io
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+from Buffer import BucketedLogsBuffer
+from DisplayHelper import get_formatted_stats, format_IS
+from LogFormat import DEFAULT_FORMAT, get_parser
+from Pipeline import ParallelAggregator, aggregate_batch
+from Snapshot import aggregate_entries
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Size of the chunks of a plain file parsed by a process at once
+_CHUNK_SIZE = 32 << 20
+# Size of the reads of the decompressed stream of an archive
+_STREAM_READ_SIZE = 4 << 20
+_THROUGHPUT_TEMPLATE = "%s: %sB in %.2fs (%.3f GB/s), %d lines, %d malformed"
+
+
+def chunk_offsets(path, chunk_size=_CHUNK_SIZE, end=None):
+    """
+    Split a plain file into chunks ending on line boundaries
+    :param path: (str) path of the file
+    :param chunk_size: (int) approximate size of the chunks, in bytes
+    :param end: (int) offset at which to stop, the end of the file if None (the last line may then be incomplete)
+    :return: (list) tuples (start, end) of the chunks, covering the file up to end without overlap
+    """
+    size = os.path.getsize(path) if end is None else end
+    if not size:
+        return []
+    offsets = []
+    with open(path, 'rb') as log_file:
+        mapped = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                newline = mapped.find(b"\n", min(start + chunk_size, size) - 1, size)
+                stop = size if newline == -1 else newline + 1
+                offsets.append((start, stop))
+                start = stop
+        finally:
+            mapped.close()
+    return offsets
+
+
+def complete_size(path):
+    """
+    :param path: (str) path of a plain file being written
+    :return: (int) offset following its last complete line
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return 0
+    with open(path, 'rb') as log_file:
+        mapped = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return mapped.rfind(b"\n", 0, size) + 1
+        finally:
+            mapped.close()
+
+
+def _aggregate_lines(lines, log_format, period):
+    """
+    :param lines: (list) log lines
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :param period: (int) time frame of the buffer, in seconds: older seconds than the newest one minus period are
+                   dropped, since they cannot be part of the period of the buffer once it received this chunk
+    :return: (tuple) (malformed, partials) as returned by Pipeline.aggregate_batch
+    """
+    parsed_lines = get_parser(log_format)(lines)
+    if not parsed_lines:
+        return len(lines), []
+    oldest = int(max(entry.utc_ts for entry in parsed_lines)) - period
+    seconds = aggregate_entries(entry for entry in parsed_lines if entry.utc_ts >= oldest)
+    return len(lines) - len(parsed_lines), [(second,) + tuple(counts) for second, counts in sorted(seconds.items())]
+
+
+def aggregate_chunk(task):
+    """
+    Parse and pre-aggregate a chunk of a plain file (run in the worker processes)
+    :param task: (tuple) (path, start, end, log_format, period), see chunk_offsets and _aggregate_lines
+    :return: (tuple) (nb_lines, malformed, partials)
+    """
+    path, start, end, log_format, period = task
+    with open(path, 'rb') as log_file:
+        mapped = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data = mapped[start:end]
+        finally:
+            mapped.close()
+    lines = data.decode("utf-8", "replace").rstrip("\n").split("\n")
+    malformed, partials = _aggregate_lines(lines, log_format, period)
+    return len(lines), malformed, partials
+
+
+def open_archive(path):
+    """
+    :param path: (str) path to a .gz or .zst archive
+    :return: (file) binary stream of the decompressed content
+    :raise ImportError: for a .zst archive if the zstandard module is not installed
+    """
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("the zstandard module is needed to read %s" % path)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_size=_STREAM_READ_SIZE,
+                                                          closefd=True)
+    return io.BufferedReader(gzip.open(path, 'rb'), _STREAM_READ_SIZE)
+
+
+def stream_batches(binary_file, read_size=_STREAM_READ_SIZE):
+    """
+    :param binary_file: (file) binary stream of log lines
+    :param read_size: (int) amount of bytes read at once
+    :return: (generator) tuples (nb_bytes, lines) of the complete lines of every read
+    """
+    pending = b""
+    while True:
+        data = binary_file.read(read_size)
+        if not data:
+            break
+        last_newline = data.rfind(b"\n")
+        if last_newline == -1:
+            pending += data
+            continue
+        block = pending + data[:last_newline]
+        pending = data[last_newline + 1:]
+        yield len(block) + 1, block.decode("utf-8", "replace").split("\n")
+    if pending:
+        yield len(pending), [pending.decode("utf-8", "replace")]
+
+
+class BulkStats:
+    def __init__(self, path):
+        """
+        Throughput of the ingestion of a file
+        :param path: (str) path of the file
+        """
+        self.path = path
+        self.nb_bytes = 0
+        self.nb_lines = 0
+        self.malformed = 0
+        self.newest = None
+        self.started = time.time()
+        self.elapsed = 0.
+
+    def gigabytes_per_second(self):
+        """
+        :return: (float) throughput, in GB (of decompressed logs) per second
+        """
+        return self.nb_bytes / 1e9 / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        return _THROUGHPUT_TEMPLATE % (self.path, format_IS(self.nb_bytes), self.elapsed,
+                                       self.gigabytes_per_second(), self.nb_lines, self.malformed)
+
+
+def _merge(monitor_buffer, malformed, partials, stats):
+    """
+    :param monitor_buffer: (BucketedLogsBuffer or alike) buffer receiving the counts
+    :param malformed: (int) amount of lines of the chunk that could not be parsed
+    :param partials: (list) per-second counts ordered by second, as returned by _aggregate_lines
+    :param stats: (BulkStats) statistics of the file the chunk belongs to
+    """
+    stats.malformed += malformed
+    for partial in partials:
+        monitor_buffer.add_counts(*partial)
+    if partials:
+        stats.newest = max(stats.newest, partials[-1][0]) if stats.newest is not None else partials[-1][0]
+        monitor_buffer.clean_old_entries(stats.newest)
+
+
+def bulk_ingest(paths, monitor_buffer, workers=1, log_format=None, end=None, chunk_size=_CHUNK_SIZE):
+    """
+    Ingest existing log files into the buffer, in the order of the paths
+    :param paths: (list) paths of plain log files, or of .gz/.zst archives, in chronological order
+    :param monitor_buffer: (BucketedLogsBuffer or alike) buffer receiving the counts, only its period is kept
+    :param workers: (int) amount of processes parsing the lines
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :param end: (int) offset at which to stop reading a plain file, its current size if None
+    :param chunk_size: (int) approximate size of the chunks of a plain file parsed by a process at once
+    :return: (generator) BulkStats of every file, once it is ingested
+    """
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        for path in paths:
+            stats = BulkStats(path)
+            if path.endswith(".gz") or path.endswith(".zst"):
+                _ingest_archive(path, monitor_buffer, workers, log_format, stats)
+            else:
+                tasks = [(path, start, stop, log_format, monitor_buffer.period)
+                         for start, stop in chunk_offsets(path, chunk_size, end)]
+                stats.nb_bytes = tasks[-1][2] if tasks else 0
+                for nb_lines, malformed, partials in (pool.imap(aggregate_chunk, tasks) if pool is not None
+                                                      else map(aggregate_chunk, tasks)):
+                    stats.nb_lines += nb_lines
+                    _merge(monitor_buffer, malformed, partials, stats)
+            stats.elapsed = time.time() - stats.started
+            yield stats
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _ingest_archive(path, monitor_buffer, workers, log_format, stats):
+    """
+    Stream an archive through its decompressor, the batches of lines being parsed by a ParallelAggregator
+    """
+    aggregator = ParallelAggregator(workers, log_format=log_format) if workers > 1 else None
+    try:
+        with open_archive(path) as archive:
+            for nb_bytes, lines in stream_batches(archive):
+                stats.nb_bytes += nb_bytes
+                stats.nb_lines += len(lines)
+                if aggregator is None:
+                    results = [(None,) + aggregate_batch(lines, log_format)]
+                else:
+                    results = aggregator.submit(lines, None)
+                for _, malformed, partials in results:
+                    _merge(monitor_buffer, malformed, partials, stats)
+            for _, malformed, partials in aggregator.collect(wait=True) if aggregator is not None else []:
+                _merge(monitor_buffer, malformed, partials, stats)
+    finally:
+        if aggregator is not None:
+            aggregator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest existing access logs in bulk, and display the statistics of "
+                                                 "their last period")
+    parser.add_argument("paths", nargs="+", metavar="FILE",
+                        help="Log files (plain, .gz or .zst), in chronological order")
+    parser.add_argument("-p", "--period", default=2, type=int,
+                        help="Time frame (int, in minutes) of the statistics")
+    parser.add_argument("-t", "--top", default=10, type=int,
+                        help="Maximum amount of sections and users displayed")
+    parser.add_argument("-w", "--workers", default=multiprocessing.cpu_count(), type=int,
+                        help="Amount of processes parsing the log lines")
+    parser.add_argument("-f", "--log-format", default=DEFAULT_FORMAT, type=str,
+                        help="Format of the log lines, as for Monitor.py")
+    parser.add_argument("--chunk-size", default=_CHUNK_SIZE >> 20, type=int,
+                        help="Size (in MB) of the chunks of a plain file parsed by a process at once")
+    args = parser.parse_args()
+    try:
+        get_parser(args.log_format)
+    except ValueError as error:
+        parser.error("invalid --log-format: %s" % error)
+
+    monitor_buffer = BucketedLogsBuffer(args.period)
+    started = time.time()
+    total = BulkStats("total")
+    for stats in bulk_ingest(args.paths, monitor_buffer, args.workers, args.log_format,
+                             chunk_size=args.chunk_size << 20):
+        print(stats)
+        total.nb_bytes += stats.nb_bytes
+        total.nb_lines += stats.nb_lines
+        total.malformed += stats.malformed
+        total.newest = max(total.newest, stats.newest) if total.newest is not None else stats.newest
+    total.elapsed = time.time() - started
+    print(total)
+    print(get_formatted_stats(datetime.fromtimestamp(total.newest or time.time()).strftime('%H:%M:%S'), "Bulk",
+                              monitor_buffer.get_total_hits(), monitor_buffer.get_total_sections(),
+                              monitor_buffer.get_popular_sections(args.top), monitor_buffer.get_status_classes(),
+                              monitor_buffer.get_total_success(), monitor_buffer.get_total_users(),
+                              monitor_buffer.get_user_traffic(args.top), monitor_buffer.get_total_traffic()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,12 +20,41 @@ _POPULAR_SECTION_TEMPLATE = "/%s is popular with %s/%s (%2d%%)"
 _STATUS_SUM_TEMPLATE = "%2d%% %s requests"
 _USER_TRAFFIC_TEMPLATE = "%2d%% of our traffic is with %s"
 _SUMMARY_TEMPLATE = "%s - %s Users - %s/%s successful hits - %sB of traffic"
+_SOURCES_TEMPLATE = """\
+                     SOURCES\n
+%s\n
+========================================================\n
+"""
+_SOURCE_TEMPLATE = "%2d%% of the hits from %s - %s/%s successful hits - %sB of traffic"
+_PERCENTILES_TEMPLATE = """\
+              RESPONSE PERCENTILES\n
+%s\n
+========================================================\n
+"""
+_PERCENTILE_ROW_TEMPLATE = "%-14s %8s  %-20s %s"
+_PATH_TREE_TEMPLATE = """\
+                  POPULAR PATHS\n
+%s\n
+========================================================\n
+"""
+_PATH_ROW_TEMPLATE = "%-40s %7s hits (%2d%%) %6sB"
+_DEGRADED_TEMPLATE = """\
+DEGRADED MODE: the ingestion lags %s behind the logs, 1 line out of %d is counted %d times and the per-user statistics
+are skipped until it catches up\n
+========================================================\n
+"""
+_DEGRADED_STATUS_TEMPLATE = "%s (DEGRADED)"
 
 _IS_SUFFIXES = {0: "", 1: "K", 2: "M", 3: "G", 4: "T", 5: "P"}
 
 _ALERT_TEMPLATE = "%s: The traffic exceeded the fixed Threshold with a value of %s out of %s.\n"
 _RECOVERY_TEMPLATE = "The traffic returned to a reasonable level. Alert lasted %s and peaked at %s out of %s.\n"
 _ALERT_MESSAGES = {0: _RECOVERY_TEMPLATE, 1: _ALERT_TEMPLATE}
+_RULE_ALERT_TEMPLATE = "%s: Rule '%s' exceeded its threshold with a value of %.4g out of %.4g.\n"
+_RULE_RECOVERY_TEMPLATE = "Rule '%s' returned to a reasonable level. Alert lasted %s and peaked at %.4g out of %.4g.\n"
+_ANOMALY_ALERT_TEMPLATE = "%s: Anomaly on %s: %d hits in a minute, %.1f standard deviations from the expected %.1f.\n"
+_ANOMALY_RECOVERY_TEMPLATE = "%s returned to its baseline. Anomaly lasted %s and peaked at %d hits in a minute (%.1f " \
+                             "standard deviations).\n"
 
 _STATUS_OK_TEMPLATE = "Low Traffic"
 _STATUS_HIGH_TEMPLATE = "HIGH TRAFFIC"
@@ -50,6 +79,8 @@ def format_IS(bytes):
     :param bytes: (int) The int to be represented
     :return: (str) representation of byte
     """
+    if bytes < 1:
+        return "0"
     magnitude = int(math.log(bytes, 10))
     group = int(magnitude / 3)
     return str(int(bytes / (10 ** (3 * group)))) + _IS_SUFFIXES[group]
@@ -62,21 +93,23 @@ def get_formatted_popular(popular_sections, total_hits, total_sections):
     :params: identical to ones described below in get_formatted_stats
     :return: (str generator) Strings describing the most popular sections
     """
+    if not total_hits:
+        return
     popularity_threshold = float(total_hits) / total_sections
-    while len(popular_sections) != 0 and popular_sections[0][1] >= popularity_threshold:
-        section = popular_sections.popleft()
+    for section in popular_sections:
+        if section[1] < popularity_threshold:
+            break
         yield _POPULAR_SECTION_TEMPLATE % (section[0], section[1],
                                            total_hits, (100. * section[1]) / total_hits)
 
 
-def get_formatted_statuses(statuses, total_hits):
+def get_formatted_statuses(status_classes, total_hits):
     """
     :params: identical to ones described below in get_formatted_stats
     :return: (str generator) Strings describing the statuses repartition
     """
-    for i in _HTTP_CODES_HEADERS:
-        status_total = sum(v if k.startswith(i) else 0 for k, v in statuses.iteritems())
-        yield _STATUS_SUM_TEMPLATE % (100. * status_total / total_hits, _HTTP_CODES_HEADERS[i])
+    for i in sorted(_HTTP_CODES_HEADERS):
+        yield _STATUS_SUM_TEMPLATE % (100. * status_classes.get(i, 0) / max(total_hits, 1), _HTTP_CODES_HEADERS[i])
 
 
 def get_formatted_user_traffic(intensive_users, total_traffic, total_users):
@@ -86,9 +119,13 @@ def get_formatted_user_traffic(intensive_users, total_traffic, total_users):
     :params: identical to ones described below in get_formatted_stats
     :return: (str generator) Strings describing the most intense users
     """
-    traffic_threshold = float(total_traffic) / total_users
-    while len(intensive_users) != 0 and intensive_users[0][1] >= traffic_threshold:
-        user = intensive_users.popleft()
+    if not total_traffic:
+        return
+    # Pre-aggregated counts may carry traffic without any user
+    traffic_threshold = float(total_traffic) / max(total_users, 1)
+    for user in intensive_users:
+        if user[1] < traffic_threshold:
+            break
         yield _USER_TRAFFIC_TEMPLATE % ((100. * user[1]) / total_traffic, user[0])
 
 
@@ -101,7 +138,7 @@ def get_formatted_summary(alert_status, total_users, total_success, total_hits,
     return _SUMMARY_TEMPLATE % (alert_status, total_users, total_success, total_hits, format_IS(total_traffic))
 
 
-def get_formatted_stats(readable_now, alert_status, total_hits, total_sections, popular_sections, statuses,
+def get_formatted_stats(readable_now, alert_status, total_hits, total_sections, popular_sections, status_classes,
                         total_success, total_users, intensive_users, total_traffic):
     """
 
@@ -110,10 +147,12 @@ def get_formatted_stats(readable_now, alert_status, total_hits, total_sections,
     :param total_hits: (int) the number of hits in the buffer (ie during the period)
     :param total_sections: (int) amount of sections registered in the buffer (ie hit during the period)
     :param popular_sections: (deque): Ordered list of tuples representing the most commonly hit sections (section, amount of hits)
-    :param statuses: (Counter): the Counter {status number: amount of hits)
+                                      Only the top sections that may be displayed are needed
+    :param status_classes: (Counter): the Counter {first digit of the status: amount of hits}
     :param total_success: (int) amount of successful hits
     :param total_users: (int) amount of users registered in the buffer (ie that sent at least one request during the period)
     :param intensive_users: (deque) Ordered list of tuples representing the users generating most trafic (user, traffic)
+                                    Only the top users that may be displayed are needed
     :param total_traffic: (int) Total amount of Bytes transferred during the period
     :return:
     """
@@ -123,7 +162,7 @@ def get_formatted_stats(readable_now, alert_status, total_hits, total_sections,
             "popular": "\n".join([section for section
                                   in get_formatted_popular(popular_sections, total_hits, total_sections)]),
             "status": "\n".join([status for status
-                                 in get_formatted_statuses(statuses, total_hits)]),
+                                 in get_formatted_statuses(status_classes, total_hits)]),
             "users": "\n".join([user for user
                                 in get_formatted_user_traffic(intensive_users, total_traffic, total_users)]),
             }
@@ -149,6 +188,37 @@ def format_alert_message(message_type, data):
     return _ALERT_MESSAGES[message_type] % data if message_type != 2 else ""
 
 
+def format_rule_message(rule_name, message_type, data):
+    """
+    Render as a string information about a new alert or recovery of a rule of the rule engine
+    :param rule_name: (str) name of the rule
+    :param message_type: (int) the type of message to display (0:recovery or 1:alert)
+    :param data: (tuple) Data required to format the message, as described in format_alert_message
+    :return: (str) message to display to inform of an alert or recovery
+    """
+    if message_type == 1:
+        return _RULE_ALERT_TEMPLATE % (data[0], rule_name, data[1], data[2])
+    if message_type == 0:
+        return _RULE_RECOVERY_TEMPLATE % ((rule_name,) + tuple(data))
+    return ""
+
+
+def format_anomaly_message(section, message_type, data):
+    """
+    Render as a string information about a new anomaly or recovery of an anomaly detector
+    :param section: (str) section watched by the detector, None for the whole traffic
+    :param message_type: (int) the type of message to display (0:recovery or 1:alert)
+    :param data: (tuple) Data required to format the message, as returned by AnomalyDetector.update
+    :return: (str) message to display to inform of an anomaly or recovery
+    """
+    label = "traffic" if section is None else "section /%s" % section
+    if message_type == 1:
+        return _ANOMALY_ALERT_TEMPLATE % (data[0], label, data[1], data[3], data[2])
+    if message_type == 0:
+        return _ANOMALY_RECOVERY_TEMPLATE % (label[0].upper() + label[1:], data[0], data[1], data[2])
+    return ""
+
+
 def format_alert_status(status):
     """
     Display a status message corresponding to the alert status level
@@ -156,3 +226,91 @@ def format_alert_status(status):
     :return: (str): "Low Traffic", "HIGH TRAFFIC" or "ALERT TRAFFIC"
     """
     return _ALERT_STATUSES[status]
+
+
+def get_formatted_sources(source_stats, total_hits):
+    """
+    Describe the share of every monitored log file in the traffic, busiest first
+    :param source_stats: (list) tuples (path, hits, successful hits, traffic), one per log file
+    :param total_hits: (int) the number of hits in the buffer (ie during the period), for all the files
+    :return: (str) the per-file breakdown, to display under the statistics
+    """
+    return _SOURCES_TEMPLATE % "\n".join(
+        _SOURCE_TEMPLATE % (100. * hits / max(total_hits, 1), path, success, hits, format_IS(traffic))
+        for path, hits, success, traffic in sorted(source_stats, key=lambda stats: stats[1], reverse=True))
+
+
+def format_duration(seconds):
+    """
+    :param seconds: (float) duration to represent, None if unknown
+    :return: (str) the duration in milliseconds under a second, in seconds above
+    """
+    if seconds is None:
+        return "-"
+    if seconds < 1:
+        return "%dms" % round(seconds * 1000)
+    return "%.1fs" % seconds
+
+
+def get_formatted_degraded(lag, sample_every):
+    """
+    Describe the degraded mode of the ingestion (see Pipeline.LoadShedder)
+    :param lag: (float) age of the newest line ingested, in seconds
+    :param sample_every: (int) 1 line out of sample_every is ingested
+    :return: (str) the warning, to display under the statistics
+    """
+    return _DEGRADED_TEMPLATE % (format_duration(lag), sample_every, sample_every)
+
+
+def format_degraded_status(alert_status):
+    """
+    :param alert_status: (str) alert status, as returned by format_alert_status
+    :return: (str) the alert status, flagged as computed in degraded mode
+    """
+    return _DEGRADED_STATUS_TEMPLATE % alert_status
+
+
+def _path_rows(subtrees, prefix, indent, total_hits):
+    """
+    :param subtrees: (list) tuples (segment, hits, traffic, children), as PathTreeBuffer.get_subtrees
+    :param prefix: (str) path of the parent of the subtrees
+    :param indent: (str) indentation of the subtrees
+    :param total_hits: (int) hits of the period
+    :return: (str generator) a row per node of the subtrees, every node followed by its children
+    """
+    for segment, hits, traffic, children in subtrees:
+        # The collapsed children are not a segment of the path
+        path = prefix + " " + segment if segment.startswith("(") else prefix + "/" + segment
+        yield _PATH_ROW_TEMPLATE % (indent + path, hits, 100. * hits / total_hits, format_IS(traffic))
+        for row in _path_rows(children, path, indent + "  ", total_hits):
+            yield row
+
+
+def get_formatted_path_tree(subtrees, total_hits):
+    """
+    Render the most popular prefixes of the paths under the most popular sections, indented by depth
+    :param subtrees: (list) tuples (segment, hits, traffic, children), as PathTreeBuffer.get_subtrees
+    :param total_hits: (int) hits of the period
+    :return: (str) the tree, to display under the statistics
+    """
+    return _PATH_TREE_TEMPLATE % "\n".join(_path_rows(subtrees, "", "", total_hits) if total_hits else [])
+
+
+def get_formatted_percentiles(total_percentiles, section_percentiles, quantiles=(.5, .95, .99)):
+    """
+    Render the table of the quantiles of the response sizes and times, for all the sections and the busiest ones
+    :param total_percentiles: (tuple) (None, hits, size quantiles, time quantiles or None) of all the sections
+    :param section_percentiles: (list) tuples (section, hits, size quantiles, time quantiles or None)
+    :param quantiles: (tuple) the quantiles estimated, between 0 and 1
+    :return: (str) the table, to display under the statistics
+    """
+    labels = "/".join("p%g" % (100 * q) for q in quantiles)
+    rows = [_PERCENTILE_ROW_TEMPLATE % ("section", "hits", "size " + labels, "time " + labels)]
+    for section, hits, sizes, times in [total_percentiles] + list(section_percentiles):
+        if not hits:
+            continue
+        rows.append(_PERCENTILE_ROW_TEMPLATE % (
+            "(all)" if section is None else section if section.startswith("(") else "/" + section, hits,
+            "/".join(format_IS(size) + "B" for size in sizes),
+            "/".join(format_duration(duration) for duration in times) if times is not None else "-"))
+    return _PERCENTILES_TEMPLATE % "\n".join(rows)
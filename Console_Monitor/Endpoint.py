@@ -0,0 +1,188 @@
+"""
+Embedded HTTP endpoint exposing the statistics of the monitor to the dashboards scraping it
+    - /metrics: Prometheus text format
+    - /metrics.json: the same values, as JSON
+The bodies of both are rendered once per refresh tick, by the thread owning the buffer, into an immutable
+MetricsSnapshot: the threads of the server only ever send those bytes, so a scrape never locks nor iterates the live
+Counters, and its cost does not depend on the traffic.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from DisplayHelper import format_alert_status
+
+_PREFIX = "logmonitor_"
+_PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_JSON_CONTENT_TYPE = "application/json"
+_INVALID_NAME_CHARACTERS = re.compile(r'[^a-zA-Z0-9_]')
+# Window statistics: (name, help, key of the JSON window)
+_WINDOW_GAUGES = (("hits", "Hits during the period", "hits"),
+                  ("traffic_bytes", "Bytes transferred during the period", "traffic_bytes"),
+                  ("sections", "Sections hit during the period", "sections"),
+                  ("users", "Users that sent at least one request during the period", "users"),
+                  ("success_hits", "Successful hits during the period", "success_hits"))
+
+
+class MetricsSnapshot(object):
+    __slots__ = ("prometheus", "json", "time")
+
+    def __init__(self, prometheus, json_body, now):
+        """
+        Rendered bodies of the endpoint, never modified once built
+        :param prometheus: (bytes) body of /metrics
+        :param json_body: (bytes) body of /metrics.json
+        :param now: (float) timestamp at which the statistics were taken
+        """
+        self.prometheus = prometheus
+        self.json = json_body
+        self.time = now
+
+
+def _escape(value):
+    """
+    :param value: (str) value of a Prometheus label
+    :return: (str) the value, escaped to be written between double quotes
+    """
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _metric(lines, name, metric_type, help_text, samples):
+    """
+    Add a metric in the Prometheus text format
+    :param lines: (list) lines of the body
+    :param name: (str) name of the metric, without the prefix
+    :param metric_type: (str) gauge, counter or summary
+    :param help_text: (str) description of the metric
+    :param samples: (list) tuples (suffix, labels, value), labels being a string as 'section="api"' or ""
+    """
+    name = _PREFIX + _INVALID_NAME_CHARACTERS.sub("_", name)
+    lines.append("# HELP %s %s" % (name, help_text))
+    lines.append("# TYPE %s %s" % (name, metric_type))
+    for suffix, labels, value in samples:
+        lines.append("%s%s%s %s" % (name, suffix, "{%s}" % labels if labels else "", repr(float(value))))
+
+
+def build_snapshot(monitor_buffer, alert_warden, metrics, now, top=10):
+    """
+    Render the statistics of the period, the alert state and the self-metrics
+    Must be called from the thread updating the buffer and the metrics.
+    :param monitor_buffer: (LogsBuffer or alike) buffer of the period
+    :param alert_warden: (AlertWarden) warden giving the alert state
+    :param metrics: (SelfMetrics) self-metrics of the monitor
+    :param now: (float) now timestamp
+    :param top: (int) amount of sections and users exposed
+    :return: (MetricsSnapshot) the rendered bodies
+    """
+    status = alert_warden.status()
+    window = {"hits": monitor_buffer.get_total_hits(),
+              "traffic_bytes": monitor_buffer.get_total_traffic(),
+              "sections": monitor_buffer.get_total_sections(),
+              "users": monitor_buffer.get_total_users(),
+              "success_hits": monitor_buffer.get_total_success(),
+              "status_classes": dict(("%sxx" % status_class, hits) for status_class, hits
+                                     in sorted(monitor_buffer.get_status_classes().items()) if hits),
+              "top_sections": [[section, hits] for section, hits in monitor_buffer.get_popular_sections(top)],
+              "top_users": [[user, traffic] for user, traffic in monitor_buffer.get_user_traffic(top)]}
+    alert = {"status": status, "label": format_alert_status(status), "in_alert_since": alert_warden.in_alert_since,
+             "threshold": alert_warden.alert_threshold, "peak": alert_warden.hits_peak}
+    histograms = dict((name, {"count": histogram.count, "sum": histogram.total, "p50": histogram.percentile(.5),
+                              "p99": histogram.percentile(.99), "max": histogram.max})
+                      for name, histogram in metrics.histograms.items())
+    self_metrics = {"uptime_seconds": time.time() - metrics.started, "counters": dict(metrics.counters),
+                    "gauges": dict(metrics.gauges), "histograms": histograms}
+
+    lines = []
+    for name, help_text, key in _WINDOW_GAUGES:
+        _metric(lines, name, "gauge", help_text, [("", "", window[key])])
+    _metric(lines, "status_class_hits", "gauge", "Hits during the period per status class",
+            [("", 'class="%s"' % status_class, hits) for status_class, hits in window["status_classes"].items()])
+    _metric(lines, "section_hits", "gauge", "Hits during the period of the busiest sections",
+            [("", 'section="%s"' % _escape(section), hits) for section, hits in window["top_sections"]])
+    _metric(lines, "user_traffic_bytes", "gauge", "Bytes transferred during the period by the busiest users",
+            [("", 'user="%s"' % _escape(user), traffic) for user, traffic in window["top_users"]])
+    _metric(lines, "alert_status", "gauge", "Alert state: 0 low traffic, 1 high traffic, 2 alert",
+            [("", "", status)])
+    _metric(lines, "alert_threshold_hits", "gauge", "Hits during the period triggering the alert",
+            [("", "", alert["threshold"])])
+    _metric(lines, "self_uptime_seconds", "gauge", "Time since the monitor started",
+            [("", "", self_metrics["uptime_seconds"])])
+    for name, value in sorted(metrics.counters.items()):
+        _metric(lines, "self_%s_total" % name, "counter", "Self-metric %s" % name, [("", "", value)])
+    for name, value in sorted(metrics.gauges.items()):
+        _metric(lines, "self_%s" % name, "gauge", "Self-metric %s" % name, [("", "", value)])
+    for name, histogram in sorted(histograms.items()):
+        _metric(lines, "self_%s" % name, "summary", "Self-metric %s" % name,
+                [("", 'quantile="0.5"', histogram["p50"]), ("", 'quantile="0.99"', histogram["p99"]),
+                 ("_sum", "", histogram["sum"]), ("_count", "", histogram["count"])])
+    prometheus = ("\n".join(lines) + "\n").encode("utf-8")
+    json_body = json.dumps({"time": now, "period_seconds": monitor_buffer.period, "window": window,
+                            "alert": alert, "self": self_metrics}, sort_keys=True).encode("utf-8")
+    return MetricsSnapshot(prometheus, json_body, now)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive connections, without waiting for the ACK of the headers before sending the body
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        snapshot = self.server.snapshot
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            self._send(200, _PROMETHEUS_CONTENT_TYPE, snapshot.prometheus)
+        elif path == "/metrics.json":
+            self._send(200, _JSON_CONTENT_TYPE, snapshot.json)
+        else:
+            self._send(404, "text/plain", b"not found, try /metrics or /metrics.json\n")
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        Scrapes are not logged: hundreds per second would drown the console
+        """
+
+
+class MetricsServer:
+    def __init__(self, host, port):
+        """
+        HTTP server of the MetricsSnapshot, run by a daemon thread (and a thread per connection)
+        :param host: (str) address to listen on
+        :param port: (int) port to listen on, 0 for any free port
+        """
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.snapshot = MetricsSnapshot(b"", b"{}", None)
+        self.thread = None
+
+    @property
+    def port(self):
+        """
+        :return: (int) the port the server listens on
+        """
+        return self.server.server_address[1]
+
+    def publish(self, snapshot):
+        """
+        Serve a new snapshot: replacing the reference is atomic, the scrapes in progress finish with the previous one
+        :param snapshot: (MetricsSnapshot) snapshot to serve
+        """
+        self.server.snapshot = snapshot
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics_server", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
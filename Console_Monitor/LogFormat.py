@@ -0,0 +1,189 @@
+"""
+Compiler of log formats, described with the directives of Apache's LogFormat (also used by nginx's combined format)
+Every format is compiled once, at startup, into the source code of a parser dedicated to it: the lines are cut on the
+literal delimiters of the format with str.find, and only the directives the statistics need are sliced and converted.
+    - %h or %a: remote host
+    - %t: date, as [10/Oct/2000:13:55:36 -0700]
+    - %r: request line, the section being the first segment of its path
+    - %>s or %s: status
+    - %b or %B: bytes transferred, "-" meaning 0
+    - %D or %T: response time, in microseconds or seconds
+    - any other directive (%l, %u, %{Referer}i...) is skipped
+The "default" format is the one of Parser.py, parsed by its hand-written parser.
+"""
+
+import re
+import time
+from Parser import _ParsedLine, _LOCAL_TIME_OFFSET, _MAX_CACHED_DATES, parse_lines
+
+DEFAULT_FORMAT = "default"
+FORMATS = {"common": '%h %l %u %t "%r" %>s %b',
+           "combined": '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-Agent}i"'}
+
+_DIRECTIVE_PATTERN = re.compile(r'%(?:\{[^}]*\})?[<>]?[a-zA-Z%]')
+# Directive: (field extracted, conversion generated at the end of the parser, where the field is a local variable)
+_DIRECTIVES = {"h": ("host", ()), "a": ("host", ()),
+               "t": ("utc_ts", ("epoch = _cached_dates(utc_ts)",
+                                "if epoch is None: epoch = _to_epoch(utc_ts)",
+                                "if epoch is None: continue",
+                                "utc_ts = epoch")),
+               "r": ("section", ("match = _match_section(section)",
+                                 "if match is None: continue",
+                                 "section, path = match.group(2, 1)")),
+               "s": ("status", ("if not status.isdigit(): continue",)),
+               "b": ("traffic", ("if traffic.isdigit(): traffic = int(traffic)",
+                                 "elif traffic == '-': traffic = 0",
+                                 "else: continue")),
+               "B": ("traffic", ("if not traffic.isdigit(): continue",
+                                 "traffic = int(traffic)")),
+               "D": ("response_time", ("response_time = int(response_time) / 1e6 "
+                                       "if response_time.isdigit() else None",)),
+               "T": ("response_time", ("response_time = float(response_time) "
+                                       "if response_time.replace('.', '', 1).isdigit() else None",))}
+# Request line: the section is the first segment of the path, up to its query string
+_SECTION_PATTERN = re.compile(r'[^ ]+ (/([^/?\s]*)\S*)')
+_DEFAULTS = {"host": "'-'", "traffic": "0", "response_time": "None"}
+_REQUIRED_FIELDS = ("utc_ts", "section", "status")
+_MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10,
+           "Nov": 11, "Dec": 12}
+
+_dates_cache = {}
+_parsers = {}
+
+
+def _to_epoch(date):
+    """
+    :param date: (str) date of a log line, 10/Oct/2000:13:55:36 -0700 (without its brackets)
+    :return: (float) the date as a UTC timestamp, computed like Parser._date_to_epoch (memoized)
+    :raise (KeyError, ValueError): if the date is malformed
+    """
+    epoch = _dates_cache.get(date)
+    if epoch is None:
+        if len(date) != 26 or date[2] != "/" or date[6] != "/" or date[11] != ":" or date[20] != " ":
+            raise ValueError("malformed date %s" % date)
+        if len(_dates_cache) >= _MAX_CACHED_DATES:
+            _dates_cache.clear()
+        offset = (int(date[22:24]) * 3600 + int(date[24:26]) * 60) * (-1 if date[21] == "-" else 1)
+        local = time.mktime((int(date[7:11]), _MONTHS[date[3:6]], int(date[:2]), int(date[12:14]), int(date[15:17]),
+                             int(date[18:20]), 0, 0, -1))
+        epoch = _dates_cache[date] = local + _LOCAL_TIME_OFFSET - offset
+    return epoch
+
+
+def _tokenize(log_format):
+    """
+    :param log_format: (str) format string, as '%h %l %u %t "%r" %>s %b'
+    :return: (list) alternating literal delimiters and directives (their letter, unless they have a parameter),
+                    starting and ending with a literal
+    :raise ValueError: if two directives are not separated by a literal
+    """
+    tokens, literal, position = [], "", 0
+    for match in _DIRECTIVE_PATTERN.finditer(log_format):
+        literal += log_format[position:match.start()]
+        position = match.end()
+        # Directives with a {parameter} change the meaning of the letter, they are skipped
+        letter = match.group()[-1] if "{" not in match.group() else match.group()
+        if letter == "%":
+            literal += "%"
+            continue
+        if letter == "t":
+            # The date is written with its brackets, which are delimiters
+            literal += "["
+        if tokens and not literal:
+            raise ValueError("directives %s and %s must be separated by a delimiter" % (tokens[-1], match.group()))
+        tokens += [literal, letter]
+        literal = "]" if letter == "t" else ""
+    tokens.append(literal + log_format[position:])
+    return tokens
+
+
+def _generate(log_format):
+    """
+    :param log_format: (str) format string
+    :return: (str) source code of a function parse_lines(batch) dedicated to the format
+    :raise ValueError: if the format cannot be compiled
+    """
+    tokens = _tokenize(log_format)
+    fields = set(_DIRECTIVES[letter][0] for letter in tokens[1::2] if letter in _DIRECTIVES)
+    missing = [field for field in _REQUIRED_FIELDS if field not in fields]
+    if missing:
+        raise ValueError("the format %r has no %s directive" % (log_format, ", ".join(missing)))
+    lines = ["def parse_lines(batch):",
+             "    parsed_lines = []",
+             "    append = parsed_lines.append",
+             "    for line in batch:"]
+    if tokens[0]:
+        lines.append("        if not line.startswith(%r): continue" % tokens[0])
+    lines.append("        position = %d" % len(tokens[0]))
+    extracted = set()
+    # The directives after the last useful one are not even delimited
+    last = max(index for index in range(1, len(tokens), 2) if tokens[index] in _DIRECTIVES)
+    for index in range(1, last + 1, 2):
+        letter, delimiter = tokens[index], tokens[index + 1]
+        field = _DIRECTIVES[letter][0] if letter in _DIRECTIVES else None
+        if field in extracted:
+            field = None
+        if delimiter:
+            lines.append("        end = line.find(%r, position)" % delimiter)
+            lines.append("        if end < 0: continue")
+        else:
+            # The last directive ends with the line, or with the extra fields some servers append
+            lines.append("        end = line.find(' ', position)")
+            lines.append("        if end < 0: end = len(line)")
+        if field is not None:
+            extracted.add(field)
+            lines.append("        %s = line[position:end]" % field)
+        if index < last:
+            lines.append("        position = end + %d" % len(delimiter))
+    for letter in tokens[1::2]:
+        field, conversion = _DIRECTIVES.get(letter, (None, ()))
+        if field in extracted:
+            lines += ["        " + line for line in conversion]
+        extracted.discard(field)
+    lines += ["        append(_ParsedLine(section, status, %s, utc_ts, %s, %s, path))"
+              % tuple(field if field in fields else _DEFAULTS[field] for field in ("host", "traffic", "response_time")),
+              "    return parsed_lines"]
+    return "\n".join(lines) + "\n"
+
+
+def compile_format(log_format):
+    """
+    Generate the parser of a log format
+    :param log_format: (str) format string, as '%h %l %u %t "%r" %>s %b', or the name of a format of FORMATS
+    :return: (function) parse_lines(batch) returning the ParsedLine of the well formed lines of the batch, in order
+    :raise ValueError: if the format cannot be compiled
+    """
+    log_format = FORMATS.get(log_format, log_format)
+    source = _generate(log_format)
+    namespace = {"_ParsedLine": _ParsedLine, "_cached_dates": _dates_cache.get, "_to_epoch": _safe(_to_epoch),
+                 "_match_section": _SECTION_PATTERN.match}
+    exec(compile(source, "<log format %s>" % log_format, "exec"), namespace)
+    parse = namespace["parse_lines"]
+    parse.source = source
+    return parse
+
+
+def _safe(conversion):
+    """
+    :return: (function) the conversion, returning None instead of raising on malformed values
+    """
+    def convert(value):
+        try:
+            return conversion(value)
+        except (KeyError, ValueError, OverflowError):
+            return None
+    return convert
+
+
+def get_parser(log_format=None):
+    """
+    :param log_format: (str) format string or name of a format, None or DEFAULT_FORMAT for the one of Parser.py
+    :return: (function) parse_lines(batch) of the format, compiled once per process
+    :raise ValueError: if the format cannot be compiled
+    """
+    if log_format is None or log_format == DEFAULT_FORMAT:
+        return parse_lines
+    parse = _parsers.get(log_format)
+    if parse is None:
+        parse = _parsers[log_format] = compile_format(log_format)
+    return parse
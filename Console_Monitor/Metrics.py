@@ -0,0 +1,210 @@
+"""
+Self-metrics of the monitor: counters, gauges and histograms cheap enough to stay enabled in production, updated once
+per batch of lines rather than once per line.
+They are displayed in a footer under the statistics, and dumped on SIGUSR1.
+This module also provides the profilers enabled by the --profile option of the monitor.
+"""
+
+import cProfile
+import signal
+import sys
+import time
+from collections import Counter
+
+_NB_HISTOGRAM_BUCKETS = 40
+# Smallest value distinguished by the histograms: 1 microsecond (or 1 microbyte, ...)
+_HISTOGRAM_RESOLUTION = 1e-6
+_FOOTER_TEMPLATE = ("monitor: %(lines_read)d lines read, %(parse_failures)d malformed, %(buffer_size)d buffered, "
+                    "tail lag %(tail_lag_bytes)dB, batch p99: parse %(parse)s buffer %(buffer)s warden %(warden)s "
+                    "render %(render)s, event latency p99 %(event_latency)s")
+
+
+class Histogram:
+    def __init__(self):
+        """
+        Histogram with exponential (power of 2) buckets, so that observing a value is O(1) and memory is fixed
+        """
+        self.buckets = [0] * _NB_HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        """
+        :param value: (float) positive value to record
+        """
+        index = min(int(value / _HISTOGRAM_RESOLUTION).bit_length(), _NB_HISTOGRAM_BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        :param fraction: (float) percentile to estimate, between 0 and 1
+        :return: (float) upper bound of the bucket holding that percentile, 0 if nothing was observed
+        """
+        if not self.count:
+            return 0.
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << index) * _HISTOGRAM_RESOLUTION, self.max)
+        return self.max
+
+
+def format_latency(seconds):
+    """
+    :param seconds: (float) latency of the footer, DisplayHelper.format_duration being the one of the statistics
+    :return: (str) the latency in milliseconds under a second, with a decimal more than format_duration
+    """
+    return "%.1fms" % (1000 * seconds) if seconds < 1 else "%.2fs" % seconds
+
+
+class SelfMetrics:
+    def __init__(self):
+        """
+        Registry of the self-metrics of the monitor
+        """
+        self.started = time.time()
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name, value=1):
+        """
+        :param name: (str) name of the counter
+        :param value: (int) amount to add
+        """
+        self.counters[name] += value
+
+    def set(self, name, value):
+        """
+        :param name: (str) name of the gauge
+        :param value: (float) current value
+        """
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        """
+        :param name: (str) name of the histogram
+        :param value: (float) value to record
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def p99(self, name):
+        """
+        :return: (float) 99th percentile of a histogram, 0 if nothing was observed
+        """
+        histogram = self.histograms.get(name)
+        return histogram.percentile(.99) if histogram is not None else 0.
+
+    def format_footer(self):
+        """
+        :return: (str) one line summary of the self-metrics, displayed under the statistics
+        """
+        return _FOOTER_TEMPLATE % {"lines_read": self.counters["lines_read"],
+                                   "parse_failures": self.counters["parse_failures"],
+                                   "buffer_size": self.gauges.get("buffer_size", 0),
+                                   "tail_lag_bytes": self.gauges.get("tail_lag_bytes", 0),
+                                   "parse": format_latency(self.p99("parse_seconds")),
+                                   "buffer": format_latency(self.p99("buffer_seconds")),
+                                   "warden": format_latency(self.p99("warden_seconds")),
+                                   "render": format_latency(self.p99("render_seconds")),
+                                   "event_latency": format_latency(self.p99("event_latency_seconds"))}
+
+    def dump(self):
+        """
+        :return: (str) every self-metric, one per line
+        """
+        uptime = time.time() - self.started
+        lines = ["uptime_seconds %.1f" % uptime]
+        lines += ["%s %d" % (name, value) for name, value in sorted(self.counters.items())]
+        if uptime > 0 and self.counters["lines_read"]:
+            lines.append("lines_read_per_second %.1f" % (self.counters["lines_read"] / uptime))
+        lines += ["%s %s" % (name, value) for name, value in sorted(self.gauges.items())]
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append("%s count=%d mean=%g p50=%g p99=%g max=%g"
+                         % (name, histogram.count, histogram.total / max(histogram.count, 1),
+                            histogram.percentile(.5), histogram.percentile(.99), histogram.max))
+        return "\n".join(lines) + "\n"
+
+
+def install_dump_handler(metrics, stream=None):
+    """
+    Dump the self-metrics when the process receives SIGUSR1 (where the signal exists)
+    :param metrics: (SelfMetrics) metrics to dump
+    :param stream: (file) where to write them, stderr by default
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def dump(signum, frame):
+        (stream or sys.stderr).write(metrics.dump())
+        (stream or sys.stderr).flush()
+
+    signal.signal(signal.SIGUSR1, dump)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        """
+        Statistical profiler sampling the stack of the main thread on SIGPROF (Unix only).
+        Its overhead only depends on the sampling interval, not on the amount of function calls.
+        :param interval: (float) CPU time between two samples, in seconds
+        """
+        self.interval = interval
+        self.samples = Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append("%s:%s:%d" % (frame.f_code.co_filename, frame.f_code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def dump(self, path):
+        """
+        Write the samples in the collapsed stacks format, readable by flamegraph tools
+        :param path: (str) output file
+        """
+        with open(path, 'w') as output_file:
+            for stack, count in self.samples.most_common():
+                output_file.write("%s %d\n" % (stack, count))
+
+
+def run_profiled(function, mode, path):
+    """
+    Run a function under a profiler, and write the profile when it returns or raises (on Ctrl-C for example)
+    :param function: (function) function to run, without arguments
+    :param mode: (str) "cprofile" (deterministic, pstats output) or "sampling" (collapsed stacks output)
+    :param path: (str) where to write the profile
+    :return: what the function returns
+    """
+    if mode == "sampling":
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            return function()
+        finally:
+            profiler.stop()
+            profiler.dump(path)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(path)
@@ -1,64 +1,459 @@
 import argparse
+import asyncio
 from logging import getLogger
+import os
+import socket
 import sys
 import time
-from Tailer import Tailer
-from Parser import parse_logline
-from Buffer import LogsBuffer
+from collections import defaultdict
+from Anomaly import AnomalyEngine
+from AsyncMonitor import Sink, run_monitor
+from Tailer import Tailer, MultiTailer
+from LogFormat import DEFAULT_FORMAT, FORMATS, get_parser
+from Bulk import bulk_ingest, complete_size
+from Endpoint import MetricsServer, build_snapshot
+from Pipeline import LoadShedder, ParallelAggregator, ReorderBuffer, ingest_batch, ingest_sources, merge_results
+from Replay import replay
+from Rollups import MinuteRollups, RollupStore
+from Buffer import LogsBuffer, BucketedLogsBuffer, SketchLogsBuffer, FanoutBuffer, PercentileBuffer, \
+    PathTreeBuffer
+import NumpyBuffer
+from Rules import RuleEngine, load_rules
 from Warden import AlertWarden
-from DisplayHelper import get_formatted_stats, format_alert_message, format_alert_status
+from DisplayHelper import get_formatted_stats, get_formatted_sources, get_formatted_percentiles, format_alert_message, \
+    format_alert_status, format_rule_message, format_anomaly_message, get_formatted_degraded, format_degraded_status, \
+    get_formatted_path_tree
+from Metrics import SelfMetrics, install_dump_handler, run_profiled
 from datetime import datetime
 
 logger = getLogger(__name__)
 
+# Time between two checks of the alert warden when no line arrives
+_WARDEN_INTERVAL = 1.
+# Time between two writes of the closed minutes to the rollup store
+_ROLLUP_INTERVAL = 10.
+# Minimum time between two warnings about malformed lines, the lines skipped in between are summed up
+_MALFORMED_WARNING_INTERVAL = 10.
+# Sections of the path tree displayed, and children displayed under every node
+_PATH_TREE_SECTIONS = 3
+_PATH_TREE_CHILDREN = 3
+
 
 def main():
     parser = argparse.ArgumentParser(description="Monitor a log file of HTTP Access")
-    parser.add_argument("-l", "--logpath", default="logs.txt", type=str,
-                        help="The path to the access log file we wish to monitor")
+    parser.add_argument("-l", "--logpath", default=["logs.txt"], type=str, nargs="+",
+                        help="The paths (or glob patterns, quoted) of the access log files we wish to monitor. With "
+                             "several files, their lines are merged by timestamp, and new files matching the patterns "
+                             "are picked up")
     parser.add_argument("-s", "--summary", default="alerts.txt", type=str,
                         help="File where to write events we need to archive")
     parser.add_argument("-p", "--period", default=2, type=int,
                         help="Time frame (int, in minutes) of the monitoring statistics")
     parser.add_argument("-r", "--refresh", default=10, type=int,
                         help="Refresh rate (int, in seconds) for the console output of monitoring statistics")
+    parser.add_argument("-t", "--top", default=10, type=int,
+                        help="Maximum amount of sections and users displayed")
+    parser.add_argument("-f", "--log-format", default=DEFAULT_FORMAT, type=str,
+                        help="Format of the log lines: " + ", ".join([DEFAULT_FORMAT] + sorted(FORMATS)) +
+                             ", or an Apache LogFormat string such as '%%h %%l %%u %%t \"%%r\" %%>s %%b %%D'")
+    parser.add_argument("-c", "--checkpoint", default=None, type=str,
+                        help="File where to persist the position reached in the log file, to resume from it after a "
+                             "restart")
+    buffer_mode = parser.add_mutually_exclusive_group()
+    buffer_mode.add_argument("-b", "--buckets", action="store_true",
+                             help="Aggregate the statistics in per-second buckets instead of keeping every log line")
+    buffer_mode.add_argument("-n", "--numpy", action="store_true",
+                             help="Aggregate the per-second buckets with vectorized NumPy operations (falls back to "
+                                  "--buckets if NumPy is not installed)")
+    buffer_mode.add_argument("-k", "--sketch", action="store_true",
+                             help="Approximate the per section and per user statistics with bounded-memory sketches")
+    parser.add_argument("--sketch-error", default=0.005, type=float,
+                        help="Maximum over-estimation of the top sections and users in sketch mode, as a fraction of "
+                             "the totals")
+    parser.add_argument("--reorder-window", default=2., type=float,
+                        help="With several log files, how late (in seconds) a file may be compared to the others and "
+                             "still be merged in timestamp order")
+    parser.add_argument("--per-source", action="store_true",
+                        help="With several log files, also display the hits and traffic of every file")
+    parser.add_argument("-w", "--workers", default=1, type=int,
+                        help="Amount of processes parsing the log lines (more than 1 implies --buckets)")
+    parser.add_argument("--backlog", action="store_true",
+                        help="Ingest the existing content of the log file in bulk (memory-mapped, parsed by --workers "
+                             "processes) before following it, instead of ignoring it (implies --buckets, single file "
+                             "only)")
+    parser.add_argument("--shed-lag", default=None, type=float, metavar="SECONDS",
+                        help="Switch to a degraded mode when the newest line ingested is older than SECONDS: only a "
+                             "sample of the lines is parsed, its counts scaled back up, and the per-user statistics "
+                             "are skipped, until the ingestion catches up (implies --buckets, not available with "
+                             "--sketch, --workers, --replay, several log files, --percentiles or --path-depth)")
+    parser.add_argument("--shed-rate", default=10, type=int,
+                        help="In degraded mode, 1 line out of SHED_RATE is ingested")
+    parser.add_argument("--replay", nargs="+", metavar="FILE",
+                        help="Replay archived log files (plain or .gz, in chronological order) as fast as possible "
+                             "instead of tailing --logpath (implies --buckets)")
+    parser.add_argument("--rules", default=None, type=str, metavar="FILE",
+                        help="JSON file of additional alert rules (per section, per host, 5xx ratio, bytes/s), each "
+                             "with its own window and hysteresis (see Rules.py)")
+    parser.add_argument("--anomaly", action="store_true",
+                        help="Also alert when the hits of a minute deviate from their seasonal baseline (Holt-Winters, "
+                             "see Anomaly.py), rather than only above the fixed threshold")
+    parser.add_argument("--anomaly-sigmas", default=4., type=float,
+                        help="Deviation from the baseline, in standard deviations, from which an anomaly is raised")
+    parser.add_argument("--anomaly-season", default=1440, type=int,
+                        help="Length (int, in minutes) of the season of the baseline")
+    parser.add_argument("--anomaly-sections", default=0, type=int,
+                        help="Amount of the busiest sections also watched for anomalies, each against its own "
+                             "baseline")
+    parser.add_argument("--percentiles", action="store_true",
+                        help="Also display the p50/p95/p99 of the response sizes and times (when the lines end with "
+                             "the response time in seconds) of the busiest sections (not available with --workers or "
+                             "--replay)")
+    parser.add_argument("--path-depth", default=None, type=int, metavar="DEPTH",
+                        help="Also count the hits and bytes of every prefix of the paths down to DEPTH segments, and "
+                             "display the busiest ones under the most popular sections (not available with --workers "
+                             "or --replay)")
+    parser.add_argument("--path-nodes", default=4096, type=int,
+                        help="Maximum amount of prefixes counted by --path-depth, the rarest ones being counted "
+                             "together as (other)")
+    parser.add_argument("--rollups", default=None, type=str, metavar="FILE",
+                        help="SQLite database where to append per-minute rollups of the traffic (sections, status "
+                             "classes, busiest hosts, bytes), queried with Rollups.py")
+    parser.add_argument("--rollup-hosts", default=20, type=int,
+                        help="Amount of the busiest hosts of every minute kept in the rollups")
+    parser.add_argument("--metrics-port", default=None, type=int, metavar="PORT",
+                        help="Serve the statistics, the alert state and the self-metrics over HTTP on PORT, at "
+                             "/metrics (Prometheus) and /metrics.json, refreshed with the display (not available "
+                             "with --replay)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", type=str,
+                        help="Address the metrics endpoint listens on")
+    parser.add_argument("--snapshot-dir", default=None, type=str, metavar="DIR",
+                        help="Spool directory where to write snapshots of the statistics, merged by Aggregator.py "
+                             "with the ones of the other hosts (implies --buckets, unless --numpy, so that a snapshot copies "
+                             "per-second counters instead of every entry; not available with --sketch)")
+    parser.add_argument("--node", default=socket.gethostname(), type=str,
+                        help="Name of this host in the spool directory")
+    parser.add_argument("--snapshot-interval", default=1., type=float,
+                        help="Time (in seconds) between two snapshots written to the spool directory")
+    parser.add_argument("--profile", default=None, type=str, metavar="FILE",
+                        help="Profile the monitor and write the profile to FILE when it stops")
+    parser.add_argument("--profile-mode", default="cprofile", choices=["cprofile", "sampling"],
+                        help="cprofile writes pstats data, sampling writes collapsed stacks for flamegraphs")
     args = parser.parse_args()
+    if args.snapshot_dir and args.sketch:
+        parser.error("--snapshot-dir is not available with --sketch")
+    if args.backlog and (args.sketch or args.checkpoint or len(args.logpath) > 1
+                         or any(character in args.logpath[0] for character in "*?[")):
+        parser.error("--backlog needs a single log file, and is not available with --sketch or --checkpoint")
+    if args.percentiles and (args.workers > 1 or args.replay):
+        parser.error("--percentiles is not available with --workers or --replay, which only keep per-second counts")
+    if args.shed_lag is not None and (args.sketch or args.workers > 1 or args.replay or len(args.logpath) > 1
+                                      or any(character in args.logpath[0] for character in "*?[")):
+        parser.error("--shed-lag needs a single log file, and is not available with --sketch, --workers or --replay")
+    if args.shed_lag is not None and (args.percentiles or args.path_depth is not None):
+        parser.error("--shed-lag is not available with --percentiles or --path-depth, which need every entry")
+    if args.shed_rate < 1:
+        parser.error("--shed-rate must be at least 1")
+    if args.path_depth is not None and (args.workers > 1 or args.replay):
+        parser.error("--path-depth is not available with --workers or --replay, which only keep per-second counts")
+    if args.path_depth is not None and args.path_depth < 1:
+        parser.error("--path-depth must be at least 1")
+    if args.metrics_port is not None and args.replay:
+        parser.error("--metrics-port is not available with --replay")
+    try:
+        get_parser(args.log_format)
+    except ValueError as error:
+        parser.error("invalid --log-format: %s" % error)
+    if args.rules:
+        try:
+            args.rules = load_rules(args.rules)
+        except (IOError, OSError, ValueError, TypeError) as error:
+            parser.error("invalid --rules file: %s" % error)
+
+    if args.profile:
+        return run_profiled(lambda: run(args), args.profile_mode, args.profile)
+    return run(args)
+
 
-    tailed_file = Tailer(args.logpath, .5)
-    monitor_buffer = LogsBuffer(args.period)
+def run(args):
+    """
+    Monitor the log files (or replay the archives) described by the command line arguments
+    :param args: (Namespace) parsed command line arguments
+    """
+    metrics = SelfMetrics()
+    install_dump_handler(metrics)
+    monitor_buffer = make_buffer(args)
     alert_warden = AlertWarden(args.period)
-    next_display = time.mktime(time.gmtime()) + 10
+    rule_engine = RuleEngine(args.rules) if args.rules else None
+    percentile_buffer = PercentileBuffer(args.period) if args.percentiles else None
+    path_tree = PathTreeBuffer(args.period, args.path_depth, max_nodes=args.path_nodes) \
+        if args.path_depth is not None else None
+    anomaly_engine = AnomalyEngine(args.anomaly_sections, args.anomaly_season, args.anomaly_sigmas,
+                                   args.anomaly_sigmas / 2) if args.anomaly else None
+    rollups = MinuteRollups() if args.rollups else None
+    consumers = [consumer for consumer in (rule_engine, anomaly_engine, percentile_buffer, path_tree, rollups)
+                 if consumer is not None]
+    if consumers:
+        monitor_buffer = FanoutBuffer(monitor_buffer, *consumers)
+    rollup_store = RollupStore(args.rollups, args.rollup_hosts) if args.rollups else None
+    try:
+        if args.replay:
+            return run_replay(args, monitor_buffer, alert_warden, rule_engine, metrics, rollups, rollup_store,
+                              anomaly_engine)
+        return asyncio.run(run_live(args, monitor_buffer, alert_warden, rule_engine, metrics, percentile_buffer,
+                                    rollups, rollup_store, anomaly_engine, path_tree))
+    finally:
+        if rollup_store is not None:
+            # The minutes still open are written as they are, a later run adds its own rollups of them
+            rollup_store.write(rollups.pop_closed())
+            rollup_store.close()
+
+
+def make_buffer(args):
+    """
+    :param args: (Namespace) parsed command line arguments
+    :return: (LogsBuffer or alike) the buffer selected by the arguments
+    """
+    if args.sketch:
+        return SketchLogsBuffer(args.period, top_error=args.sketch_error)
+    if args.numpy:
+        return NumpyBuffer.make_buffer(args.period)
+    if args.buckets or args.workers > 1 or args.replay or args.backlog or args.shed_lag is not None \
+            or args.snapshot_dir:
+        return BucketedLogsBuffer(args.period)
+    return LogsBuffer(args.period)
+
+
+def check_alerts(alert_warden, rule_engine, monitor_buffer, now, metrics, anomaly_engine=None):
+    """
+    :param alert_warden: (AlertWarden) warden to update
+    :param rule_engine: (RuleEngine) additional rules to evaluate, None if there are none
+    :param monitor_buffer: (LogsBuffer or alike) buffer of the period, cleaned up to now
+    :param now: (float) now timestamp
+    :param metrics: (SelfMetrics) where to record the time spent in the warden
+    :param anomaly_engine: (AnomalyEngine) detectors of the deviations from the baseline, None if there are none
+    :return: (list) the alert and recovery messages of the alert states that changed
+    """
+    started = time.time()
+    message_type, data = alert_warden.update(monitor_buffer.get_total_hits(), now)
+    messages = [format_alert_message(message_type, data)] if message_type != 2 else []
+    if rule_engine is not None:
+        messages += [format_rule_message(rule.name, message_type, data)
+                     for rule, message_type, data in rule_engine.update(now)]
+    if anomaly_engine is not None:
+        messages += [format_anomaly_message(section, message_type, data)
+                     for section, message_type, data in anomaly_engine.update(now)]
+    metrics.observe("warden_seconds", time.time() - started)
+    return messages
+
+
+def render(args, monitor_buffer, alert_warden, now, metrics, source_buffers=None, percentile_buffer=None,
+           load_shedder=None, path_tree=None):
+    """
+    :param args: (Namespace) parsed command line arguments
+    :param monitor_buffer: (LogsBuffer or alike) buffer of the period
+    :param alert_warden: (AlertWarden) warden giving the alert status
+    :param now: (float) now timestamp
+    :param metrics: (SelfMetrics) self-metrics, displayed in the footer
+    :param source_buffers: (dict) {path: buffer} of every log file, for the per-file breakdown
+    :param percentile_buffer: (PercentileBuffer) quantiles of the response sizes and times, None to omit them
+    :param load_shedder: (LoadShedder) degraded mode of the ingestion, displayed when it is active
+    :param path_tree: (PathTreeBuffer) hits and bytes of the prefixes of the paths, None to omit them
+    :return: (str) the statistics to display
+    """
+    started = time.time()
+    readable_now = datetime.fromtimestamp(now).strftime('%H:%M:%S')
+    degraded = load_shedder is not None and load_shedder.degraded
+    alert_status = format_alert_status(alert_warden.status())
+    stats = get_formatted_stats(readable_now, format_degraded_status(alert_status) if degraded else alert_status,
+                                monitor_buffer.get_total_hits(),
+                                monitor_buffer.get_total_sections(),
+                                monitor_buffer.get_popular_sections(args.top),
+                                monitor_buffer.get_status_classes(),
+                                monitor_buffer.get_total_success(),
+                                monitor_buffer.get_total_users(),
+                                monitor_buffer.get_user_traffic(args.top),
+                                monitor_buffer.get_total_traffic()
+                                )
+    if source_buffers:
+        stats += get_formatted_sources([(path, source_buffer.get_total_hits(), source_buffer.get_total_success(),
+                                         source_buffer.get_total_traffic())
+                                        for path, source_buffer in source_buffers.items()],
+                                       monitor_buffer.get_total_hits())
+    if degraded:
+        stats += get_formatted_degraded(load_shedder.lag, load_shedder.sample_every)
+    if percentile_buffer is not None:
+        stats += get_formatted_percentiles(percentile_buffer.get_total_percentiles(),
+                                           percentile_buffer.get_percentiles(args.top))
+    if path_tree is not None:
+        stats += get_formatted_path_tree(path_tree.get_subtrees(_PATH_TREE_SECTIONS, _PATH_TREE_CHILDREN),
+                                         path_tree.get_total_hits())
+    metrics.observe("render_seconds", time.time() - started)
+    metrics.set("buffer_size", monitor_buffer.get_total_hits())
+    return stats + metrics.format_footer()
 
+
+def run_replay(args, monitor_buffer, alert_warden, rule_engine, metrics, rollups=None, rollup_store=None,
+               anomaly_engine=None):
+    """
+    Replay the archives as fast as possible, the clock being driven by the log timestamps
+    The rollups of the closed minutes are written synchronously, since nothing waits for the replay.
+    """
+    next_display = None
+    malformed_warnings = MalformedWarnings()
     with open(args.summary, 'a') as alert_logs:
-        for newline in tailed_file.read():
-            now = time.mktime(time.gmtime())
-            readable_now = datetime.fromtimestamp(now).strftime('%H:%M:%S')
-            try:
-                parsed_line = parse_logline(newline)
-                monitor_buffer.clean_old_entries(now)
-                monitor_buffer.add_entry(parsed_line)
-            except AttributeError as e:
-                logger.warning("Exception %s was thrown while parsing: %s", (e, newline))
-                pass
-            message_type, data = alert_warden.update(monitor_buffer.get_total_hits(), now)
-            alert_state = format_alert_message(message_type, data)
-            if alert_state:
+        for now, malformed in replay(args.replay, monitor_buffer, args.workers, metrics, args.log_format):
+            malformed_warnings.add(malformed, now)
+            if rollup_store is not None:
+                rollup_store.write(rollups.pop_closed(now))
+            for alert_state in check_alerts(alert_warden, rule_engine, monitor_buffer, now, metrics, anomaly_engine):
                 alert_logs.write(alert_state)
                 alert_logs.flush()
                 print(alert_state)
 
+            if next_display is None:
+                next_display = now + args.refresh
             if now > next_display:
-                print get_formatted_stats(readable_now, format_alert_status(alert_warden.status()),
-                                          monitor_buffer.get_total_hits(),
-                                          monitor_buffer.get_total_sections(),
-                                          monitor_buffer.get_popular_sections(),
-                                          monitor_buffer.get_statuses(),
-                                          monitor_buffer.get_total_success(),
-                                          monitor_buffer.get_total_users(),
-                                          monitor_buffer.get_user_traffic(),
-                                          monitor_buffer.get_total_traffic()
-                                          )
-                next_display += 10
+                print(render(args, monitor_buffer, alert_warden, now, metrics))
+                while next_display < now:
+                    next_display += args.refresh
+
+
+def load_backlog(args, monitor_buffer):
+    """
+    Ingest in bulk the complete lines already written in the log file, before following it
+    :param args: (Namespace) parsed command line arguments
+    :param monitor_buffer: (BucketedLogsBuffer or alike) buffer receiving the counts
+    :return: (int) offset where the backlog stops, from which the file is then followed
+    """
+    end = complete_size(args.logpath[0])
+    for stats in bulk_ingest(args.logpath[:1], monitor_buffer, args.workers, args.log_format, end=end):
+        _write_console("Backlog of %s" % stats)
+    monitor_buffer.clean_old_entries(time.mktime(time.gmtime()))
+    return end
+
+
+class MalformedWarnings:
+    def __init__(self, interval=_MALFORMED_WARNING_INTERVAL):
+        """
+        Warn about the malformed lines at most once per interval, so that a flood of garbage does not flood the logs
+        (every malformed line is still counted in the parse_failures self-metric)
+        :param interval: (float) minimum time between two warnings, in seconds
+        """
+        self.interval = interval
+        self.skipped = 0
+        self.next_warning = None
+
+    def add(self, malformed, now):
+        """
+        :param malformed: (int) amount of lines skipped by the last ingestion
+        :param now: (float) now timestamp
+        """
+        self.skipped += malformed
+        if self.skipped and (self.next_warning is None or now >= self.next_warning):
+            logger.warning("%d malformed lines were skipped while parsing", self.skipped)
+            self.skipped = 0
+            self.next_warning = now + self.interval
+
+
+def _write_console(message):
+    print(message)
+    sys.stdout.flush()
+
+
+async def run_live(args, monitor_buffer, alert_warden, rule_engine, metrics, percentile_buffer=None, rollups=None,
+                   rollup_store=None, anomaly_engine=None, path_tree=None):
+    """
+    Tail the log files until interrupted. The warden is checked after every batch and every _WARDEN_INTERVAL, the
+    statistics are displayed (and published to the metrics endpoint) every args.refresh seconds, whether lines arrive
+    or not, and the closed minutes are written to the rollup store every _ROLLUP_INTERVAL.
+    """
+    source_buffers, aggregator = None, None
+    load_shedder = LoadShedder(args.shed_lag, args.shed_rate) if args.shed_lag is not None else None
+    start_offset = load_backlog(args, monitor_buffer) if args.backlog else None
+    if len(args.logpath) > 1 or any(character in args.logpath[0] for character in "*?["):
+        tailed_file = MultiTailer(args.logpath, .5)
+        reorder = ReorderBuffer(args.reorder_window)
+        if args.per_source:
+            source_buffers = defaultdict(lambda: make_buffer(args))
+
+        def process(batches):
+            return [ingest_sources(batches, reorder, monitor_buffer, source_buffers, metrics, args.log_format)]
+    elif args.workers > 1:
+        tailed_file = Tailer(args.logpath[0], .5, checkpoint_path=args.checkpoint, start_offset=start_offset)
+        aggregator = ParallelAggregator(args.workers, log_format=args.log_format)
+
+        def process(batch):
+            return merge_results(aggregator.submit(batch, time.mktime(time.gmtime())), monitor_buffer, metrics)
+    else:
+        tailed_file = Tailer(args.logpath[0], .5, checkpoint_path=args.checkpoint, start_offset=start_offset)
+
+        def process(batch):
+            return [ingest_batch(batch, monitor_buffer, metrics, args.log_format, load_shedder)]
+
+    malformed_warnings = MalformedWarnings()
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(args.metrics_host, args.metrics_port)
+        metrics_server.publish(build_snapshot(monitor_buffer, alert_warden, metrics, time.mktime(time.gmtime()),
+                                              args.top))
+        metrics_server.start()
+    with open(args.summary, 'a') as alert_logs:
+        def write_alert(message):
+            alert_logs.write(message)
+            alert_logs.flush()
+
+        alerts_sink = Sink("alerts_sink", write_alert, metrics)
+        console_sink = Sink("console_sink", _write_console, metrics)
+        sinks = [alerts_sink, console_sink]
+
+        def on_ingested(now, malformed):
+            malformed_warnings.add(malformed, now)
+            for alert_state in check_alerts(alert_warden, rule_engine, monitor_buffer, now, metrics, anomaly_engine):
+                alerts_sink.publish(alert_state)
+                console_sink.publish(alert_state)
+
+        def check():
+            now = time.mktime(time.gmtime())
+            if aggregator is not None:
+                for ingested in merge_results(aggregator.collect(), monitor_buffer, metrics):
+                    on_ingested(*ingested)
+            monitor_buffer.clean_old_entries(now)
+            on_ingested(now, 0)
+
+        def display():
+            now = time.mktime(time.gmtime())
+            metrics.set("tail_lag_bytes", tailed_file.lag())
+            if load_shedder is not None:
+                load_shedder.check_idle(args.refresh, metrics)
+            console_sink.publish(render(args, monitor_buffer, alert_warden, now, metrics, source_buffers,
+                                        percentile_buffer, load_shedder, path_tree))
+            if metrics_server is not None:
+                metrics_server.publish(build_snapshot(monitor_buffer, alert_warden, metrics, now, args.top))
+
+        timers = [(_WARDEN_INTERVAL, check), (args.refresh, display)]
+        if args.snapshot_dir:
+            snapshot_path = os.path.join(args.snapshot_dir, args.node + ".snap")
+            snapshot_sink = Sink("snapshot_sink", lambda snapshot: snapshot.save(snapshot_path), metrics, 1)
+            sinks.append(snapshot_sink)
+            timers.append((args.snapshot_interval, lambda: snapshot_sink.publish(monitor_buffer.snapshot())))
+        if rollup_store is not None:
+            rollup_sink = Sink("rollup_sink", rollup_store.write, metrics)
+            sinks.append(rollup_sink)
+
+            def publish_rollups():
+                closed = rollups.pop_closed(time.mktime(time.gmtime()))
+                if closed:
+                    rollup_sink.publish(closed)
+            timers.append((_ROLLUP_INTERVAL, publish_rollups))
+
+        try:
+            await run_monitor(tailed_file.read_batches(), process, on_ingested, timers, sinks)
+        finally:
+            tailed_file.stop()
+            if aggregator is not None:
+                aggregator.close()
+            if metrics_server is not None:
+                metrics_server.stop()
 
 
 if __name__ == '__main__':
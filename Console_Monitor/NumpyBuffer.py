@@ -0,0 +1,340 @@
+"""
+NumPy-vectorized alternative to BucketedLogsBuffer (NumPy is optional: make_buffer falls back to the pure Python
+BucketedLogsBuffer when it is missing).
+Entries are integer coded (section, status and host identifiers) as they are added, and aggregated per second with
+numpy.unique once per batch, when the buffer is cleaned or read. The totals of the period are vectors indexed by
+those identifiers, and the top sections and users are selected with numpy.argpartition.
+The identifiers of the strings that left the period are recycled, so that the vectors and the cost of an update follow
+the cardinality of the period, not the one of the whole run (a scan or a botnet sends a lot of one-off hosts).
+"""
+
+import heapq
+import math
+from collections import Counter, deque
+from logging import getLogger
+from Buffer import BucketedLogsBuffer, _Interner
+from Snapshot import WindowSnapshot
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = getLogger(__name__)
+
+# Identifiers known from which an interner is rebuilt, if less than half of them are still in the period
+_MIN_RECYCLED_IDS = 1024
+# Integer coded columns: (interner, vectors of the totals indexed by its identifiers, identifier arrays of the chunks)
+_CODED_COLUMNS = (("section_names", ("section_hits",), "section_ids"),
+                  ("status_names", ("status_hits",), "status_ids"),
+                  ("host_names", ("host_hits", "host_traffic"), "host_ids"))
+
+
+def make_buffer(period=2):
+    """
+    :param period: (int) time frame of the buffer, in minutes
+    :return: (NumpyLogsBuffer) or a BucketedLogsBuffer if NumPy is not installed
+    """
+    if numpy is None:
+        logger.warning("NumPy is not installed, falling back to the pure Python buckets")
+        return BucketedLogsBuffer(period)
+    return NumpyLogsBuffer(period)
+
+
+class _Chunk(object):
+    __slots__ = ("hits", "traffic", "section_ids", "section_hits", "status_ids", "status_hits", "host_ids",
+                 "host_hits", "host_traffic")
+
+    def __init__(self, hits, traffic, section_ids, section_hits, status_ids, status_hits, host_ids, host_hits,
+                 host_traffic):
+        """
+        Counts of some entries of a second: every identifier array holds distinct identifiers, and is followed by the
+        counts of those identifiers
+        """
+        self.hits = hits
+        self.traffic = traffic
+        self.section_ids = section_ids
+        self.section_hits = section_hits
+        self.status_ids = status_ids
+        self.status_hits = status_hits
+        self.host_ids = host_ids
+        self.host_hits = host_hits
+        self.host_traffic = host_traffic
+
+
+def _count(ids, weights=None):
+    """
+    :param ids: (numpy.ndarray) identifiers
+    :param weights: (numpy.ndarray) weight of every identifier, None to count them
+    :return: (tuple) (distinct identifiers, their counts or summed weights), whatever the amount of identifiers known
+    """
+    distinct, inverse = numpy.unique(ids, return_inverse=True)
+    counts = numpy.bincount(inverse, weights=weights, minlength=len(distinct))
+    return distinct, counts.astype(numpy.int64)
+
+
+def _grow(vector, size):
+    """
+    :param vector: (numpy.ndarray) totals indexed by identifier
+    :param size: (int) amount of identifiers known
+    :return: (numpy.ndarray) the vector, padded with zeros up to size if needed
+    """
+    if len(vector) >= size:
+        return vector
+    grown = numpy.zeros(max(size, 2 * len(vector)), dtype=vector.dtype)
+    grown[:len(vector)] = vector
+    return grown
+
+
+def _top(names, counts, n):
+    """
+    :param names: (list) name of every identifier
+    :param counts: (numpy.ndarray) counts indexed by identifier
+    :param n: (int) amount of names to return, all the ones with a count if None
+    :return: (deque) tuples (name, count), highest counts first
+    """
+    ids = numpy.flatnonzero(counts[:len(names)])
+    if n is not None and n < len(ids):
+        ids = ids[numpy.argpartition(-counts[ids], n - 1)[:n]]
+    ids = ids[numpy.argsort(-counts[ids], kind="mergesort")]
+    return deque((names[identifier], int(counts[identifier])) for identifier in ids)
+
+
+class NumpyLogsBuffer:
+    def __init__(self, period=2):
+        """
+        Per-second counts of the period, aggregated with vectorized NumPy operations
+        :param period: (int) time frame of the buffer, in minutes
+        """
+        self.period = period*60
+        self.section_names = _Interner()
+        self.status_names = _Interner()
+        self.host_names = _Interner()
+        # Entries added since the last flush, integer coded: second, section, status, host, bytes
+        self.pending = ([], [], [], [], [])
+        self.chunks = {}
+        self.seconds = []
+        self.newest = None
+        self.total_hits = 0
+        self.total_traffic = 0
+        self.section_hits = numpy.zeros(64, dtype=numpy.int64)
+        self.status_hits = numpy.zeros(16, dtype=numpy.int64)
+        self.host_hits = numpy.zeros(1024, dtype=numpy.int64)
+        self.host_traffic = numpy.zeros(1024, dtype=numpy.int64)
+
+    def add_entry(self, parsed_entry):
+        """
+        Queue an entry, it is aggregated with the rest of its batch at the next flush
+        :param parsed_entry: (NamedTuple) ParsedLine(section, status, host, utc_ts, traffic)
+        """
+        seconds, sections, statuses, hosts, traffic = self.pending
+        seconds.append(int(parsed_entry.utc_ts))
+        sections.append(self.section_names.intern(parsed_entry.section))
+        statuses.append(self.status_names.intern(parsed_entry.status))
+        hosts.append(self.host_names.intern(parsed_entry.host))
+        traffic.append(parsed_entry.traffic)
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Merge counts pre-aggregated elsewhere, as BucketedLogsBuffer.add_counts
+        """
+        if self._too_old(second):
+            return
+        chunk = _Chunk(hits, sum(host_traffic.values()),
+                       numpy.array([self.section_names.intern(key) for key in sections], dtype=numpy.int64),
+                       numpy.array(list(sections.values()), dtype=numpy.int64),
+                       numpy.array([self.status_names.intern(key) for key in statuses], dtype=numpy.int64),
+                       numpy.array(list(statuses.values()), dtype=numpy.int64),
+                       numpy.array([self.host_names.intern(key) for key in host_hits], dtype=numpy.int64),
+                       numpy.array(list(host_hits.values()), dtype=numpy.int64),
+                       numpy.array([host_traffic.get(key, 0) for key in host_hits], dtype=numpy.int64))
+        self._add_chunk(second, chunk)
+        self._expire(self.newest - self.period)
+
+    def _too_old(self, second):
+        """
+        :return: (bool) True if the second is older than the buckets the period still holds
+        """
+        return self.newest is not None and second < self.newest - self.period
+
+    def _flush(self):
+        """
+        Aggregate the pending entries per second, on the distinct identifiers of every second and column only
+        """
+        if not self.pending[0]:
+            return
+        seconds, sections, statuses, hosts, traffic = [numpy.array(column, dtype=numpy.int64)
+                                                       for column in self.pending]
+        self.pending = ([], [], [], [], [])
+        for second in numpy.unique(seconds):
+            if self._too_old(second):
+                continue
+            mask = seconds == second
+            host_ids, host_hits = _count(hosts[mask])
+            _, host_traffic = _count(hosts[mask], traffic[mask])
+            section_ids, section_hits = _count(sections[mask])
+            status_ids, status_hits = _count(statuses[mask])
+            chunk = _Chunk(int(mask.sum()), int(traffic[mask].sum()), section_ids, section_hits, status_ids,
+                           status_hits, host_ids, host_hits, host_traffic)
+            self._add_chunk(int(second), chunk)
+        self._expire(self.newest - self.period)
+
+    def _add_chunk(self, second, chunk, sign=1):
+        """
+        :param second: (int) second of the counts
+        :param chunk: (_Chunk) counts to add to the totals of the period (sign=1) or to remove (sign=-1)
+        :param sign: (int) 1 or -1
+        """
+        if sign == 1:
+            if second not in self.chunks:
+                self.chunks[second] = []
+                heapq.heappush(self.seconds, second)
+                if self.newest is None or second > self.newest:
+                    self.newest = second
+            self.chunks[second].append(chunk)
+            self.section_hits = _grow(self.section_hits, len(self.section_names.values))
+            self.status_hits = _grow(self.status_hits, len(self.status_names.values))
+            self.host_hits = _grow(self.host_hits, len(self.host_names.values))
+            self.host_traffic = _grow(self.host_traffic, len(self.host_names.values))
+        self.total_hits += sign * chunk.hits
+        self.total_traffic += sign * chunk.traffic
+        # The identifiers of a chunk are distinct, so a fancy-indexed addition is enough (no numpy.add.at needed)
+        self.section_hits[chunk.section_ids] += sign * chunk.section_hits
+        self.status_hits[chunk.status_ids] += sign * chunk.status_hits
+        self.host_hits[chunk.host_ids] += sign * chunk.host_hits
+        self.host_traffic[chunk.host_ids] += sign * chunk.host_traffic
+
+    def clean_old_entries(self, now):
+        """
+        Aggregate the pending entries, and remove the seconds that are older than the period
+        :param now: (float) now timestamp
+        """
+        self._flush()
+        self._expire(int(math.ceil(now - self.period)))
+        self._recycle()
+
+    def _expire(self, limit):
+        """
+        Remove the counts of the seconds older than limit from the totals of the period
+        As in the ring of BucketedLogsBuffer, a new second also pushes out the seconds more than a period older.
+        :param limit: (int) oldest second to keep
+        """
+        while self.seconds and self.seconds[0] < limit:
+            second = heapq.heappop(self.seconds)
+            for chunk in self.chunks.pop(second):
+                self._add_chunk(second, chunk, -1)
+
+    def _recycle(self):
+        """
+        Rebuild the interners most of whose identifiers left the period, the identifiers of the strings still in the
+        period being renumbered in the totals and in the chunks. Rebuilding once the identifiers are twice the ones
+        in use keeps its cost amortized over the interned strings. Must be called when nothing is pending.
+        """
+        for interner_name, vector_names, chunk_field in _CODED_COLUMNS:
+            interner = getattr(self, interner_name)
+            size = len(interner.values)
+            if size < _MIN_RECYCLED_IDS:
+                continue
+            in_period = numpy.zeros(size, dtype=bool)
+            for vector_name in vector_names:
+                in_period |= getattr(self, vector_name)[:size] != 0
+            kept = numpy.flatnonzero(in_period)
+            if 2 * len(kept) > size:
+                continue
+            renumbered = numpy.full(size, -1, dtype=numpy.int64)
+            renumbered[kept] = numpy.arange(len(kept))
+            recycled = _Interner()
+            for identifier in kept:
+                recycled.intern(interner.values[identifier])
+            setattr(self, interner_name, recycled)
+            for vector_name in vector_names:
+                vector = numpy.zeros(max(2 * len(kept), 16), dtype=numpy.int64)
+                vector[:len(kept)] = getattr(self, vector_name)[kept]
+                setattr(self, vector_name, vector)
+            for chunks in self.chunks.values():
+                for chunk in chunks:
+                    setattr(chunk, chunk_field, renumbered[getattr(chunk, chunk_field)])
+
+    def get_total_hits(self):
+        """
+        :return: (int) the number of hits in the buffer (ie during the period)
+        """
+        self._flush()
+        return self.total_hits
+
+    def get_total_sections(self):
+        """
+        :return: (int) amount of sections registered in the buffer (ie hit during the period)
+        """
+        self._flush()
+        return int(numpy.count_nonzero(self.section_hits))
+
+    def get_popular_sections(self, n=None):
+        """
+        :param n: (int) amount of sections to return, all of them if None
+        :return: (deque): Ordered list of tuples representing the most commonly hit sections (section, amount of hits)
+        """
+        self._flush()
+        return _top(self.section_names.values, self.section_hits, n)
+
+    def get_statuses(self):
+        """
+        :return: (Counter): the Counter {status number: amount of hits)
+        """
+        self._flush()
+        return Counter(dict(_top(self.status_names.values, self.status_hits, None)))
+
+    def get_status_classes(self):
+        """
+        :return: (Counter): the Counter {first digit of the status: amount of hits}
+        """
+        status_classes = Counter()
+        for status, count in self.get_statuses().items():
+            status_classes[status[:1]] += count
+        return status_classes
+
+    def get_total_success(self):
+        """
+        :return: (int) amount of successful hits
+        """
+        return self.get_status_classes()["2"]
+
+    def get_total_users(self):
+        """
+        :return: (int) amount of users registered in the buffer (ie that sent at least one request during the period)
+        """
+        self._flush()
+        return int(numpy.count_nonzero(self.host_hits))
+
+    def get_user_traffic(self, n=None):
+        """
+        :param n: (int) amount of users to return, all of them if None
+        :return: (deque) Ordered list of tuples representing the users generating most trafic (user, traffic)
+        """
+        self._flush()
+        return _top(self.host_names.values, self.host_traffic, n)
+
+    def get_total_traffic(self):
+        """
+        :return: (int) Total amount of Bytes transferred during the period
+        """
+        self._flush()
+        return self.total_traffic
+
+    def snapshot(self):
+        """
+        :return: (WindowSnapshot) mergeable per-second counters of the buffer
+        """
+        self._flush()
+        seconds = {}
+        sections, statuses, hosts = self.section_names.values, self.status_names.values, self.host_names.values
+        for second, chunks in self.chunks.items():
+            counts = seconds[second] = [0, Counter(), Counter(), Counter(), Counter()]
+            for chunk in chunks:
+                counts[0] += chunk.hits
+                counts[1].update(dict((sections[i], int(c)) for i, c in zip(chunk.section_ids, chunk.section_hits)))
+                counts[2].update(dict((statuses[i], int(c)) for i, c in zip(chunk.status_ids, chunk.status_hits)))
+                counts[3].update(dict((hosts[i], int(c)) for i, c in zip(chunk.host_ids, chunk.host_hits)))
+                counts[4].update(dict((hosts[i], int(c)) for i, c in zip(chunk.host_ids, chunk.host_traffic)))
+            seconds[second] = [counts[0]] + [dict(key_counts) for key_counts in counts[1:]]
+        return WindowSnapshot(seconds)
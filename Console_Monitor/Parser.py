@@ -9,33 +9,145 @@ from collections import namedtuple
 # Regexp matching every part of a w3c-formatted HTTP log line
 # We expect a logline to look like this :
 # 192.168.1.3 - - [20/12/2015:21:15:44 +01.000] "GET /api/browse/id" 404 1978
+# optionally followed by the response time in seconds (as nginx's $request_time), 404 1978 0.042 for instance
 
 _HTTP_LOG_PATTERN = re.compile(r'\A(?P<remoteHost>\S+) (?P<rfc931>\S+) (?P<authUser>\S+) \[(?P<date>\S+) '
-                               r'(?P<offsetGMT>[+-]\d{2}\.\d{3})] "(?P<method>\S+) (?P<request>/(?P<section>[^/]*)'
-                               r'(?:/\S*)?(?P<protocol> \S+)?)" (?P<status>\d+) (?P<bytes>\d+)')
-_ParsedLine = namedtuple("ParsedLine", ["section", "status", "host", "utc_ts", "traffic"])
+                               r'(?P<offsetGMT>[+-]\d{2}\.\d{3})] "(?P<method>\S+) '
+                               r'(?P<request>(?P<path>/(?P<section>[^/?\s]*)(?:[/?]\S*)?)(?P<protocol> \S+)?)" '
+                               r'(?P<status>\d+) (?P<bytes>\d+)'
+                               r'(?: (?P<responseTime>\d+(?:\.\d+)?)(?!\S))?')
+_HTTP_OFFSET_PATTERN = re.compile(r'\A[+-]\d{2}\.\d{3}\Z')
+_RESPONSE_TIME_PATTERN = re.compile(r'\A\d+(?:\.\d+)?\Z')
+_ParsedLine = namedtuple("ParsedLine", ["section", "status", "host", "utc_ts", "traffic", "response_time", "path"])
+# The response time is optional, most log lines do not have one, and the path is only needed by the path tree
+_ParsedLine.__new__.__defaults__ = (None, None)
+
+_DATE_FORMAT = "%d/%m/%Y:%H:%M:%S"
+# The caches are keyed by second, so they are cleared when they get this big to keep memory bounded
+_MAX_CACHED_DATES = 100000
+
+# Offset of the local timezone to UTC, computed once since it only changes with daylight saving time
+_LOCAL_TIME_OFFSET = time.mktime(time.localtime()) - time.mktime(time.gmtime())
+_dates_cache = {}
+_offsets_cache = {}
+
+
+def _date_to_epoch(date):
+    """
+    :param date: (str) date of a log line, 20/12/2015:21:15:44 in our example above
+    :return: (float) the date as a timestamp, corrected by the local time offset (memoized)
+    """
+    epoch = _dates_cache.get(date)
+    if epoch is None:
+        if len(_dates_cache) >= _MAX_CACHED_DATES:
+            _dates_cache.clear()
+        epoch = time.mktime(time.strptime(date, _DATE_FORMAT)) + _LOCAL_TIME_OFFSET
+        _dates_cache[date] = epoch
+    return epoch
+
+
+def _offset_to_seconds(offset):
+    """
+    :param offset: (str) GMT offset of a log line, +01.000 in our example above
+    :return: (float) the offset in seconds (memoized)
+    """
+    seconds = _offsets_cache.get(offset)
+    if seconds is None:
+        seconds = _offsets_cache[offset] = float(offset) * 3600
+    return seconds
+
+
+def _parse_fast(new_entry):
+    """
+    Parse a log line by splitting it on its fixed delimiters
+    :param new_entry: (string) w3c-formatted log line
+    :return: (ParsedLine) or None if the line does not have the expected shape
+    """
+    try:
+        head, rest = new_entry.split(" [", 1)
+        date_part, rest = rest.split('] "', 1)
+        request, tail = rest.rsplit('" ', 1)
+    except ValueError:
+        return None
+    head = head.split(" ")
+    date_part = date_part.split(" ")
+    request = request.split(" ")
+    tail = tail.split(" ")
+    if len(head) != 3 or "" in head or len(date_part) != 2 or not 2 <= len(request) <= 3 or len(tail) < 2:
+        return None
+    date, offset = date_part
+    status, traffic = tail[0], tail[1]
+    path = request[1]
+    if (len(offset) != 7 or offset[3] != "." or not status.isdigit() or not traffic.isdigit()
+            or path[:1] != "/" or not request[0]):
+        return None
+    if offset not in _offsets_cache and not _HTTP_OFFSET_PATTERN.match(offset):
+        return None
+    try:
+        epoch = _date_to_epoch(date)
+    except ValueError:
+        return None
+    response_time = None
+    if len(tail) > 2 and _RESPONSE_TIME_PATTERN.match(tail[2]):
+        response_time = float(tail[2])
+    section = path[1:].split("/", 1)[0]
+    if "?" in section:
+        section = section.split("?", 1)[0]
+    return _ParsedLine(section, status, head[0], epoch - _offset_to_seconds(offset), int(traffic),
+                       response_time, path)
+
+
+def _parse_regex(new_entry):
+    """
+    Parse a log line with the complete _HTTP_LOG_PATTERN regexp
+    :param new_entry: (string) w3c-formatted log line
+    :return: (ParsedLine)
+    :raise AttributeError: if the line does not match the pattern
+    """
+    properties = _HTTP_LOG_PATTERN.match(new_entry)
+    section = properties.group("section")
+    status = properties.group("status")
+    host = properties.group("remoteHost")
+    traffic = int(properties.group("bytes"))
+    utc_ts = _date_to_epoch(properties.group("date")) - _offset_to_seconds(properties.group("offsetGMT"))
+    response_time = properties.group("responseTime")
+    return _ParsedLine(section, status, host, utc_ts, traffic,
+                       float(response_time) if response_time is not None else None, properties.group("path"))
 
 
 def parse_logline(new_entry):
     """
     Parse a formatted log line to extract the information we need
+    The line is split on its fixed delimiters, and only lines with an unexpected shape go through the slower regexp
     :param new_entry: (string) w3c-formatted log line
-    :return unnamed: (dict) dictionary with 3 keys
+    :return unnamed: (ParsedLine) namedtuple with 7 fields
         - section: the section hit, api in our example above
         - status: of the request, 404 in our example above
-        - utc_ts: timestamp converted to utc, 1450642544.0 in our example above
         - host: ip of the remote Host, 192.168.1.3 in our example
+        - utc_ts: timestamp converted to utc, 1450642544.0 in our example above
         - traffic: Amount of bytes transferred, 1978 in our example
+        - response_time: time taken to serve the request in seconds, None when the line does not end with it
+        - path: path of the request, /api/browse/id in our example above
+    :raise AttributeError: if the line is not a w3c-formatted log line
     """
-    properties = _HTTP_LOG_PATTERN.match(new_entry)
-    local_time_offset = time.mktime(time.localtime()) - time.mktime(time.gmtime())
-    section = properties.group("section")
-    status = properties.group("status")
-    host = properties.group("remoteHost")
-    traffic = int(properties.group("bytes"))
+    return _parse_fast(new_entry) or _parse_regex(new_entry)
 
-    local_ts = time.mktime(time.strptime(properties.group("date"), "%d/%m/%Y:%H:%M:%S"))
-    offset = float(properties.group("offsetGMT")) * 3600
-    utc_ts = local_ts - offset + local_time_offset
 
-    return _ParsedLine(section, status, host, utc_ts, traffic)
+def parse_lines(batch):
+    """
+    Parse a batch of formatted log lines, skipping the malformed ones
+    :param batch: (list) w3c-formatted log lines
+    :return: (list) ParsedLine of every well formed line of the batch, in the same order
+    """
+    parsed_lines = []
+    append = parsed_lines.append
+    parse_fast = _parse_fast
+    for new_entry in batch:
+        parsed_line = parse_fast(new_entry)
+        if parsed_line is None:
+            try:
+                parsed_line = _parse_regex(new_entry)
+            except (AttributeError, ValueError):
+                continue
+        append(parsed_line)
+    return parsed_lines
@@ -0,0 +1,398 @@
+"""
+Multiprocess ingestion: batches of raw log lines are parsed by a pool of worker processes, which send back compact
+per-second partial counts instead of every parsed line. The main process merges them, in submission order, into a
+BucketedLogsBuffer.
+It also merges the lines of several log files into a single stream ordered by timestamp (see ingest_merged), and
+sheds load when the ingestion falls behind the writer of the logs (see LoadShedder).
+"""
+
+import heapq
+import multiprocessing
+import time
+from collections import deque
+from Buffer import SAMPLED_HOSTS
+from Metrics import SelfMetrics
+from LogFormat import get_parser
+from Snapshot import aggregate_entries
+
+# Lines kept by the degraded mode: 1 out of _SAMPLE_EVERY
+_SAMPLE_EVERY = 10
+# The degraded mode is left once the lag falls under this share of the lag that triggered it
+_RECOVERY_LAG_RATIO = .25
+
+
+def aggregate_batch(batch, log_format=None):
+    """
+    Parse a batch of log lines and pre-aggregate it per second (run in the worker processes)
+    :param batch: (list) w3c-formatted log lines
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :return: (tuple)
+        - malformed: (int) amount of lines that could not be parsed
+        - partials: (list) tuples (second, hits, sections, statuses, host_hits, host_traffic) ordered by second, the
+                    last four being dicts of counts as expected by BucketedLogsBuffer.add_counts
+    """
+    parsed_lines = get_parser(log_format)(batch)
+    partials = [(second,) + tuple(counts) for second, counts in sorted(aggregate_entries(parsed_lines).items())]
+    return len(batch) - len(parsed_lines), partials
+
+
+def merge_partials(monitor_buffer, partials):
+    """
+    :param monitor_buffer: (BucketedLogsBuffer) buffer receiving the counts
+    :param partials: (list) partial counts, as returned by aggregate_batch
+    """
+    for partial in partials:
+        monitor_buffer.add_counts(*partial)
+
+
+class ParallelAggregator:
+    def __init__(self, workers, max_pending=None, log_format=None):
+        """
+        Dispatch the batches of log lines to a pool of worker processes
+        :param workers: (int) amount of worker processes
+        :param max_pending: (int) maximum amount of batches in flight before submit waits for the oldest one
+        :param log_format: (str) format of the lines, compiled by every worker (see LogFormat.get_parser)
+        """
+        self.pool = multiprocessing.Pool(workers)
+        self.log_format = log_format
+        self.max_pending = max_pending or 2 * workers
+        self.pending = deque()
+
+    def submit(self, batch, now):
+        """
+        Send a batch to the workers, and collect the results that are available
+        Results are always returned in submission order, so that the merge is deterministic.
+        :param batch: (list) w3c-formatted log lines
+        :param now: (float) timestamp at which the batch was read, returned with its result
+        :return: (list) tuples (now, malformed, partials) of the batches processed so far
+        """
+        self.pending.append((now, self.pool.apply_async(aggregate_batch, (batch, self.log_format))))
+        return self.collect()
+
+    def collect(self, wait=False):
+        """
+        :param wait: (bool) wait for every batch in flight instead of only the ready ones
+        :return: (list) tuples (now, malformed, partials) of the batches processed so far, in submission order
+        """
+        results = []
+        while self.pending and (wait or len(self.pending) > self.max_pending or self.pending[0][1].ready()):
+            now, result = self.pending.popleft()
+            malformed, partials = result.get()
+            results.append((now, malformed, partials))
+        return results
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        self.pool.terminate()
+        self.pool.join()
+
+
+def ingest(batches, monitor_buffer, metrics=None, log_format=None, load_shedder=None):
+    """
+    Parse the batches of log lines in this process and add them to the buffer
+    :param batches: (iterable) lists of w3c-formatted log lines, as yielded by Tailer.read_batches
+    :param monitor_buffer: (LogsBuffer or alike) buffer receiving the entries
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :param load_shedder: (LoadShedder) degraded mode to apply when the ingestion lags, None to never shed load
+    :return: (generator) tuples (now, malformed) every time the lines read at timestamp now are in the buffer
+    """
+    metrics = metrics or SelfMetrics()
+    for batch in batches:
+        yield ingest_batch(batch, monitor_buffer, metrics, log_format, load_shedder)
+
+
+def ingest_batch(batch, monitor_buffer, metrics, log_format=None, load_shedder=None):
+    """
+    Parse a batch of log lines in this process and add it to the buffer
+    :param batch: (list) w3c-formatted log lines
+    :param monitor_buffer: (LogsBuffer or alike) buffer receiving the entries, with add_counts if there is a
+                           load_shedder
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :param load_shedder: (LoadShedder) degraded mode to apply when the ingestion lags, None to never shed load
+    :return: (tuple) (now, malformed): timestamp at which the batch was ingested, amount of lines that could not be
+             parsed
+    """
+    if load_shedder is not None and load_shedder.degraded:
+        return _ingest_sampled(batch, monitor_buffer, metrics, log_format, load_shedder)
+    now = time.mktime(time.gmtime())
+    started = time.time()
+    parsed_lines = get_parser(log_format)(batch)
+    parsed = time.time()
+    monitor_buffer.clean_old_entries(now)
+    for parsed_line in parsed_lines:
+        monitor_buffer.add_entry(parsed_line)
+    metrics.observe("parse_seconds", parsed - started)
+    metrics.observe("buffer_seconds", time.time() - parsed)
+    _record_batch(metrics, now, len(batch), len(batch) - len(parsed_lines),
+                  parsed_lines[-1].utc_ts if parsed_lines else None)
+    if load_shedder is not None and parsed_lines:
+        load_shedder.update(now - parsed_lines[-1].utc_ts, metrics)
+    return now, len(batch) - len(parsed_lines)
+
+
+def _ingest_sampled(batch, monitor_buffer, metrics, log_format, load_shedder):
+    """
+    Ingest a sample of a batch, its counts being scaled back up by the sampling rate and its per-host statistics
+    skipped (its hits and traffic are counted under SAMPLED_HOSTS, which the rules and rollups ignore)
+    :return: (tuple) (now, malformed) as ingest_batch, malformed being estimated from the sample
+    """
+    now = time.mktime(time.gmtime())
+    started = time.time()
+    sampled = load_shedder.sample(batch)
+    parsed_lines = get_parser(log_format)(sampled)
+    parsed = time.time()
+    scale = load_shedder.sample_every
+    seconds = {}
+    for entry in parsed_lines:
+        second = int(entry.utc_ts)
+        counts = seconds.get(second)
+        if counts is None:
+            counts = seconds[second] = [0, 0, {}, {}]
+        counts[0] += 1
+        counts[1] += entry.traffic
+        sections, statuses = counts[2], counts[3]
+        sections[entry.section] = sections.get(entry.section, 0) + 1
+        statuses[entry.status] = statuses.get(entry.status, 0) + 1
+    monitor_buffer.clean_old_entries(now)
+    for second in sorted(seconds):
+        hits, traffic, sections, statuses = seconds[second]
+        monitor_buffer.add_counts(second, hits * scale, dict((key, count * scale) for key, count in sections.items()),
+                                  dict((key, count * scale) for key, count in statuses.items()),
+                                  {SAMPLED_HOSTS: hits * scale}, {SAMPLED_HOSTS: traffic * scale})
+    metrics.observe("parse_seconds", parsed - started)
+    metrics.observe("buffer_seconds", time.time() - parsed)
+    malformed = (len(sampled) - len(parsed_lines)) * scale
+    _record_batch(metrics, now, len(batch), malformed, parsed_lines[-1].utc_ts if parsed_lines else None)
+    metrics.incr("lines_shed", len(batch) - len(sampled))
+    if parsed_lines:
+        load_shedder.update(now - parsed_lines[-1].utc_ts, metrics)
+    return now, malformed
+
+
+class LoadShedder:
+    def __init__(self, max_lag, sample_every=_SAMPLE_EVERY):
+        """
+        Degraded mode of the ingestion, so that the alerts stay fresh when the parsing cannot keep up with the writer
+        of the logs: past max_lag, only 1 line out of sample_every is parsed, and counted sample_every times.
+        The lag is the age of the newest line of the last batch ingested, so it includes the batches waiting to be
+        parsed. The degraded mode is left once the lag falls under _RECOVERY_LAG_RATIO of max_lag.
+        :param max_lag: (float) lag (in seconds) from which the load is shed
+        :param sample_every: (int) 1 line out of sample_every is ingested in degraded mode
+        """
+        self.max_lag = max_lag
+        self.sample_every = sample_every
+        self.degraded = False
+        self.lag = 0.
+        self.updated = time.time()
+        # Index, in the next batch, of the first line of the sample, so that the sampling rate spans the batches
+        self.next_line = 0
+
+    def update(self, lag, metrics):
+        """
+        :param lag: (float) age of the newest line ingested, in seconds
+        :param metrics: (SelfMetrics) where to record the lag and the state
+        """
+        self.lag = lag
+        self.updated = time.time()
+        if not self.degraded and lag > self.max_lag:
+            self.degraded = True
+            metrics.incr("degraded_switches")
+        elif self.degraded and lag < self.max_lag * _RECOVERY_LAG_RATIO:
+            self.degraded = False
+        metrics.set("ingestion_lag_seconds", lag)
+        metrics.set("degraded", int(self.degraded))
+
+    def check_idle(self, idle, metrics):
+        """
+        Leave the degraded mode when nothing was ingested for a while: the lines are only ingested as they come, so
+        the lag of the last one does not decrease once the writer stops, although the ingestion caught up
+        :param idle: (float) time without any ingestion (in seconds) after which the ingestion is caught up
+        :param metrics: (SelfMetrics) where to record the lag and the state
+        """
+        if self.degraded and time.time() - self.updated >= idle:
+            self.update(0., metrics)
+
+    def sample(self, batch):
+        """
+        :param batch: (list) log lines
+        :return: (list) the lines of the sample
+        """
+        sampled = batch[self.next_line::self.sample_every]
+        self.next_line = (self.next_line - len(batch)) % self.sample_every
+        return sampled
+
+
+def _record_batch(metrics, now, nb_lines, malformed, newest):
+    """
+    :param metrics: (SelfMetrics) where to record the self-metrics
+    :param now: (float) timestamp at which the batch was read
+    :param nb_lines: (int) amount of lines in the batch
+    :param malformed: (int) amount of lines that could not be parsed
+    :param newest: (float) timestamp of the newest entry of the batch, None if it had no valid line
+    """
+    metrics.incr("lines_read", nb_lines)
+    metrics.incr("parse_failures", malformed)
+    metrics.incr("batches")
+    if newest is not None:
+        metrics.observe("event_latency_seconds", max(now - newest, 0))
+
+
+def ingest_parallel(batches, monitor_buffer, workers, metrics=None, log_format=None):
+    """
+    Parse the batches of log lines in a pool of worker processes and merge their partial counts into the buffer
+    The timestamp returned with a batch is the one at which it was read, so that alerts are not delayed by the
+    processing time of the workers.
+    :param batches: (iterable) lists of w3c-formatted log lines, as yielded by Tailer.read_batches
+    :param monitor_buffer: (BucketedLogsBuffer) buffer receiving the counts
+    :param workers: (int) amount of worker processes
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :return: (generator) tuples (now, malformed) every time the lines read at timestamp now are in the buffer
+    """
+    metrics = metrics or SelfMetrics()
+    aggregator = ParallelAggregator(workers, log_format=log_format)
+    try:
+        for batch in batches:
+            for ingested in merge_results(aggregator.submit(batch, time.mktime(time.gmtime())), monitor_buffer,
+                                          metrics):
+                yield ingested
+    finally:
+        aggregator.close()
+
+
+def merge_results(results, monitor_buffer, metrics):
+    """
+    Merge the partial counts of the batches processed by a ParallelAggregator into the buffer
+    :param results: (list) tuples (now, malformed, partials), as returned by ParallelAggregator.submit or collect
+    :param monitor_buffer: (BucketedLogsBuffer) buffer receiving the counts
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :return: (list) tuples (now, malformed) of the merged batches
+    """
+    ingested = []
+    for now, malformed, partials in results:
+        started = time.time()
+        monitor_buffer.clean_old_entries(now)
+        merge_partials(monitor_buffer, partials)
+        metrics.observe("buffer_seconds", time.time() - started)
+        nb_lines = malformed + sum(partial[1] for partial in partials)
+        _record_batch(metrics, time.mktime(time.gmtime()), nb_lines, malformed, partials[-1][0] if partials else None)
+        ingested.append((now, malformed))
+    return ingested
+
+
+class ReorderBuffer:
+    def __init__(self, window):
+        """
+        k-way merge of several streams of entries, each roughly ordered by timestamp, into a single ordered stream
+        Entries are held in a heap until they are older than the newest timestamp seen (or the current time) by more
+        than window seconds, so that a source lagging by less than window seconds is still merged in order.
+        :param window: (float) reorder window, in seconds
+        """
+        self.window = window
+        self.heap = []
+        self.sequence = 0
+        self.newest = None
+
+    def push(self, entries, source=None):
+        """
+        :param entries: (list) ParsedLine of a source
+        :param source: (str) name of the source, returned with its entries
+        """
+        heap, sequence = self.heap, self.sequence
+        for entry in entries:
+            # The sequence number keeps the order of a source between entries of the same timestamp
+            heapq.heappush(heap, (entry.utc_ts, sequence, source, entry))
+            sequence += 1
+        self.sequence = sequence
+        if entries:
+            newest = max(entry.utc_ts for entry in entries)
+            if self.newest is None or newest > self.newest:
+                self.newest = newest
+
+    def release(self, now=None):
+        """
+        :param now: (float) current timestamp, so that entries are released even when every source is idle
+        :return: (list) tuples (source, entry) that left the reorder window, ordered by timestamp
+        """
+        horizon = max(self.newest, now) if now is not None and self.newest is not None else (self.newest or now)
+        if horizon is None:
+            return []
+        horizon -= self.window
+        heap, released = self.heap, []
+        while heap and heap[0][0] <= horizon:
+            _, _, source, entry = heapq.heappop(heap)
+            released.append((source, entry))
+        return released
+
+    def flush(self):
+        """
+        :return: (list) tuples (source, entry) of every entry still held, ordered by timestamp
+        """
+        released = [(source, entry) for _, _, source, entry in sorted(self.heap)]
+        self.heap = []
+        return released
+
+    def __len__(self):
+        return len(self.heap)
+
+
+def ingest_merged(source_batches, monitor_buffer, reorder_window=2.0, source_buffers=None, metrics=None,
+                  log_format=None):
+    """
+    Parse the batches of log lines of several files, merge them by timestamp and add them to the buffer
+    :param source_batches: (iterable) lists of tuples (path, lines), as yielded by MultiTailer.read_batches
+    :param monitor_buffer: (LogsBuffer or alike) buffer receiving the entries
+    :param reorder_window: (float) how late, in seconds, a file may be compared to the others and still be merged in
+                           order
+    :param source_buffers: (defaultdict) if not None, receives the entries of every file in source_buffers[path], for
+                           per-file breakdowns
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :return: (generator) tuples (now, malformed) every time the lines read at timestamp now are in the buffer
+    """
+    metrics = metrics or SelfMetrics()
+    reorder = ReorderBuffer(reorder_window)
+    for batches in source_batches:
+        yield ingest_sources(batches, reorder, monitor_buffer, source_buffers, metrics, log_format)
+
+
+def ingest_sources(batches, reorder, monitor_buffer, source_buffers, metrics, log_format=None):
+    """
+    Parse the batches of log lines of several files, and add the entries leaving the reorder window to the buffer
+    :param batches: (list) tuples (path, lines), as yielded by MultiTailer.read_batches
+    :param reorder: (ReorderBuffer) entries waiting to be merged in timestamp order
+    :param monitor_buffer: (LogsBuffer or alike) buffer receiving the entries
+    :param source_buffers: (defaultdict) if not None, receives the entries of every file in source_buffers[path]
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :return: (tuple) (now, malformed): timestamp at which the batches were ingested, amount of lines that could not be
+             parsed
+    """
+    now = time.mktime(time.gmtime())
+    started = time.time()
+    nb_lines, malformed = 0, 0
+    parse_lines = get_parser(log_format)
+    for path, lines in batches:
+        parsed_lines = parse_lines(lines)
+        reorder.push(parsed_lines, path)
+        nb_lines += len(lines)
+        malformed += len(lines) - len(parsed_lines)
+    parsed = time.time()
+    released = reorder.release(now)
+    monitor_buffer.clean_old_entries(now)
+    for path, parsed_line in released:
+        monitor_buffer.add_entry(parsed_line)
+    if source_buffers is not None:
+        for source_buffer in source_buffers.values():
+            source_buffer.clean_old_entries(now)
+        for path, parsed_line in released:
+            source_buffers[path].add_entry(parsed_line)
+    metrics.observe("parse_seconds", parsed - started)
+    metrics.observe("buffer_seconds", time.time() - parsed)
+    metrics.set("reorder_size", len(reorder))
+    _record_batch(metrics, now, nb_lines, malformed, released[-1][1].utc_ts if released else None)
+    return now, malformed
@@ -0,0 +1,99 @@
+"""
+Offline replay of archived logs, as fast as possible
+The clock is driven by the timestamps of the log lines instead of the wall clock, so that the buffer expiry, the
+alerts and the periodic statistics happen as they would have while the logs were written.
+"""
+
+import gzip
+import io
+from itertools import islice
+from Metrics import SelfMetrics
+from Pipeline import ParallelAggregator, aggregate_batch
+
+_BATCH_SIZE = 8192
+
+
+def open_log(path):
+    """
+    :param path: (str) path to a log file, compressed with gzip if it ends with .gz
+    :return: (file) the log file opened for reading text
+    """
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(path, 'rb')), errors="replace")
+    return open(path, 'r')
+
+
+def read_batches(paths, batch_size=_BATCH_SIZE):
+    """
+    :param paths: (list) paths of the log files, replayed one after the other
+    :param batch_size: (int) amount of lines per batch
+    :return: (generator) lists of log lines
+    """
+    for path in paths:
+        with open_log(path) as log_file:
+            while True:
+                batch = [line.rstrip("\n") for line in islice(log_file, batch_size)]
+                if not batch:
+                    break
+                yield batch
+
+
+def _aggregated_batches(batches, workers, log_format=None):
+    """
+    :param batches: (iterable) lists of log lines
+    :param workers: (int) amount of processes parsing the lines
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :return: (generator) tuples (malformed, partials) as returned by aggregate_batch, in the order of the batches
+    """
+    if workers <= 1:
+        for batch in batches:
+            yield aggregate_batch(batch, log_format)
+        return
+    aggregator = ParallelAggregator(workers, log_format=log_format)
+    try:
+        for batch in batches:
+            for _, malformed, partials in aggregator.submit(batch, None):
+                yield malformed, partials
+        for _, malformed, partials in aggregator.collect(wait=True):
+            yield malformed, partials
+    finally:
+        aggregator.close()
+
+
+def replay(paths, monitor_buffer, workers=1, metrics=None, log_format=None):
+    """
+    Replay log files into the buffer, one simulated second at a time
+    The files should be given in chronological order: the simulated clock never goes backwards, and lines older than
+    the period at the time they are read are ignored. The seconds without lines are ticked too, so that the alerts
+    recover and the statistics are displayed during the silent gaps as they would have been live.
+    :param paths: (list) paths of the log files, plain or gzip compressed
+    :param monitor_buffer: (BucketedLogsBuffer) buffer receiving the counts
+    :param workers: (int) amount of processes parsing the lines
+    :param metrics: (SelfMetrics) where to record the self-metrics of the ingestion
+    :param log_format: (str) format of the lines, as accepted by LogFormat.get_parser
+    :return: (generator) tuples (now, malformed) for every simulated second from the first line to the last one, once
+                         its lines are in the buffer, malformed being the amount of lines skipped since the previous
+                         one
+    """
+    metrics = metrics or SelfMetrics()
+    clock = None
+    skipped = 0
+    for malformed, partials in _aggregated_batches(read_batches(paths), workers, log_format):
+        skipped += malformed
+        metrics.incr("lines_read", malformed + sum(partial[1] for partial in partials))
+        metrics.incr("parse_failures", malformed)
+        metrics.incr("batches")
+        for partial in partials:
+            second = partial[0]
+            if clock is None or second > clock:
+                if clock is not None:
+                    yield clock, skipped
+                    skipped = 0
+                    for silent in range(clock + 1, second):
+                        monitor_buffer.clean_old_entries(silent)
+                        yield silent, 0
+                clock = second
+                monitor_buffer.clean_old_entries(clock)
+            monitor_buffer.add_counts(*partial)
+    if clock is not None:
+        yield clock, skipped
@@ -0,0 +1,325 @@
+"""
+Persistent per-minute rollups of the traffic, for trend queries long after the lines left the buffer
+    - MinuteRollups is fed next to the monitor buffer (see FanoutBuffer) and aggregates the entries of every minute:
+      hits, bytes, status classes, hits per section, and the hits and bytes of the busiest hosts
+    - RollupStore appends the closed minutes to a SQLite database, one transaction per batch of minutes, from the
+      thread of a Sink so that the ingestion never waits for the disk. Section and host names are stored once, every
+      table is indexed on time, and the sections and hosts of every complete hour are also compacted into hourly
+      rows, so that a query over weeks reads hundreds of hours rather than tens of thousands of minutes.
+Run it from the Console_Monitor directory to query the store, for example:
+    python Rollups.py rollups.db --from "2015-12-24 14:00" --to "2015-12-24 15:00" --top 10
+"""
+
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from Buffer import SAMPLED_HOSTS, _Bucket
+from DisplayHelper import format_IS
+
+# Time a minute is kept open after its end, for the late entries
+_GRACE_SECONDS = 5
+# Busiest hosts of every minute (and of every hour) stored
+_HOSTS_PER_MINUTE = 20
+_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS minutes (minute INTEGER NOT NULL, hits INTEGER NOT NULL, bytes INTEGER NOT NULL,
+                                    status_1 INTEGER NOT NULL, status_2 INTEGER NOT NULL, status_3 INTEGER NOT NULL,
+                                    status_4 INTEGER NOT NULL, status_5 INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS minutes_by_time ON minutes (minute);
+CREATE TABLE IF NOT EXISTS sections (minute INTEGER NOT NULL, name_id INTEGER NOT NULL, hits INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS sections_by_time ON sections (minute, name_id, hits);
+CREATE TABLE IF NOT EXISTS hosts (minute INTEGER NOT NULL, name_id INTEGER NOT NULL, hits INTEGER NOT NULL,
+                                  bytes INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS hosts_by_time ON hosts (minute, name_id, hits, bytes);
+CREATE TABLE IF NOT EXISTS hourly_sections (hour INTEGER NOT NULL, name_id INTEGER NOT NULL, hits INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS hourly_sections_by_time ON hourly_sections (hour, name_id, hits);
+CREATE TABLE IF NOT EXISTS hourly_hosts (hour INTEGER NOT NULL, name_id INTEGER NOT NULL, hits INTEGER NOT NULL,
+                                         bytes INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS hourly_hosts_by_time ON hourly_hosts (hour, name_id, hits, bytes);
+CREATE TABLE IF NOT EXISTS compaction (until INTEGER NOT NULL);
+"""
+# Top of a range: the minutes before its first compacted hour, the compacted hours, and the minutes after them
+_TOP_QUERY = ("SELECT name, SUM(hits) AS total, %(bytes)s FROM ("
+              "SELECT name_id, hits%(columns)s FROM %(table)s WHERE minute >= ? AND minute < ? UNION ALL "
+              "SELECT name_id, hits%(columns)s FROM hourly_%(table)s WHERE hour >= ? AND hour < ? UNION ALL "
+              "SELECT name_id, hits%(columns)s FROM %(table)s WHERE minute >= ? AND minute < ?) "
+              "JOIN names ON names.id = name_id GROUP BY name_id ORDER BY total DESC LIMIT ?")
+_TOP_QUERIES = {"section": _TOP_QUERY % {"bytes": "0", "columns": "", "table": "sections"},
+                "host": _TOP_QUERY % {"bytes": "SUM(bytes)", "columns": ", bytes", "table": "hosts"}}
+_TOTALS_QUERY = ("SELECT COUNT(DISTINCT minute), SUM(hits), SUM(bytes), SUM(status_1), SUM(status_2), SUM(status_3), "
+                 "SUM(status_4), SUM(status_5) FROM minutes WHERE minute >= ? AND minute < ?")
+
+
+class MinuteRollups:
+    def __init__(self, grace=_GRACE_SECONDS):
+        """
+        Per-minute counters of the entries, handed over once their minute is over
+        An entry arriving after its minute was handed over opens a new rollup of that minute: the store adds them up.
+        :param grace: (int) time a minute is kept open after its end, in seconds
+        """
+        self.grace = grace
+        self.open_minutes = {}
+
+    def _get_rollup(self, second):
+        """
+        :param second: (int) timestamp of an entry
+        :return: (_Bucket) the rollup of the minute of that second, its second being the start of the minute
+        """
+        minute = second - second % 60
+        rollup = self.open_minutes.get(minute)
+        if rollup is None:
+            rollup = self.open_minutes[minute] = _Bucket(minute)
+        return rollup
+
+    def add_entry(self, parsed_entry):
+        """
+        :param parsed_entry: (NamedTuple) ParsedLine(section, status, host, utc_ts, traffic)
+        """
+        rollup = self._get_rollup(int(parsed_entry.utc_ts))
+        rollup.hits += 1
+        rollup.traffic += parsed_entry.traffic
+        rollup.sections[parsed_entry.section] += 1
+        rollup.statuses[parsed_entry.status] += 1
+        rollup.host_hits[parsed_entry.host] += 1
+        rollup.host_traffic[parsed_entry.host] += parsed_entry.traffic
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Add counts pre-aggregated elsewhere, as BucketedLogsBuffer.add_counts
+        The SAMPLED_HOSTS pseudo-host is not a host: it is not stored among the busiest hosts.
+        """
+        rollup = self._get_rollup(second)
+        rollup.hits += hits
+        rollup.traffic += sum(host_traffic.values())
+        rollup.sections.update(sections)
+        rollup.statuses.update(statuses)
+        if SAMPLED_HOSTS in host_hits or SAMPLED_HOSTS in host_traffic:
+            host_hits = dict((host, count) for host, count in host_hits.items() if host != SAMPLED_HOSTS)
+            host_traffic = dict((host, count) for host, count in host_traffic.items() if host != SAMPLED_HOSTS)
+        rollup.host_hits.update(host_hits)
+        rollup.host_traffic.update(host_traffic)
+
+    def clean_old_entries(self, now):
+        """
+        The rollups are handed over by pop_closed, nothing expires here
+        """
+
+    def pop_closed(self, now=None):
+        """
+        :param now: (float) now timestamp, None to hand over every minute, even the ones still open
+        :return: (list) _Bucket of every minute over (since more than the grace time), by minute
+        """
+        closed = sorted(minute for minute in self.open_minutes if now is None or minute + 60 + self.grace <= now)
+        return [self.open_minutes.pop(minute) for minute in closed]
+
+
+class RollupStore:
+    def __init__(self, path, hosts_per_minute=_HOSTS_PER_MINUTE):
+        """
+        Append-only SQLite store of the per-minute rollups
+        The connection is opened by the first call, so that the store can be built in one thread and used in the
+        thread of a Sink, and the calls are serialized, so that a last write can follow the ones of the Sink.
+        :param path: (str) path of the database, created if needed
+        :param hosts_per_minute: (int) amount of the busiest hosts of every minute stored
+        """
+        self.path = path
+        self.hosts_per_minute = hosts_per_minute
+        self.connection = None
+        self.name_ids = {}
+        # Start of the first hour not compacted yet
+        self.compacted_until = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        """
+        :return: (sqlite3.Connection) the connection to the database, opened and initialized if needed
+        """
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.executescript(_SCHEMA)
+            self._load_state()
+        return self.connection
+
+    def _load_state(self):
+        """
+        Read the names and the compaction progress stored
+        """
+        self.name_ids = dict((name, identifier)
+                             for identifier, name in self.connection.execute("SELECT id, name FROM names"))
+        self.compacted_until = self.connection.execute("SELECT COALESCE(MAX(until), 0) FROM compaction").fetchone()[0]
+
+    def _name_id(self, cursor, name):
+        """
+        :param cursor: (sqlite3.Cursor) cursor of the current transaction
+        :param name: (str) section or host
+        :return: (int) identifier of the name, stored if it is new
+        """
+        identifier = self.name_ids.get(name)
+        if identifier is None:
+            cursor.execute("INSERT INTO names (name) VALUES (?)", (name,))
+            identifier = self.name_ids[name] = cursor.lastrowid
+        return identifier
+
+    def write(self, rollups):
+        """
+        Append rollups to the store, in a single transaction
+        :param rollups: (list) _Bucket of minutes, as returned by MinuteRollups.pop_closed
+        """
+        if not rollups:
+            return
+        with self.lock:
+            connection = self._connect()
+            try:
+                with connection:
+                    cursor = connection.cursor()
+                    self._insert(cursor, rollups)
+                    newest = max(rollup.second for rollup in rollups)
+                    self._compact(cursor, newest - newest % 3600)
+            except sqlite3.Error:
+                # The transaction is rolled back, and with it the names and the compaction it stored
+                self._load_state()
+                raise
+
+    def _insert(self, cursor, rollups):
+        """
+        :param cursor: (sqlite3.Cursor) cursor of the current transaction
+        :param rollups: (list) _Bucket of minutes to insert
+        """
+        for rollup in rollups:
+            classes = Counter()
+            for status, count in rollup.statuses.items():
+                classes[status[:1]] += count
+            cursor.execute("INSERT INTO minutes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (rollup.second, rollup.hits, rollup.traffic) + tuple(classes[str(status_class)]
+                                                                               for status_class in range(1, 6)))
+            sections = [(rollup.second, self._name_id(cursor, section), hits)
+                        for section, hits in rollup.sections.items()]
+            hosts = [(rollup.second, self._name_id(cursor, host), hits, rollup.host_traffic[host])
+                     for host, hits in rollup.host_hits.most_common(self.hosts_per_minute)]
+            cursor.executemany("INSERT INTO sections VALUES (?, ?, ?)", sections)
+            cursor.executemany("INSERT INTO hosts VALUES (?, ?, ?, ?)", hosts)
+            if rollup.second < self.compacted_until:
+                # Late minute of an hour already compacted: its rows are added to the ones of the hour
+                hour = rollup.second - rollup.second % 3600
+                cursor.executemany("INSERT INTO hourly_sections VALUES (?, ?, ?)",
+                                   [(hour,) + row[1:] for row in sections])
+                cursor.executemany("INSERT INTO hourly_hosts VALUES (?, ?, ?, ?)", [(hour,) + row[1:] for row in hosts])
+
+    def _compact(self, cursor, until):
+        """
+        Sum up the sections and the hosts of the hours not compacted yet, up to an hour
+        :param cursor: (sqlite3.Cursor) cursor of the current transaction
+        :param until: (int) start of the first hour to leave as minutes (the one still being written)
+        """
+        if until <= self.compacted_until:
+            return
+        cursor.execute("INSERT INTO hourly_sections SELECT minute - minute % 3600, name_id, SUM(hits) FROM sections "
+                       "WHERE minute >= ? AND minute < ? GROUP BY minute - minute % 3600, name_id",
+                       (self.compacted_until, until))
+        hourly_hosts = {}
+        for row in cursor.execute("SELECT minute - minute % 3600, name_id, SUM(hits), SUM(bytes) FROM hosts "
+                                  "WHERE minute >= ? AND minute < ? GROUP BY minute - minute % 3600, name_id",
+                                  (self.compacted_until, until)).fetchall():
+            hourly_hosts.setdefault(row[0], []).append(row)
+        for rows in hourly_hosts.values():
+            rows.sort(key=lambda row: row[2], reverse=True)
+            cursor.executemany("INSERT INTO hourly_hosts VALUES (?, ?, ?, ?)", rows[:self.hosts_per_minute])
+        cursor.execute("INSERT INTO compaction VALUES (?)", (until,))
+        self.compacted_until = until
+
+    def totals(self, start, end):
+        """
+        :param start: (float) start of the range, timestamp
+        :param end: (float) end of the range (excluded), timestamp
+        :return: (dict) minutes (amount of minutes with traffic), hits, bytes and status_1 to status_5 of the range
+        """
+        with self.lock:
+            row = self._connect().execute(_TOTALS_QUERY, (start, end)).fetchone()
+        keys = ("minutes", "hits", "bytes") + tuple("status_%d" % status_class for status_class in range(1, 6))
+        return dict(zip(keys, [value or 0 for value in row]))
+
+    def top(self, kind, start, end, n=10):
+        """
+        :param kind: (str) "section" or "host" (hosts are only counted in the minutes, or in the compacted hours, they
+                     were among the busiest)
+        :param start: (float) start of the range, timestamp
+        :param end: (float) end of the range (excluded), timestamp
+        :param n: (int) amount of names to return
+        :return: (list) tuples (name, hits, bytes) of the names with most hits in the range, bytes being 0 for the
+                        sections
+        """
+        with self.lock:
+            connection = self._connect()
+            first_hour = min(-(-start // 3600) * 3600, end)
+            last_hour = max(min(end - end % 3600, self.compacted_until), first_hour)
+            return [tuple(row) for row in connection.execute(_TOP_QUERIES[kind], (start, first_hour, first_hour,
+                                                                                   last_hour, last_hour, end, n))]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def parse_date(value):
+    """
+    :param value: (str) local date, as 2015-12-24 14:00, or a timestamp
+    :return: (float) the timestamp of the date
+    :raise ValueError: if the date is not in one of the _DATE_FORMATS
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for date_format in _DATE_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, date_format))
+        except ValueError:
+            continue
+    raise ValueError("unknown date %s, expected YYYY-MM-DD[ HH:MM[:SS]] or a timestamp" % value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the per-minute rollups written by Monitor.py --rollups")
+    parser.add_argument("store", type=str, help="Rollup database")
+    parser.add_argument("--from", dest="start", default="0", type=str,
+                        help="Start of the range: local date (YYYY-MM-DD[ HH:MM[:SS]]) or timestamp")
+    parser.add_argument("--to", dest="end", default=None, type=str,
+                        help="End of the range (excluded), now by default")
+    parser.add_argument("-t", "--top", default=10, type=int,
+                        help="Amount of sections and hosts displayed")
+    args = parser.parse_args()
+    try:
+        start = parse_date(args.start)
+        end = parse_date(args.end) if args.end else time.time()
+    except ValueError as error:
+        parser.error(str(error))
+
+    started = time.time()
+    store = RollupStore(args.store)
+    totals = store.totals(start, end)
+    sections = store.top("section", start, end, args.top)
+    hosts = store.top("host", start, end, args.top)
+    elapsed = time.time() - started
+    store.close()
+
+    print("%d minutes with traffic - %d hits - %sB of traffic - statuses %s" % (
+        totals["minutes"], totals["hits"], format_IS(totals["bytes"]),
+        " ".join("%dxx: %d" % (status_class, totals["status_%d" % status_class]) for status_class in range(1, 6))))
+    print("\nTOP SECTIONS")
+    for name, hits, _ in sections:
+        print("/%s %d hits (%2d%%)" % (name, hits, 100. * hits / max(totals["hits"], 1)))
+    print("\nTOP HOSTS")
+    for name, hits, traffic in hosts:
+        print("%s %d hits - %sB of traffic" % (name, hits, format_IS(traffic)))
+    print("\nanswered in %.1f ms" % (elapsed * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Rule engine: evaluates many alert rules at once, each with its own metric, window and hysteresis.
+Every rule is served by one shared set of per-second buckets. Each distinct window keeps running totals, updated
+once per second with the buckets entering and leaving it. The cost of a check therefore depends on the amount of
+rules, not on the amount of lines. The only exception is the rules watching the busiest section or host, which scan
+the keys of their window.
+The rules are configured in a JSON file, for example:
+    {"rules": [
+        {"name": "traffic", "metric": "hits", "window": 120, "threshold": 2, "recovery_threshold": 1.8},
+        {"name": "api", "metric": "section_hits", "key": "api", "window": 10, "threshold": 50},
+        {"name": "errors", "metric": "error_ratio", "window": 60, "threshold": 0.05, "min_hits": 100},
+        {"name": "bandwidth", "metric": "bytes", "window": 900, "threshold": 1000000},
+        {"name": "greedy host", "metric": "host_hits", "window": 60, "threshold": 10}
+    ]}
+"""
+
+import json
+from collections import Counter
+from Buffer import SAMPLED_HOSTS, _Bucket
+from Warden import AlertRule
+
+_METRICS = ("hits", "bytes", "section_hits", "host_hits", "error_ratio")
+_RULE_FIELDS = ("name", "metric", "window", "threshold", "recovery_threshold", "key", "min_hits")
+
+
+class _WindowTotals(object):
+    __slots__ = ("window", "oldest", "hits", "traffic", "errors", "sections", "hosts")
+
+    def __init__(self, window, sections, hosts):
+        """
+        Running totals of the buckets of the last window seconds
+        :param window: (int) time frame, in seconds
+        :param sections: (bool) keep the hits of every section
+        :param hosts: (bool) keep the hits of every host
+        """
+        self.window = window
+        self.oldest = None
+        self.hits = 0
+        self.traffic = 0
+        self.errors = 0
+        self.sections = Counter() if sections else None
+        self.hosts = Counter() if hosts else None
+
+    def add(self, bucket, sign=1):
+        """
+        :param bucket: (_Bucket) counts entering (sign=1) or leaving (sign=-1) the window
+        :param sign: (int) 1 or -1
+        """
+        self.hits += sign * bucket.hits
+        self.traffic += sign * bucket.traffic
+        self.errors += sign * sum(count for status, count in bucket.statuses.items() if status[:1] == "5")
+        if self.sections is not None:
+            _add_to_counter(self.sections, bucket.sections, sign)
+        if self.hosts is not None:
+            _add_to_counter(self.hosts, bucket.host_hits, sign)
+
+
+def _add_to_counter(counter, counts, sign):
+    """
+    :param counter: (Counter) totals, the keys dropping to zero are removed
+    :param counts: (dict) counts to add (sign=1) or remove (sign=-1)
+    :param sign: (int) 1 or -1
+    """
+    for key, count in counts.items():
+        total = counter[key] + sign * count
+        if total:
+            counter[key] = total
+        else:
+            del counter[key]
+
+
+class WindowCounters:
+    def __init__(self, rules):
+        """
+        Per-second buckets of the traffic, shared by the rules, and running totals of every window the rules use
+        A second is folded into the totals once it is over, so the totals lag the traffic by less than a second.
+        :param rules: (list) AlertRule served by the counters
+        """
+        self.longest = max(rule.window for rule in rules)
+        self.buckets = {}
+        self.folded_until = None
+        self.totals = {}
+        for rule in rules:
+            totals = self.totals.get(rule.window)
+            if totals is None:
+                totals = self.totals[rule.window] = _WindowTotals(rule.window, False, False)
+            if rule.metric == "section_hits" and totals.sections is None:
+                totals.sections = Counter()
+            if rule.metric == "host_hits" and totals.hosts is None:
+                totals.hosts = Counter()
+
+    def _get_bucket(self, second):
+        """
+        :param second: (int) timestamp of the bucket
+        :return: (_Bucket) the bucket of that second, created if needed, or None if it is older than every window
+        """
+        bucket = self.buckets.get(second)
+        if bucket is None:
+            if self.folded_until is not None and second < self.folded_until - self.longest:
+                return None
+            bucket = self.buckets[second] = _Bucket(second)
+        return bucket
+
+    def _add_late(self, second, counts):
+        """
+        Add the counts of a second already folded to the totals of the windows still holding that second
+        :param second: (int) timestamp of the counts
+        :param counts: (_Bucket) counts to add
+        """
+        if self.folded_until is not None and second < self.folded_until:
+            for totals in self.totals.values():
+                if totals.oldest is not None and second >= totals.oldest:
+                    totals.add(counts)
+
+    def add_entry(self, parsed_entry):
+        """
+        :param parsed_entry: (NamedTuple) ParsedLine(section, status, host, utc_ts, traffic)
+        """
+        second = int(parsed_entry.utc_ts)
+        bucket = self._get_bucket(second)
+        if bucket is None:
+            return
+        bucket.hits += 1
+        bucket.traffic += parsed_entry.traffic
+        bucket.sections[parsed_entry.section] += 1
+        bucket.statuses[parsed_entry.status] += 1
+        bucket.host_hits[parsed_entry.host] += 1
+        if self.folded_until is not None and second < self.folded_until:
+            late = _Bucket(second)
+            late.hits, late.traffic = 1, parsed_entry.traffic
+            late.sections[parsed_entry.section] = late.statuses[parsed_entry.status] = 1
+            late.host_hits[parsed_entry.host] = 1
+            self._add_late(second, late)
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        """
+        Add counts pre-aggregated elsewhere, as BucketedLogsBuffer.add_counts
+        The SAMPLED_HOSTS pseudo-host is not a host: the host rules ignore it.
+        """
+        bucket = self._get_bucket(second)
+        if bucket is None:
+            return
+        if SAMPLED_HOSTS in host_hits:
+            host_hits = dict((host, count) for host, count in host_hits.items() if host != SAMPLED_HOSTS)
+        counts = _Bucket(second)
+        counts.hits, counts.traffic = hits, sum(host_traffic.values())
+        counts.sections.update(sections)
+        counts.statuses.update(statuses)
+        counts.host_hits.update(host_hits)
+        bucket.hits += counts.hits
+        bucket.traffic += counts.traffic
+        bucket.sections.update(sections)
+        bucket.statuses.update(statuses)
+        bucket.host_hits.update(host_hits)
+        self._add_late(second, counts)
+
+    def advance(self, now):
+        """
+        Fold the seconds that are over into the totals, and remove the seconds leaving every window
+        :param now: (float) now timestamp
+        """
+        current = int(now)
+        if self.folded_until is None:
+            self.folded_until = min(self.buckets) if self.buckets else current
+            for totals in self.totals.values():
+                totals.oldest = self.folded_until
+        if current <= self.folded_until:
+            return
+        for second in self._seconds(self.folded_until, current):
+            for totals in self.totals.values():
+                if second >= current - totals.window:
+                    totals.add(self.buckets[second])
+        for totals in self.totals.values():
+            limit = current - totals.window
+            for second in self._seconds(totals.oldest, min(limit, self.folded_until)):
+                totals.add(self.buckets[second], -1)
+            totals.oldest = max(totals.oldest, limit)
+        self.folded_until = current
+        for second in self._seconds(None, current - self.longest):
+            del self.buckets[second]
+
+    def _seconds(self, start, end):
+        """
+        :return: (list) seconds in [start, end) having a bucket, ordered, start None meaning from the oldest
+        """
+        if start is not None and end - start <= len(self.buckets):
+            return [second for second in range(start, end) if second in self.buckets]
+        return sorted(second for second in self.buckets if (start is None or second >= start) and second < end)
+
+    def value(self, rule):
+        """
+        :param rule: (AlertRule) rule served by these counters
+        :return: (float) current value of the metric of the rule
+        """
+        totals = self.totals[rule.window]
+        if rule.metric == "hits":
+            return float(totals.hits) / rule.window
+        if rule.metric == "bytes":
+            return float(totals.traffic) / rule.window
+        if rule.metric == "error_ratio":
+            return float(totals.errors) / totals.hits if totals.hits and totals.hits >= rule.min_hits else 0.
+        counts = totals.sections if rule.metric == "section_hits" else totals.hosts
+        if rule.key is not None:
+            return float(counts.get(rule.key, 0)) / rule.window
+        return float(max(counts.values())) / rule.window if counts else 0.
+
+
+class RuleEngine:
+    def __init__(self, rules):
+        """
+        Evaluate alert rules over shared per-second counters
+        The engine receives the entries like a buffer (add_entry, add_counts, clean_old_entries), so that it can be
+        fed by the ingestion pipeline next to the monitor buffer.
+        :param rules: (list) AlertRule to evaluate
+        """
+        self.rules = rules
+        self.counters = WindowCounters(rules)
+
+    def add_entry(self, parsed_entry):
+        self.counters.add_entry(parsed_entry)
+
+    def add_counts(self, second, hits, sections, statuses, host_hits, host_traffic):
+        self.counters.add_counts(second, hits, sections, statuses, host_hits, host_traffic)
+
+    def clean_old_entries(self, now):
+        self.counters.advance(now)
+
+    def update(self, now):
+        """
+        Evaluate every rule
+        :param now: (float) now timestamp
+        :return: (list) tuples (rule, message_type, data) of the rules whose alert state changed, as AlertWarden.update
+        """
+        self.counters.advance(now)
+        changes = []
+        for rule in self.rules:
+            message_type, data = rule.update(self.counters.value(rule), now)
+            if message_type != 2:
+                changes.append((rule, message_type, data))
+        return changes
+
+
+def load_rules(path):
+    """
+    :param path: (str) JSON file describing the rules, as in the example at the top of this module
+    :return: (list) AlertRule
+    :raise ValueError: if the file does not describe valid rules
+    """
+    with open(path, 'r') as rules_file:
+        config = json.load(rules_file)
+    rules = []
+    for fields in config.get("rules", []):
+        unknown = set(fields) - set(_RULE_FIELDS)
+        if unknown:
+            raise ValueError("Unknown fields in rule %s: %s" % (fields.get("name"), ", ".join(sorted(unknown))))
+        if fields.get("metric") not in _METRICS:
+            raise ValueError("Rule %s: metric must be one of %s" % (fields.get("name"), ", ".join(_METRICS)))
+        if int(fields.get("window", 0)) <= 0 or "threshold" not in fields or "name" not in fields:
+            raise ValueError("Rule %s: name, a positive window and a threshold are required" % fields.get("name"))
+        fields = dict(fields, window=int(fields["window"]))
+        rules.append(AlertRule(**fields))
+    if not rules:
+        raise ValueError("No rule found in %s" % path)
+    return rules
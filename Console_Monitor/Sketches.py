@@ -0,0 +1,266 @@
+"""
+Streaming sketches keeping approximate statistics in a bounded amount of memory:
+    - SpaceSaving: heaviest keys of a stream and an over-estimation of their counts
+    - CountMinSketch: over-estimation of the count of any key
+    - HyperLogLog: estimation of the amount of distinct keys
+    - DDSketch: quantiles of a stream of values, within a relative error
+Hashes are computed with md5 so that sketches built by different processes can be compared and merged
+"""
+
+import math
+import struct
+from array import array
+from hashlib import md5
+
+
+def hash64(key):
+    """
+    :param key: (str) key to hash
+    :return: (int) 64 bits hash of the key, stable across processes
+    """
+    return struct.unpack("<Q", md5(key.encode("utf-8")).digest()[:8])[0]
+
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        """
+        Keep track of the heaviest keys of a stream. Every count is over-estimated by at most self.floor, which stays
+        below total/capacity.
+        :param capacity: (int) amount of keys kept after a pruning (the dict grows up to twice that size in between)
+        """
+        self.capacity = capacity
+        self.counts = {}
+        self.floor = 0
+
+    @classmethod
+    def from_error(cls, error):
+        """
+        :param error: (float) maximum over-estimation of a count, as a fraction of the total weight of the stream
+        :return: (SpaceSaving) sized to guarantee that error
+        """
+        return cls(int(math.ceil(1. / error)))
+
+    def add(self, key, weight=1):
+        """
+        Count a new occurrence of a key
+        :param key: (str) key to count
+        :param weight: (int) weight of the occurrence
+        """
+        counts = self.counts
+        if key in counts:
+            counts[key] += weight
+        else:
+            counts[key] = self.floor + weight
+            if len(counts) >= 2 * self.capacity:
+                self._prune()
+
+    def _prune(self):
+        """
+        Only keep the capacity heaviest keys, the count of the heaviest dropped key becomes the new floor
+        """
+        kept = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        if len(kept) > self.capacity:
+            self.floor = max(self.floor, kept[self.capacity][1])
+            self.counts = dict(kept[:self.capacity])
+
+    def merge(self, other):
+        """
+        Add the counts of another summary to this one
+        :param other: (SpaceSaving) summary of another part of the stream
+        """
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, self.floor) + count
+        for key in self.counts:
+            if key not in other.counts:
+                self.counts[key] += other.floor
+        self.floor += other.floor
+        if len(self.counts) > self.capacity:
+            self._prune()
+
+    def most_common(self, n=None):
+        """
+        :param n: (int) amount of keys to return, all of them if None
+        :return: (list) tuples (key, estimated count), heaviest first
+        """
+        ordered = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return ordered if n is None else ordered[:n]
+
+
+class CountMinSketch:
+    def __init__(self, width, depth):
+        """
+        Over-estimate the count of any key, within total*e/width with probability 1 - exp(-depth)
+        :param width: (int) amount of counters per row
+        :param depth: (int) amount of rows, hashed independently
+        """
+        self.width = width
+        self.depth = depth
+        self.rows = [array('d', [0]) * width for _ in range(depth)]
+
+    @classmethod
+    def from_error(cls, error, probability=0.01):
+        """
+        :param error: (float) maximum over-estimation of a count, as a fraction of the total weight of the stream
+        :param probability: (float) probability that a count is over-estimated by more than error
+        :return: (CountMinSketch) sized to guarantee that error
+        """
+        return cls(int(math.ceil(math.e / error)), int(math.ceil(math.log(1. / probability))))
+
+    def _indexes(self, hashed):
+        """
+        :param hashed: (int) 64 bits hash of a key
+        :return: (generator) index of the key in every row, derived from two halves of the hash
+        """
+        low, high = hashed & 0xffffffff, hashed >> 32
+        return ((low + i * high) % self.width for i in range(self.depth))
+
+    def add(self, hashed, weight=1):
+        """
+        :param hashed: (int) 64 bits hash of the key to count
+        :param weight: (int) weight of the occurrence
+        """
+        for row, index in zip(self.rows, self._indexes(hashed)):
+            row[index] += weight
+
+    def estimate(self, hashed):
+        """
+        :param hashed: (int) 64 bits hash of a key
+        :return: (float) over-estimation of the count of the key
+        """
+        return min(row[index] for row, index in zip(self.rows, self._indexes(hashed)))
+
+
+class HyperLogLog:
+    def __init__(self, precision):
+        """
+        Estimate the amount of distinct keys, with a relative standard error of 1.04/sqrt(2**precision)
+        :param precision: (int) the sketch uses 2**precision one byte registers
+        """
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_error(cls, error):
+        """
+        :param error: (float) relative standard error of the estimation
+        :return: (HyperLogLog) sized to guarantee that error
+        """
+        return cls(min(max(int(math.ceil(2 * math.log(1.04 / error, 2))), 4), 18))
+
+    def add(self, hashed):
+        """
+        :param hashed: (int) 64 bits hash of the key to register
+        """
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        :param other: (HyperLogLog) sketch with the same precision, of another part of the stream
+        """
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        """
+        :return: (int) estimated amount of distinct keys registered
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2. ** -register for register in self.registers)
+        zeros = self.registers.count(b"\x00")
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class DDSketch:
+    def __init__(self, relative_accuracy=0.01, max_bins=1024):
+        """
+        Estimate the quantiles of a stream of positive values, within relative_accuracy of the true value
+        Values are counted in logarithmic bins, so the sketches of different parts of a stream can be merged, and
+        removed again, exactly. When there are more than max_bins bins, the lowest ones are collapsed together: only
+        the accuracy of the lowest quantiles suffers.
+        :param relative_accuracy: (float) maximum relative error of a quantile
+        :param max_bins: (int) maximum amount of bins, bounding the memory used whatever the values
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        # Values too small to be told apart from 0 (including 0 itself)
+        self.zeros = 0
+        self.count = 0
+        # Index the bins below are collapsed into, None while nothing was collapsed
+        self.min_index = None
+
+    def _index(self, index):
+        """
+        :param index: (int) bin of a value, as computed without collapsing
+        :return: (int) bin actually holding the value
+        """
+        return index if self.min_index is None or index > self.min_index else self.min_index
+
+    def add(self, value, weight=1):
+        """
+        :param value: (float) value to register, negative values being counted as 0
+        :param weight: (int) weight of the occurrence
+        """
+        self.count += weight
+        if value <= 1e-9:
+            self.zeros += weight
+            return
+        index = self._index(int(math.ceil(math.log(value) / self.log_gamma)))
+        self.bins[index] = self.bins.get(index, 0) + weight
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        """
+        Merge the lowest bins together until there are max_bins of them
+        """
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins + 1
+        self.min_index = indexes[excess - 1]
+        self.bins[self.min_index] = sum(self.bins.pop(index) for index in indexes[:excess])
+
+    def merge(self, other, sign=1):
+        """
+        :param other: (DDSketch) sketch with the same relative accuracy, of another part of the stream
+        :param sign: (int) 1 to add it, -1 to remove it (it must have been merged or added before)
+        """
+        if other.min_index is not None and (self.min_index is None or other.min_index > self.min_index):
+            self.min_index = other.min_index
+            for index in [index for index in self.bins if index < self.min_index]:
+                self.bins[self.min_index] = self.bins.get(self.min_index, 0) + self.bins.pop(index)
+        for index, count in other.bins.items():
+            index = self._index(index)
+            count = self.bins.get(index, 0) + sign * count
+            if count:
+                self.bins[index] = count
+            else:
+                self.bins.pop(index, None)
+        self.zeros += sign * other.zeros
+        self.count += sign * other.count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q):
+        """
+        :param q: (float) quantile, between 0 and 1
+        :return: (float) estimation of the quantile, None if the sketch is empty
+        """
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
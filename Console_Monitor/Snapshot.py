@@ -0,0 +1,179 @@
+"""
+Mergeable snapshots of the per-second counters of a monitor, so that the monitors of several hosts can be aggregated
+into a fleet-wide view (see Aggregator.py).
+A snapshot is serialized in a compact binary format: every section, status and host is written once in a string
+table, and the per-second counters refer to it by index.
+Merging snapshots sums their counters second by second, so it is associative and commutative.
+"""
+
+import os
+import struct
+
+_MAGIC = b"HLS1"
+_HEADER = struct.Struct("<4sI")
+_LENGTH = struct.Struct("<I")
+_STRING_LENGTH = struct.Struct("<H")
+_SECOND = struct.Struct("<qI")
+_COUNT = struct.Struct("<IQ")
+_replace = getattr(os, "replace", os.rename)
+
+
+def aggregate_entries(entries):
+    """
+    Pre-aggregate parsed log lines per second
+    :param entries: (iterable) ParsedLine
+    :return: (dict) {second: [hits, sections, statuses, host_hits, host_traffic]}, the last four being dicts of counts
+    """
+    seconds = {}
+    for entry in entries:
+        second = int(entry.utc_ts)
+        counts = seconds.get(second)
+        if counts is None:
+            counts = seconds[second] = [0, {}, {}, {}, {}]
+        counts[0] += 1
+        sections, statuses, host_hits, host_traffic = counts[1:]
+        sections[entry.section] = sections.get(entry.section, 0) + 1
+        statuses[entry.status] = statuses.get(entry.status, 0) + 1
+        host_hits[entry.host] = host_hits.get(entry.host, 0) + 1
+        host_traffic[entry.host] = host_traffic.get(entry.host, 0) + entry.traffic
+    return seconds
+
+
+def _add_counts(total, counts):
+    """
+    :param total: (dict) counts receiving the sum
+    :param counts: (dict) counts to add
+    """
+    for key, count in counts.items():
+        total[key] = total.get(key, 0) + count
+
+
+class WindowSnapshot:
+    def __init__(self, seconds=None):
+        """
+        Per-second counters of the window of a monitor
+        :param seconds: (dict) {second: [hits, sections, statuses, host_hits, host_traffic]}, as returned by
+                        aggregate_entries
+        """
+        self.seconds = seconds if seconds is not None else {}
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        :param entries: (iterable) ParsedLine
+        :return: (WindowSnapshot) counters of the entries
+        """
+        return cls(aggregate_entries(entries))
+
+    def partials(self):
+        """
+        :return: (list) tuples (second, hits, sections, statuses, host_hits, host_traffic) ordered by second, as
+                 expected by BucketedLogsBuffer.add_counts
+        """
+        return [(second,) + tuple(counts) for second, counts in sorted(self.seconds.items())]
+
+    def merge(self, other):
+        """
+        :param other: (WindowSnapshot) snapshot of another node
+        :return: (WindowSnapshot) new snapshot holding the sum of both, neither of them is modified
+        """
+        merged = WindowSnapshot()
+        for snapshot in (self, other):
+            for second, counts in snapshot.seconds.items():
+                total = merged.seconds.get(second)
+                if total is None:
+                    total = merged.seconds[second] = [0, {}, {}, {}, {}]
+                total[0] += counts[0]
+                for total_counts, added_counts in zip(total[1:], counts[1:]):
+                    _add_counts(total_counts, added_counts)
+        return merged
+
+    def __eq__(self, other):
+        return isinstance(other, WindowSnapshot) and self.seconds == other.seconds
+
+    def __ne__(self, other):
+        return not self == other
+
+    def to_bytes(self):
+        """
+        :return: (bytes) the snapshot in its binary format
+        """
+        strings = {}
+        records = []
+        for second, counts in sorted(self.seconds.items()):
+            records.append(_SECOND.pack(second, counts[0]))
+            for key_counts in counts[1:]:
+                records.append(_LENGTH.pack(len(key_counts)))
+                for key, count in key_counts.items():
+                    index = strings.get(key)
+                    if index is None:
+                        index = strings[key] = len(strings)
+                    records.append(_COUNT.pack(index, count))
+        table = [None] * len(strings)
+        for key, index in strings.items():
+            table[index] = key
+        parts = [_HEADER.pack(_MAGIC, len(table))]
+        for key in table:
+            encoded = key.encode("utf-8")
+            parts.append(_STRING_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+        parts.append(_LENGTH.pack(len(self.seconds)))
+        return b"".join(parts + records)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: (bytes) snapshot in its binary format
+        :return: (WindowSnapshot)
+        :raise ValueError: if the data is not a valid snapshot
+        """
+        try:
+            magic, nb_strings = _HEADER.unpack_from(data, 0)
+            if magic != _MAGIC:
+                raise ValueError("not a snapshot")
+            position = _HEADER.size
+            table = []
+            for _ in range(nb_strings):
+                length, = _STRING_LENGTH.unpack_from(data, position)
+                position += _STRING_LENGTH.size
+                table.append(data[position:position + length].decode("utf-8"))
+                position += length
+            nb_seconds, = _LENGTH.unpack_from(data, position)
+            position += _LENGTH.size
+            seconds = {}
+            for _ in range(nb_seconds):
+                second, hits = _SECOND.unpack_from(data, position)
+                position += _SECOND.size
+                counts = seconds[second] = [hits]
+                for _ in range(4):
+                    nb_keys, = _LENGTH.unpack_from(data, position)
+                    position += _LENGTH.size
+                    key_counts = {}
+                    for _ in range(nb_keys):
+                        index, count = _COUNT.unpack_from(data, position)
+                        position += _COUNT.size
+                        key_counts[table[index]] = count
+                    counts.append(key_counts)
+        except (struct.error, IndexError, UnicodeDecodeError):
+            raise ValueError("truncated or corrupted snapshot")
+        return cls(seconds)
+
+    def save(self, path):
+        """
+        Atomically write the snapshot to a file, so that a reader never sees a partial snapshot
+        :param path: (str) where to write the snapshot
+        """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(self.to_bytes())
+        _replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: (str) file written by save
+        :return: (WindowSnapshot)
+        :raise ValueError: if the file is not a valid snapshot
+        """
+        with open(path, 'rb') as snapshot_file:
+            return cls.from_bytes(snapshot_file.read())
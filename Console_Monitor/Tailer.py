@@ -3,20 +3,188 @@ Tracks new lines in a file
 The new lines are returned by the read method, as a generator
 (Credit goes to Jeff Bauer, that described this method on StackOverflow, I had a hard time finding a way:
 http://stackoverflow.com/questions/5419888/reading-from-a-frequently-updated-file)
+The read_batches method is the high throughput alternative: it reads big chunks of the file and yields lists of
+complete lines, waking up on inotify events when they are available instead of sleeping for a fixed time.
+It follows the file through rotations and truncations, and can checkpoint its position to resume after a restart
+MultiTailer follows several files at once, given as paths or glob patterns, and picks up the files created later on
 """
 
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
 import time
 
+_DEFAULT_CHUNK_SIZE = 1 << 16
+_MIN_POLLING_DELAY = 0.01
+_DEFAULT_RESCAN_INTERVAL = 5.0
+# Names under which a rotated file is looked for, next to the tailed one, when resuming from a checkpoint
+_ROTATED_SUFFIXES = (".1", ".0", "-old")
+_UNCHANGED, _ROTATED, _TRUNCATED = range(3)
+_replace = getattr(os, "replace", os.rename)
+
+# Constants taken from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVE_SELF = 0x00000800
+_IN_DELETE_SELF = 0x00000400
+_IN_NONBLOCK = 0x00000800
+_IN_CLOEXEC = 0x00080000
+_INOTIFY_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVE_SELF | _IN_DELETE_SELF
+
+
+class PollingNotifier:
+    def __init__(self, refresh_rate, min_delay=_MIN_POLLING_DELAY):
+        """
+        Wait for new data by sleeping, with a delay that doubles every time nothing new is found
+        :param refresh_rate (float): Maximum time to wait between two checks of the file
+        :param min_delay (float): Time to wait right after some data was found
+        """
+        self.refresh_rate = refresh_rate
+        self.min_delay = min(min_delay, refresh_rate)
+        self.delay = self.min_delay
+
+    def wait(self):
+        """
+        Sleep until the next check of the file, and back off for the next call
+        """
+        time.sleep(self.delay)
+        self.delay = min(2 * self.delay, self.refresh_rate)
+
+    def reset(self):
+        """
+        Some data was found: go back to the most reactive delay
+        """
+        self.delay = self.min_delay
+
+    def close(self):
+        pass
+
+
+class InotifyNotifier:
+    def __init__(self, tailed_file_path, refresh_rate):
+        """
+        Wait for new data by blocking on inotify events of the tailed file (Linux only)
+        :param tailed_file_path (string): Path to the file that we want to follow
+        :param refresh_rate (float): Maximum time to block, so that a stop request is noticed
+        :raise OSError: if inotify is not available on this system
+        """
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.refresh_rate = refresh_rate
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        path = tailed_file_path.encode() if not isinstance(tailed_file_path, bytes) else tailed_file_path
+        if libc.inotify_add_watch(self.fd, path, _INOTIFY_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def wait(self):
+        """
+        Block until the file is modified (or refresh_rate elapsed), then drain the pending events
+        """
+        readable, _, _ = select.select([self.fd], [], [], self.refresh_rate)
+        if readable:
+            try:
+                os.read(self.fd, 4096)
+            except OSError:
+                pass
+
+    def reset(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_notifier(tailed_file_path, refresh_rate):
+    """
+    Build the most efficient notifier available for the file
+    :param tailed_file_path (string): Path to the file that we want to follow
+    :param refresh_rate (float): Maximum time to wait between two checks of the file
+    :return: (InotifyNotifier or PollingNotifier)
+    """
+    try:
+        return InotifyNotifier(tailed_file_path, refresh_rate)
+    except (OSError, AttributeError):
+        return PollingNotifier(refresh_rate)
+
+
+def _decode(data):
+    """
+    :param data: (bytes) raw content read from the tailed file
+    :return: (str) the content as a native string
+    """
+    return data if str is bytes else data.decode("utf-8", "replace")
+
+
+class Checkpoint:
+    def __init__(self, checkpoint_path):
+        """
+        Persist the position reached in the tailed file, so that a restart resumes where we stopped
+        :param checkpoint_path (string): Path to the file where the (inode, offset) position is stored
+        """
+        self.checkpoint_path = checkpoint_path
+
+    def load(self):
+        """
+        :return: (tuple) (inode, offset) saved by the last run, or None if there is no valid checkpoint
+        """
+        try:
+            with open(self.checkpoint_path, 'r') as checkpoint_file:
+                inode, offset = checkpoint_file.read().split()
+            return int(inode), int(offset)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, inode, offset):
+        """
+        Atomically replace the checkpoint with a new position
+        :param inode: (int) inode of the file being tailed
+        :param offset: (int) offset in bytes following the last line handed to the consumer
+        """
+        temporary_path = self.checkpoint_path + ".tmp"
+        with open(temporary_path, 'w') as checkpoint_file:
+            checkpoint_file.write("%d %d\n" % (inode, offset))
+        _replace(temporary_path, self.checkpoint_path)
+
 
 class Tailer:
-    def __init__(self, tailed_file_path, refresh_rate=1.0):
+    def __init__(self, tailed_file_path, refresh_rate=1.0, chunk_size=_DEFAULT_CHUNK_SIZE, from_start=False,
+                 checkpoint_path=None, checkpoint_interval=1.0, start_offset=None):
         """
         Construct the tailer
         :param tailed_file_path (string): Path to the file that we want to follow
         :param refresh_rate (float): Time to wait when no new line is found (since we don't need extreme reactivity)
+        :param chunk_size (int): Amount of bytes read at once by read_batches
+        :param from_start (bool): Read the file from its beginning instead of only following the new lines
+        :param checkpoint_path (string): Where read_batches persists its position, None to disable checkpoints
+        :param checkpoint_interval (float): Minimum time in seconds between two writes of the checkpoint
+        :param start_offset (int): Offset from which to read the file when there is no checkpoint (overrides
+                                   from_start), the end of a backlog ingested in bulk for example
         """
         self.tailed_file_path = tailed_file_path
         self.refresh_rate = refresh_rate
+        self.chunk_size = chunk_size
+        self.from_start = from_start
+        self.checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+        self.checkpoint_interval = checkpoint_interval
+        self.start_offset = start_offset
+        self.next_checkpoint = 0
+        self.inode = None
+        self.offset = 0
+        self.tailed_file = None
+        self.pending = b""
+        self.unacknowledged = 0
+        self.reopened = False
         self.proceed = True
 
     def read(self):
@@ -25,7 +193,8 @@ class Tailer:
         :return unnamed (generator): containing all lines written in the monitored file since the method was called
         """
         with open(self.tailed_file_path, 'r') as tailed_file:
-            tailed_file.seek(0, 2)
+            if not self.from_start:
+                tailed_file.seek(0, 2)
             while self.proceed:
                 line = tailed_file.readline()
                 if not line:
@@ -33,8 +202,287 @@ class Tailer:
                 else:
                     yield line.strip("\n")
 
+    def read_batches(self):
+        """
+        Pseudo-infinite loop that yields the new lines written in the file at self.tailed_file_path, by batches.
+        A partial last line is held back until the writer completes it.
+        When the file is rotated, the old file is drained before switching to the new one.
+        When the file is truncated, it is read again from its beginning.
+        A batch is checkpointed once the consumer asks for the next one, so after a crash or a stop the last batch
+        may be delivered again, but no line is ever skipped.
+        :return unnamed (generator): lists of the complete lines written in the monitored file since the method was
+                                     called (or since the checkpoint)
+        """
+        self.open()
+        notifier = make_notifier(self.tailed_file_path, self.refresh_rate)
+        try:
+            while self.proceed:
+                lines = self.poll()
+                if self.reopened:
+                    self.reopened = False
+                    notifier.close()
+                    notifier = make_notifier(self.tailed_file_path, self.refresh_rate)
+                if lines:
+                    notifier.reset()
+                    yield lines
+                    self.acknowledge()
+                else:
+                    notifier.wait()
+                self._save_checkpoint()
+        finally:
+            notifier.close()
+            self.close()
+
+    def open(self):
+        """
+        Open the tailed file, to read it with poll
+        """
+        self.tailed_file = self._open_initial()
+        self.pending = b""
+        self.unacknowledged = 0
+        self.reopened = False
+
+    def poll(self):
+        """
+        Read the complete lines available right now, without waiting, following rotations and truncations
+        :return: (list) the new lines, empty if there are none
+        """
+        while True:
+            chunk = self.tailed_file.read(self.chunk_size)
+            if not chunk:
+                change = self._detect_change(self.tailed_file)
+                if change == _TRUNCATED:
+                    self.tailed_file.seek(0)
+                    self.offset = 0
+                    self.pending = b""
+                    continue
+                if change != _ROTATED:
+                    return []
+                # Catch up with what was written between our last read and the rotation
+                chunk = self.tailed_file.read()
+                if not chunk:
+                    lines = [_decode(self.pending)] if self.pending else []
+                    self.pending = b""
+                    self.tailed_file.close()
+                    self.tailed_file = self._open_rotated()
+                    self.reopened = True
+                    if lines:
+                        return lines
+                    continue
+            last_newline = chunk.rfind(b"\n")
+            if last_newline == -1:
+                self.pending += chunk
+                continue
+            block = self.pending + chunk[:last_newline]
+            self.pending = chunk[last_newline + 1:]
+            self.unacknowledged += len(block) + 1
+            return _decode(block).split("\n")
+
+    def acknowledge(self):
+        """
+        Mark the lines returned by poll as processed, so that the checkpoint moves past them
+        """
+        self.offset += self.unacknowledged
+        self.unacknowledged = 0
+
+    def close(self):
+        """
+        Close the tailed file, and save the checkpoint
+        """
+        self.tailed_file.close()
+        self._save_checkpoint(force=True)
+
     def stop(self):
         """
         Stop the file tailing
         """
         self.proceed = False
+
+    def lag(self):
+        """
+        :return: (int) amount of bytes written in the tailed file that read_batches did not hand to its consumer yet
+        """
+        try:
+            size = os.stat(self.tailed_file_path).st_size
+        except OSError:
+            return 0
+        return max(size - self.offset, 0)
+
+    def _open_initial(self):
+        """
+        Open the file to tail and position it: at the checkpoint if there is a valid one, else at start_offset if it is
+        set, else at its end (or at its beginning if from_start is set).
+        If the checkpointed file was rotated while we were down, it is looked for next to the tailed file to be
+        drained first.
+        :return: (file) the opened file, in binary mode
+        """
+        tailed_file = open(self.tailed_file_path, 'rb')
+        self.inode = os.fstat(tailed_file.fileno()).st_ino
+        saved = self.checkpoint.load() if self.checkpoint else None
+        if saved is None:
+            if self.start_offset is not None:
+                tailed_file.seek(min(self.start_offset, os.fstat(tailed_file.fileno()).st_size))
+            elif not self.from_start:
+                tailed_file.seek(0, 2)
+        else:
+            inode, offset = saved
+            if inode != self.inode:
+                rotated_file = self._find_rotated(inode)
+                if rotated_file is not None:
+                    tailed_file.close()
+                    tailed_file, self.inode = rotated_file, inode
+                else:
+                    offset = 0
+            if offset > os.fstat(tailed_file.fileno()).st_size:
+                offset = 0
+            tailed_file.seek(offset)
+        self.offset = tailed_file.tell()
+        return tailed_file
+
+    def _find_rotated(self, inode):
+        """
+        :param inode: (int) inode of a file that used to be at self.tailed_file_path
+        :return: (file) that file opened in binary mode if it is found under a usual rotation name, else None
+        """
+        for suffix in _ROTATED_SUFFIXES:
+            try:
+                candidate = open(self.tailed_file_path + suffix, 'rb')
+            except (IOError, OSError):
+                continue
+            if os.fstat(candidate.fileno()).st_ino == inode:
+                return candidate
+            candidate.close()
+        return None
+
+    def _open_rotated(self):
+        """
+        Switch to the new file created at self.tailed_file_path after a rotation
+        :return: (file) the new file opened at its beginning, in binary mode
+        """
+        tailed_file = open(self.tailed_file_path, 'rb')
+        self.inode = os.fstat(tailed_file.fileno()).st_ino
+        self.offset = 0
+        self._save_checkpoint(force=True)
+        return tailed_file
+
+    def _detect_change(self, tailed_file):
+        """
+        :param tailed_file: (file) the file currently followed
+        :return: (int) _ROTATED if another file now lives at self.tailed_file_path, _TRUNCATED if the followed file
+                       shrank below our position, _UNCHANGED otherwise
+        """
+        try:
+            stat = os.stat(self.tailed_file_path)
+        except OSError:
+            # Moved away and not created again yet: keep following the old file
+            return _UNCHANGED
+        if stat.st_ino != self.inode:
+            return _ROTATED
+        if stat.st_size < tailed_file.tell():
+            return _TRUNCATED
+        return _UNCHANGED
+
+    def _save_checkpoint(self, force=False):
+        """
+        Persist the position following the last line handed to the consumer, at most every checkpoint_interval
+        :param force: (bool) save even if the last save is recent
+        """
+        if self.checkpoint is None or self.inode is None:
+            return
+        now = time.time()
+        if force or now >= self.next_checkpoint:
+            self.checkpoint.save(self.inode, self.offset)
+            self.next_checkpoint = now + self.checkpoint_interval
+
+
+class MultiTailer:
+    def __init__(self, patterns, refresh_rate=1.0, rescan_interval=_DEFAULT_RESCAN_INTERVAL,
+                 chunk_size=_DEFAULT_CHUNK_SIZE, from_start=False):
+        """
+        Follow every file matching a list of paths or glob patterns, with one Tailer per file
+        The patterns should not match the rotated names of the files (logs.txt.1 for example): every Tailer already
+        drains its file after a rotation.
+        :param patterns (list): paths or glob patterns of the files to follow
+        :param refresh_rate (float): Maximum time to wait when no new line is found in any file
+        :param rescan_interval (float): Time between two expansions of the patterns, looking for new files
+        :param chunk_size (int): Amount of bytes read at once in every file
+        :param from_start (bool): Read the files found at start from their beginning (files found later on always are)
+        """
+        self.patterns = patterns
+        self.refresh_rate = refresh_rate
+        self.rescan_interval = rescan_interval
+        self.chunk_size = chunk_size
+        self.from_start = from_start
+        self.tailers = {}
+        self.next_rescan = 0
+        self.proceed = True
+
+    def _rescan(self):
+        """
+        Expand the patterns, and start following the files that are not followed yet
+        """
+        now = time.time()
+        if now < self.next_rescan:
+            return
+        # Files appearing after the first scan are new: all their lines are read
+        from_start = self.from_start or self.next_rescan > 0
+        self.next_rescan = now + self.rescan_interval
+        for pattern in self.patterns:
+            for path in sorted(glob.glob(pattern)):
+                if path in self.tailers or not os.path.isfile(path):
+                    continue
+                tailer = Tailer(path, self.refresh_rate, self.chunk_size, from_start)
+                try:
+                    tailer.open()
+                except (IOError, OSError):
+                    continue
+                self.tailers[path] = tailer
+
+    def read_batches(self):
+        """
+        Pseudo-infinite loop that polls every followed file in turn
+        A file deleted (or moved away) and not created again is dropped once it was read to its end.
+        It also yields when no file has new lines, every refresh_rate at most, so that the consumer keeps its clock
+        running.
+        :return unnamed (generator): lists of tuples (path, lines), the lines being new complete lines of the file
+        """
+        delay = _MIN_POLLING_DELAY
+        try:
+            while self.proceed:
+                self._rescan()
+                batches, gone = [], []
+                for path, tailer in self.tailers.items():
+                    tailer.acknowledge()
+                    lines = tailer.poll()
+                    if lines:
+                        batches.append((path, lines))
+                    elif not os.path.exists(path):
+                        # Deleted and drained: a file created at this path later on is found by _rescan
+                        if tailer.pending:
+                            batches.append((path, [_decode(tailer.pending)]))
+                        gone.append(path)
+                for path in gone:
+                    self.tailers.pop(path).close()
+                if batches:
+                    delay = _MIN_POLLING_DELAY
+                else:
+                    time.sleep(delay)
+                    delay = min(2 * delay, self.refresh_rate)
+                    if delay < self.refresh_rate:
+                        continue
+                yield batches
+        finally:
+            for tailer in self.tailers.values():
+                tailer.close()
+
+    def stop(self):
+        """
+        Stop the read_batches loop
+        """
+        self.proceed = False
+
+    def lag(self):
+        """
+        :return: (int) amount of bytes written in the followed files and not read yet
+        """
+        return sum(tailer.lag() for tailer in self.tailers.values())
@@ -0,0 +1,121 @@
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from Anomaly import AnomalyDetector, AnomalyEngine, HoltWinters
+from Buffer import BucketedLogsBuffer, FanoutBuffer
+from DisplayHelper import format_anomaly_message
+from Parser import _ParsedLine, parse_logline
+from Replay import replay
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Logs_Simulator"))
+import HTTP_log_fields
+from SimulateServer import LoadGenerator, _FAST_LOG_LINE_TEMPLATE
+
+# Midnight UTC
+_START = 1450915200
+_DAY = 86400
+
+
+def write_seasonal_logs(path, duration, attacks=()):
+    """
+    Write the seasonal traffic of the simulator (about 2 hits per minute at night, 22 at noon), plus attacks
+    :param attacks: (list) tuples (start, end, section, interval): a hit on the section every interval seconds
+    """
+    generator = LoadGenerator(.2, "daily", nb_hosts=100, nb_sections=10, seed=1)
+    expected, written = 0., 0
+    with open(path, 'w') as log_file:
+        for second in range(duration):
+            expected += generator.rate_at(second)
+            count = int(expected) - written
+            written += count
+            lines = generator.lines_at(_START + second, count) if count else []
+            for start, end, section, interval in attacks:
+                if start <= second < end and second % interval == 0:
+                    lines.append(_FAST_LOG_LINE_TEMPLATE % ("10.9.9.9", HTTP_log_fields.format_date(_START + second),
+                                                            "GET", "/%s/item" % section, "200", 100))
+            log_file.write("".join(lines))
+
+
+class TestHoltWinters(unittest.TestCase):
+    def test_learns_the_season(self):
+        baseline = HoltWinters(season=60)
+        values = [100 + 50 * math.sin(2 * math.pi * minute / 60) for minute in range(60 * 30)]
+        for minute, value in enumerate(values):
+            baseline.update(value, minute % 60)
+        for minute in range(60):
+            self.assertAlmostEqual(baseline.forecast(minute)[0], values[minute], delta=5)
+        self.assertLess(math.sqrt(baseline.variance), 2)
+
+    def test_anomalies_are_not_learned_at_once(self):
+        detector = AnomalyDetector(season=60, warmup=10)
+        changes = [detector.update(10, minute * 60)[0] for minute in range(30)]
+        changes += [detector.update(100, minute * 60)[0] for minute in range(30, 40)]
+        changes += [detector.update(10, minute * 60)[0] for minute in range(40, 45)]
+        self.assertListEqual([(minute, change) for minute, change in enumerate(changes) if change != 2],
+                             [(30, 1), (40, 0)])
+
+
+class TestAnomalyEngine(unittest.TestCase):
+    def test_minutes_without_traffic_count(self):
+        engine = AnomalyEngine(season=60, warmup=5, grace=0)
+        for minute in range(20):
+            for second in range(0, 60, 2):
+                engine.add_entry(_ParsedLine("a", "200", "h", _START + minute * 60 + second, 1))
+        self.assertListEqual(engine.update(_START + 20 * 60), [])
+        changes = engine.update(_START + 30 * 60)
+        self.assertListEqual([(section, message_type) for section, message_type, _ in changes], [(None, 1)])
+        self.assertEqual(changes[0][2][1], 0)
+        self.assertEqual(engine.last_minute, _START + 29 * 60)
+
+    def test_message(self):
+        self.assertEqual(format_anomaly_message("api", 1, ("2015-12-24 03:00:00", 25, 5.04, 6.2)),
+                         "2015-12-24 03:00:00: Anomaly on section /api: 25 hits in a minute, 6.2 standard deviations "
+                         "from the expected 5.0.\n")
+        self.assertIn("Traffic returned to its baseline", format_anomaly_message(None, 0, ("0:11: 0", 25, 6.2)))
+
+
+class TestSeasonalReplay(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def replay_changes(self, attacks=()):
+        """
+        :return: (list) tuples (section, message_type, minute of the day) of the anomalies of a replay of a day and a
+                        half of seasonal traffic, the first day being learned
+        """
+        path = os.path.join(self.workdir, "logs.txt")
+        write_seasonal_logs(path, _DAY + _DAY // 2, attacks)
+        engine = AnomalyEngine(sections=5)
+        monitor_buffer = FanoutBuffer(BucketedLogsBuffer(1), engine)
+        start = parse_logline(_FAST_LOG_LINE_TEMPLATE.strip() % ("10.9.9.9", HTTP_log_fields.format_date(_START),
+                                                                 "GET", "/", "200", 100)).utc_ts
+        changes = []
+        for now, _ in replay([path], monitor_buffer):
+            changes += [(section, message_type, int(now - start) % _DAY // 60)
+                        for section, message_type, _ in engine.update(now)]
+        return changes
+
+    def test_daily_peak_is_not_an_anomaly(self):
+        # The traffic of noon is 9 times the one of the night, far above a threshold fitting the night
+        self.assertListEqual(self.replay_changes(), [])
+
+    def test_attacks(self):
+        # 20 more hits per minute at 3:00, and 12 more on a quiet section at 9:00, for 10 minutes
+        changes = self.replay_changes([(_DAY + 3 * 3600, _DAY + 3 * 3600 + 600, "section0", 3),
+                                       (_DAY + 9 * 3600, _DAY + 9 * 3600 + 600, "section5", 5)])
+        self.assertListEqual(sorted((section or "", message_type) for section, message_type, _ in changes),
+                             [("", 0), ("", 1), ("section0", 0), ("section0", 1), ("section5", 0), ("section5", 1)])
+        for section, message_type, minute in changes:
+            start = 3 * 60 if section in (None, "section0") else 9 * 60
+            self.assertTrue(start <= minute <= start + 12 if message_type else start + 10 <= minute <= start + 15,
+                            (section, message_type, minute))
+
+
+if __name__ == '__main__':
+    unittest.main()
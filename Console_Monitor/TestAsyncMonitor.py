@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+import unittest
+from AsyncMonitor import Sink, run_monitor
+from Metrics import SelfMetrics
+
+
+def blocking_batches(batches, stop):
+    """
+    :return: (generator) the batches, then nothing until stop is set, like an idle Tailer.read_batches
+    """
+    for batch in batches:
+        yield batch
+    stop.wait()
+
+
+class TestAsyncMonitor(unittest.TestCase):
+    def test_timers_run_without_lines(self):
+        stop, ticks, ingested = threading.Event(), [], []
+
+        def tick():
+            ticks.append(time.time())
+            if len(ticks) == 5:
+                stop.set()
+
+        asyncio.run(run_monitor(blocking_batches([["a"]], stop), lambda batch: [(0, 0)],
+                                lambda now, malformed: ingested.append(now), [(.02, tick)], []))
+        self.assertListEqual(ingested, [0])
+        self.assertEqual(len(ticks), 5)
+
+    def test_slow_sink_does_not_stall_ingestion(self):
+        metrics, written, ingested = SelfMetrics(), [], []
+        stop = threading.Event()
+
+        def write(message):
+            time.sleep(.05)
+            written.append(message)
+
+        async def monitor():
+            sink = Sink("slow", write, metrics, max_pending=2)
+
+            def on_ingested(now, malformed):
+                ingested.append(time.time())
+                sink.publish(now)
+                if len(ingested) == 100:
+                    stop.set()
+
+            await run_monitor(blocking_batches([[i] for i in range(100)], stop), lambda batch: [(batch[0], 0)],
+                              on_ingested, [], [sink])
+
+        started = time.time()
+        asyncio.run(monitor())
+        self.assertLess(ingested[-1] - started, 1.)
+        self.assertGreater(metrics.counters["slow_dropped"], 0)
+        self.assertEqual(written[-1], 99)
+        self.assertEqual(len(written) + metrics.counters["slow_dropped"], 100)
+
+    def test_errors_do_not_stop_the_tasks(self):
+        metrics, stop, ticks, written = SelfMetrics(), threading.Event(), [], []
+
+        def tick():
+            ticks.append(time.time())
+            if len(ticks) == 5:
+                stop.set()
+            raise ValueError("tick %d" % len(ticks))
+
+        def write(message):
+            if message % 2:
+                raise IOError("disk full")
+            written.append(message)
+
+        async def monitor():
+            sink = Sink("failing", write, metrics)
+            await run_monitor(blocking_batches([[i] for i in range(10)], stop), lambda batch: [(batch[0], 0)],
+                              lambda now, malformed: sink.publish(now), [(.02, tick)], [sink])
+
+        with self.assertLogs("AsyncMonitor", "ERROR") as logs:
+            asyncio.run(asyncio.wait_for(monitor(), 5))
+        self.assertGreaterEqual(len(ticks), 5)
+        self.assertListEqual(written, [0, 2, 4, 6, 8])
+        self.assertEqual(metrics.counters["failing_errors"], 5)
+        self.assertEqual(len(logs.records), len(ticks) + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
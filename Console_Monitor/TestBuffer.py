@@ -0,0 +1,179 @@
+import random
+import unittest
+from collections import Counter
+from Buffer import LogsBuffer, BucketedLogsBuffer, PathTreeBuffer, PercentileBuffer
+from Parser import _ParsedLine
+
+
+def make_entries(start, seconds, per_second):
+    return [_ParsedLine("section%d" % (i % 7), "%d00" % (2 + i % 3), "host%d" % (i % 5), start + second, i + 1)
+            for second in range(seconds) for i in range(per_second)]
+
+
+class TestLogsBuffer(unittest.TestCase):
+    def test_columns_keep_the_entries_of_the_period(self):
+        logs_buffer = LogsBuffer(1)
+        entries = make_entries(1450983778, 200, 50)
+        for entry in entries:
+            logs_buffer.clean_old_entries(entry.utc_ts)
+            logs_buffer.add_entry(entry)
+        kept = [entry for entry in entries if entry.utc_ts >= entries[-1].utc_ts - 60]
+        self.assertEqual(len(logs_buffer), len(kept))
+        self.assertListEqual(list(logs_buffer), kept)
+        self.assertEqual(logs_buffer[0], kept[0])
+        self.assertEqual(logs_buffer[-1], kept[-1])
+        self.assertLess(len(logs_buffer.utc_ts), 2 * len(kept))
+        self.assertEqual(len(logs_buffer.host_names.values), 5)
+        self.assertDictEqual(dict(+logs_buffer.hits), dict(Counter(entry.section for entry in kept)))
+        self.assertEqual(logs_buffer.get_total_traffic(), sum(entry.traffic for entry in kept))
+
+    def test_strings_are_released(self):
+        # Every host and section is seen during 10 seconds only, so that 7 sets of 30 of them are in the period
+        logs_buffer = LogsBuffer(1)
+        start = 1450983778
+        for second in range(2000):
+            logs_buffer.clean_old_entries(start + second)
+            for i in range(30):
+                name = "%d" % ((second // 10) * 30 + i)
+                logs_buffer.add_entry(_ParsedLine("section" + name, "200", "host" + name, start + second, 0))
+            self.assertLessEqual(logs_buffer.get_total_users(), 7 * 30)
+        self.assertEqual(logs_buffer.get_total_users(), 7 * 30)
+        self.assertEqual(logs_buffer.get_total_sections(), 7 * 30)
+        self.assertLessEqual(len(logs_buffer.host_names.values), 7 * 30)
+        self.assertLessEqual(len(logs_buffer.section_names.values), 7 * 30)
+        self.assertEqual(len(logs_buffer.host_names.ids), 7 * 30)
+        self.assertListEqual(list(logs_buffer)[-30:], [_ParsedLine("section%d" % i, "200", "host%d" % i,
+                                                                   start + 1999, 0) for i in range(5970, 6000)])
+        logs_buffer.clean_old_entries(start + 3000)
+        self.assertDictEqual(dict(logs_buffer.hits), {})
+        self.assertDictEqual(dict(logs_buffer.host_traffic), {})
+        self.assertEqual(len(logs_buffer.status_names.ids), 0)
+
+
+class TestBucketedLogsBuffer(unittest.TestCase):
+    def assertSameWindow(self, logs_buffer, bucketed_buffer):
+        self.assertEqual(bucketed_buffer.get_total_hits(), logs_buffer.get_total_hits())
+        self.assertEqual(bucketed_buffer.get_total_traffic(), logs_buffer.get_total_traffic())
+        self.assertEqual(bucketed_buffer.get_total_success(),
+                         sum(v for k, v in logs_buffer.get_statuses().items() if k.startswith("2")))
+        self.assertDictEqual(dict(bucketed_buffer.get_statuses()), dict(+logs_buffer.get_statuses()))
+        self.assertDictEqual(dict(bucketed_buffer.get_popular_sections()), dict(+logs_buffer.hits))
+        self.assertDictEqual(dict(bucketed_buffer.get_user_traffic()), dict(+logs_buffer.host_traffic))
+        self.assertEqual(bucketed_buffer.get_total_sections(), len(+logs_buffer.hits))
+        self.assertDictEqual(dict(+bucketed_buffer.get_status_classes()), dict(+logs_buffer.get_status_classes()))
+        self.assertEqual(logs_buffer.get_total_traffic(), sum(logs_buffer.host_traffic.values()))
+        self.assertListEqual([hits for _, hits in bucketed_buffer.get_popular_sections(3)],
+                             [hits for _, hits in (+logs_buffer.hits).most_common(3)])
+
+    def test_same_stats_as_logs_buffer(self):
+        logs_buffer, bucketed_buffer = LogsBuffer(1), BucketedLogsBuffer(1)
+        start = 1450983778
+        for entry in make_entries(start, 200, 11):
+            logs_buffer.clean_old_entries(entry.utc_ts)
+            bucketed_buffer.clean_old_entries(entry.utc_ts)
+            logs_buffer.add_entry(entry)
+            bucketed_buffer.add_entry(entry)
+            if entry.traffic == 1:
+                self.assertSameWindow(logs_buffer, bucketed_buffer)
+        for now in (start + 230.5, start + 259, start + 300):
+            logs_buffer.clean_old_entries(now)
+            bucketed_buffer.clean_old_entries(now)
+            self.assertSameWindow(logs_buffer, bucketed_buffer)
+        self.assertEqual(bucketed_buffer.get_total_hits(), 0)
+        self.assertEqual(bucketed_buffer.get_total_users(), 0)
+
+    def test_memory_is_bounded_by_the_period(self):
+        bucketed_buffer = BucketedLogsBuffer(1)
+        for entry in make_entries(1450983778, 1000, 3):
+            bucketed_buffer.add_entry(entry)
+        self.assertEqual(len([bucket for bucket in bucketed_buffer.ring if bucket is not None]), 61)
+        self.assertEqual(bucketed_buffer.get_total_hits(), 61 * 3)
+
+    def test_late_entries(self):
+        bucketed_buffer = BucketedLogsBuffer(1)
+        entries = make_entries(1450983778, 100, 1)
+        bucketed_buffer.add_entry(entries[99])
+        bucketed_buffer.add_entry(entries[0])
+        bucketed_buffer.add_entry(entries[50])
+        self.assertEqual(bucketed_buffer.get_total_hits(), 3)
+        bucketed_buffer.clean_old_entries(entries[99].utc_ts)
+        self.assertEqual(bucketed_buffer.get_total_hits(), 2)
+        # Same slot of the ring as the newest second, but too old to be part of the period
+        bucketed_buffer.add_entry(entries[99 - 61])
+        self.assertEqual(bucketed_buffer.get_total_hits(), 2)
+        self.assertEqual(bucketed_buffer.get_total_users(), len(Counter([entries[99].host, entries[50].host])))
+
+
+class TestPercentileBuffer(unittest.TestCase):
+    def test_quantiles_of_the_period(self):
+        rng = random.Random(0)
+        start = 1450983778
+        entries = [_ParsedLine("api" if i % 3 else "pages", "200", "host", start + second, rng.randrange(100, 5000),
+                               rng.expovariate(20) if i % 3 else None)
+                   for second in range(120) for i in range(30)]
+        percentile_buffer = PercentileBuffer(1)
+        for entry in entries:
+            percentile_buffer.clean_old_entries(entry.utc_ts)
+            percentile_buffer.add_entry(entry)
+        kept = [entry for entry in entries if entry.utc_ts >= entries[-1].utc_ts - 60]
+        api = sorted(entry.response_time for entry in kept if entry.section == "api")
+        sizes = sorted(entry.traffic for entry in kept)
+
+        section, hits, section_sizes, times = percentile_buffer.get_percentiles(1)[0]
+        self.assertEqual((section, hits), ("api", len(api)))
+        self.assertAlmostEqual(times[1], api[int(.95 * (len(api) - 1))], delta=api[-1] * 0.01)
+        self.assertIsNone(percentile_buffer.get_percentiles()[1][3])
+        _, hits, total_sizes, _ = percentile_buffer.get_total_percentiles()
+        self.assertEqual(hits, len(kept))
+        self.assertAlmostEqual(total_sizes[0], sizes[int(.5 * (len(sizes) - 1))], delta=sizes[-1] * 0.01)
+
+        percentile_buffer.clean_old_entries(entries[-1].utc_ts + 61)
+        self.assertListEqual(percentile_buffer.get_percentiles(), [])
+        self.assertEqual(len(percentile_buffer.second_sketches), 0)
+
+    def test_sections_are_bounded(self):
+        percentile_buffer = PercentileBuffer(1, max_sections=4)
+        for i in range(100):
+            percentile_buffer.add_entry(_ParsedLine("section%d" % i, "200", "host", 1450983778, 10))
+        self.assertEqual(len(percentile_buffer.sections), 5)
+        self.assertEqual(percentile_buffer.get_percentiles(1)[0][:2], ("(other)", 96))
+
+
+class TestPathTreeBuffer(unittest.TestCase):
+    def test_prefixes_of_the_period(self):
+        start = 1450983778
+        path_tree = PathTreeBuffer(1, depth=2)
+        for second, path in ((0, "/pages/corentin/1"), (0, "/pages/corentin/2?page=3"), (30, "/pages/"),
+                             (30, "/api/users"), (90, "/pages/about")):
+            path_tree.clean_old_entries(start + second)
+            path_tree.add_entry(_ParsedLine(path.split("/")[1], "200", "host", start + second, 10, None, path))
+            if path == "/api/users":
+                self.assertListEqual(path_tree.get_subtrees(), [
+                    ("pages", 3, 30, [("corentin", 2, 20, [])]), ("api", 1, 10, [("users", 1, 10, [])])])
+        self.assertListEqual(path_tree.get_subtrees(), [("pages", 2, 20, [("about", 1, 10, [])]),
+                                                        ("api", 1, 10, [("users", 1, 10, [])])])
+        self.assertEqual(path_tree.get_total_hits(), 3)
+        path_tree.clean_old_entries(start + 200)
+        self.assertListEqual(path_tree.get_subtrees(), [])
+        self.assertEqual((path_tree.nodes, path_tree.get_total_hits(), len(path_tree.second_counts)), (1, 0, 0))
+
+    def test_nodes_are_bounded(self):
+        path_tree = PathTreeBuffer(1, depth=3, max_children=4, max_nodes=12)
+        for i in range(100):
+            path_tree.add_entry(_ParsedLine("a", "200", "host", 1450983778, 1, None, "/a/%d/%d" % (i % 10, i)))
+        self.assertEqual(path_tree.nodes, 12)
+        subtrees = path_tree.get_subtrees()
+        self.assertEqual(subtrees[0][:2], ("a", 100))
+        self.assertEqual(len(subtrees[0][3]), 4)
+        self.assertEqual(sum(hits for _, hits, _, _ in subtrees[0][3]), 100)
+        self.assertEqual(subtrees[0][3][0][:2], ("(other)", 70))
+        self.assertListEqual(subtrees[0][3][0][3], [])
+        # Once the tree is full, the new prefixes are only counted in their parent
+        self.assertEqual(subtrees[0][3][1][:2], ("0", 10))
+        self.assertEqual(len(subtrees[0][3][1][3]), 2)
+        # Sections without a path are counted at the first level only
+        path_tree.add_entry(_ParsedLine("b", "200", "host", 1450983778, 1))
+        self.assertEqual(path_tree.get_subtrees(1, 0), [("a", 100, 100, [])])
+
+if __name__ == '__main__':
+    unittest.main()
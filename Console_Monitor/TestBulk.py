@@ -0,0 +1,62 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from Buffer import BucketedLogsBuffer
+from Bulk import bulk_ingest, chunk_offsets, complete_size
+from Parser import parse_lines
+
+_LINES = ['192.168.2.%d - - [24/12/2015:%02d:%02d:%02d +01.000] "GET /%s/x" %s %d'
+          % (i % 7, 3 + i // 3600, i // 60 % 60, i % 60, ["pages", "api", "search", "home"][i % 4],
+             ["200", "404", "500"][i % 5 % 3], 100 + i) for i in range(0, 1200, 2)] + ["garbage"]
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.workdir, "logs.txt")
+        with open(self.log_path, 'w') as log_file:
+            log_file.write("\n".join(_LINES) + "\n")
+        self.expected = BucketedLogsBuffer(1)
+        parsed_lines = parse_lines(_LINES)
+        for entry in parsed_lines:
+            self.expected.add_entry(entry)
+        self.expected.clean_old_entries(int(parsed_lines[-1].utc_ts))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_chunks_are_line_aligned(self):
+        offsets = chunk_offsets(self.log_path, 1000)
+        self.assertGreater(len(offsets), 10)
+        with open(self.log_path, 'rb') as log_file:
+            content = log_file.read()
+        self.assertEqual(b"".join(content[start:end] for start, end in offsets), content)
+        self.assertTrue(all(content[end - 1:end] == b"\n" for _, end in offsets))
+
+    def test_plain_file(self):
+        for workers in (1, 2):
+            bulk_buffer = BucketedLogsBuffer(1)
+            stats, = bulk_ingest([self.log_path], bulk_buffer, workers, chunk_size=1000)
+            self.assertEqual((stats.nb_lines, stats.malformed), (len(_LINES), 1))
+            self.assertEqual(stats.nb_bytes, os.path.getsize(self.log_path))
+            self.assertEqual(bulk_buffer.snapshot(), self.expected.snapshot())
+
+    def test_archive(self):
+        archive_path = self.log_path + ".gz"
+        with open(self.log_path, 'rb') as log_file, gzip.open(archive_path, 'wb') as archive:
+            archive.write(log_file.read())
+        bulk_buffer = BucketedLogsBuffer(1)
+        stats, = bulk_ingest([archive_path], bulk_buffer)
+        self.assertEqual((stats.nb_lines, stats.malformed), (len(_LINES), 1))
+        self.assertEqual(bulk_buffer.snapshot(), self.expected.snapshot())
+
+    def test_complete_size(self):
+        size = os.path.getsize(self.log_path)
+        with open(self.log_path, 'a') as log_file:
+            log_file.write("partial line")
+        self.assertEqual(complete_size(self.log_path), size)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from collections import Counter
+from DisplayHelper import get_formatted_stats, get_formatted_percentiles, get_formatted_path_tree, format_IS, \
+    format_duration
+
+
+class TestDisplayHelper(unittest.TestCase):
+    def test_format_IS(self):
+        self.assertEqual(format_IS(0), "0")
+        self.assertEqual(format_IS(999), "999")
+        self.assertEqual(format_IS(12345678), "12M")
+
+    def test_get_formatted_stats(self):
+        stats = get_formatted_stats("20:02:58", "Low Traffic", 10, 3, [("api", 6), ("pages", 3), ("search", 1)],
+                                    Counter({"2": 7, "4": 3}), 7, 2, [("10.0.0.1", 900), ("10.0.0.2", 100)], 1000)
+        self.assertIn("/api is popular with 6/10 (60%)", stats)
+        self.assertNotIn("/pages", stats)
+        self.assertIn("70% success requests", stats)
+        self.assertIn("30% client_error requests", stats)
+        self.assertIn("90% of our traffic is with 10.0.0.1", stats)
+        self.assertNotIn("10.0.0.2", stats)
+
+    def test_get_formatted_stats_without_traffic(self):
+        stats = get_formatted_stats("20:02:58", "Low Traffic", 0, 0, [], Counter(), 0, 0, [], 0)
+        self.assertIn("Low Traffic - 0 Users - 0/0 successful hits - 0B of traffic", stats)
+
+    def test_get_formatted_percentiles(self):
+        self.assertEqual(format_duration(0.0424), "42ms")
+        self.assertEqual(format_duration(2.25), "2.2s")
+        table = get_formatted_percentiles((None, 10, (1500, 2000, 12000), (.01, .2, 1.5)),
+                                          [("api", 7, (1500, 2000, 2000), None), ("pages", 0, (), None)])
+        self.assertIn("(all)", table)
+        self.assertIn("1KB/2KB/12KB", table)
+        self.assertIn("10ms/200ms/1.5s", table)
+        self.assertIn("/api", table)
+        self.assertNotIn("/pages", table)
+
+    def test_get_formatted_path_tree(self):
+        tree = get_formatted_path_tree([("api", 8, 8000, [("users", 6, 6000, [("(other)", 6, 6000, [])]),
+                                                          ("", 2, 2000, [])])], 10)
+        rows = tree.split("\n")
+        self.assertTrue(rows[2].startswith("/api "))
+        self.assertIn("8 hits (80%)     8KB", rows[2])
+        self.assertTrue(rows[3].startswith("  /api/users "))
+        self.assertTrue(rows[4].startswith("    /api/users (other) "))
+        self.assertTrue(rows[5].startswith("  /api/ "))
+        self.assertNotIn("hits", get_formatted_path_tree([], 0))
+
+if __name__ == '__main__':
+    unittest.main()
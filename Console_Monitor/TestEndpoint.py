@@ -0,0 +1,61 @@
+import json
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from Buffer import BucketedLogsBuffer
+from Endpoint import MetricsServer, build_snapshot
+from Metrics import SelfMetrics
+from Parser import _ParsedLine
+from Warden import AlertWarden
+
+_NOW = 1450983778
+
+
+def make_snapshot():
+    monitor_buffer = BucketedLogsBuffer(1)
+    for i in range(30):
+        monitor_buffer.add_entry(_ParsedLine("api" if i % 3 else 'we"ird', "200" if i % 5 else "503",
+                                             "10.0.0.%d" % (i % 4), _NOW, 100))
+    alert_warden = AlertWarden(1)
+    alert_warden.update(monitor_buffer.get_total_hits(), _NOW)
+    metrics = SelfMetrics()
+    metrics.incr("lines_read", 30)
+    metrics.set("tail_lag_bytes", 12)
+    metrics.observe("parse_seconds", .002)
+    return build_snapshot(monitor_buffer, alert_warden, metrics, _NOW, top=3)
+
+
+class TestEndpoint(unittest.TestCase):
+    def test_prometheus(self):
+        body = make_snapshot().prometheus.decode("utf-8")
+        self.assertIn("# TYPE logmonitor_hits gauge\nlogmonitor_hits 30.0\n", body)
+        self.assertIn('logmonitor_status_class_hits{class="5xx"} 6.0\n', body)
+        self.assertIn('logmonitor_section_hits{section="we\\"ird"} 10.0\n', body)
+        self.assertIn("logmonitor_alert_status 0.0\n", body)
+        self.assertIn("logmonitor_self_lines_read_total 30.0\n", body)
+        self.assertIn("logmonitor_self_parse_seconds_count 1.0\n", body)
+
+    def test_json(self):
+        document = json.loads(make_snapshot().json.decode("utf-8"))
+        self.assertEqual(document["window"]["hits"], 30)
+        self.assertEqual(document["window"]["status_classes"], {"2xx": 24, "5xx": 6})
+        self.assertEqual(document["window"]["top_sections"][0], ["api", 20])
+        self.assertEqual(document["alert"]["label"], "Low Traffic")
+        self.assertEqual(document["self"]["gauges"]["tail_lag_bytes"], 12)
+
+    def test_server(self):
+        server = MetricsServer("127.0.0.1", 0)
+        server.start()
+        try:
+            snapshot = make_snapshot()
+            server.publish(snapshot)
+            url = "http://127.0.0.1:%d" % server.port
+            self.assertEqual(urlopen(url + "/metrics").read(), snapshot.prometheus)
+            self.assertEqual(urlopen(url + "/metrics.json").read(), snapshot.json)
+            self.assertRaises(HTTPError, urlopen, url + "/other")
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
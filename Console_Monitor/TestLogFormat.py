@@ -0,0 +1,70 @@
+import unittest
+from LogFormat import compile_format, get_parser
+from Parser import parse_lines, parse_logline
+from Pipeline import aggregate_batch
+
+_COMBINED_LINES = ['127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /apache_pb.gif HTTP/1.0" 200 2326 '
+                   '"http://www.example.com/start.html" "Mozilla/4.08 [en] (Win98; I ;Nav)"',
+                   '10.0.0.2 - - [24/Dec/2015:03:58:30 +0100] "GET /api/browse?id=3 HTTP/1.1" 404 - "-" "curl/7.0"',
+                   '10.0.0.3 - - [24/Dec/2015:03:58:31 +0000] "POST /?page=2 HTTP/2.0" 301 0 "-" "-"']
+_MALFORMED_LINES = ["garbage", "",
+                    '10.0.0.4 - - [24/Dec/2015:03:58:31 +0000] "-" 408 - "-" "-"',
+                    '10.0.0.4 - - [24/Dec/2015:03:58:31 +0000] "GET /a HTTP/1.1" 200 12x "-" "-"',
+                    '10.0.0.4 - - [24/Foo/2015:03:58:31 +0000] "GET /a HTTP/1.1" 200 12 "-" "-"',
+                    '10.0.0.4 - - [24/Dec/2015:03:58:31 +0000] "GET /a HTTP/1.1" OK 12 "-" "-"']
+
+
+class TestLogFormat(unittest.TestCase):
+    def test_combined(self):
+        parsed_lines = compile_format("combined")(_COMBINED_LINES)
+        self.assertListEqual([line.section for line in parsed_lines], ["apache_pb.gif", "api", ""])
+        self.assertListEqual([line.status for line in parsed_lines], ["200", "404", "301"])
+        self.assertListEqual([line.host for line in parsed_lines], ["127.0.0.1", "10.0.0.2", "10.0.0.3"])
+        self.assertListEqual([line.traffic for line in parsed_lines], [2326, 0, 0])
+        self.assertEqual(parsed_lines[2].utc_ts - parsed_lines[1].utc_ts, 3601)
+
+    def test_same_timestamps_as_the_default_format(self):
+        default = parse_logline('10.0.0.2 - - [24/12/2015:03:58:30 +01.000] "GET /api/browse" 404 12')
+        self.assertEqual(compile_format("common")(['10.0.0.2 - - [24/Dec/2015:03:58:30 +0100] "GET /api/browse '
+                                                   'HTTP/1.1" 404 12'])[0], default)
+
+    def test_query_strings_as_the_default_format(self):
+        for request in ("/search?q=a", "/api?id=1/x", "/api/browse?id=1", "/?q=a"):
+            default = parse_logline('10.0.0.2 - - [24/12/2015:03:58:30 +01.000] "GET %s" 404 12' % request)
+            self.assertEqual(compile_format("common")(['10.0.0.2 - - [24/Dec/2015:03:58:30 +0100] "GET %s HTTP/1.1" '
+                                                       '404 12' % request])[0], default)
+
+    def test_malformed_lines_are_skipped(self):
+        parse = compile_format("combined")
+        self.assertListEqual(parse(_MALFORMED_LINES + _COMBINED_LINES), parse(_COMBINED_LINES))
+        malformed, partials = aggregate_batch(_MALFORMED_LINES + _COMBINED_LINES, "combined")
+        self.assertEqual(malformed, len(_MALFORMED_LINES))
+        self.assertEqual(sum(partial[1] for partial in partials), len(_COMBINED_LINES))
+
+    def test_response_time(self):
+        line = '10.0.0.2 - - [24/Dec/2015:03:58:30 +0100] "GET /api HTTP/1.1" 200 12 %s'
+        self.assertEqual(compile_format('%h %l %u %t "%r" %>s %b %D')([line % "1500"])[0].response_time, .0015)
+        self.assertEqual(compile_format('%h %l %u %t "%r" %>s %b %T')([line % "0.25"])[0].response_time, .25)
+        self.assertIsNone(compile_format('%h %l %u %t "%r" %>s %b %T')([line % "-"])[0].response_time)
+        self.assertIsNone(compile_format("common")([line % "1500"])[0].response_time)
+
+    def test_custom_format(self):
+        parse = compile_format('%{X-Forwarded-For}i|%t|%a|"%r"|%>s|%B|100%%')
+        parsed_lines = parse(['1.1.1.1, 2.2.2.2|[24/Dec/2015:03:58:30 +0100]|10.0.0.9|"GET /shop/cart HTTP/1.1"|'
+                              '503|42|100%'])
+        self.assertEqual(len(parsed_lines), 1)
+        self.assertEqual((parsed_lines[0].host, parsed_lines[0].section, parsed_lines[0].traffic),
+                         ("10.0.0.9", "shop", 42))
+        self.assertEqual(parsed_lines[0].path, "/shop/cart")
+
+    def test_invalid_formats(self):
+        self.assertRaises(ValueError, compile_format, "%h %t %>s")
+        self.assertRaises(ValueError, compile_format, '%h%l %t "%r" %>s')
+
+    def test_get_parser(self):
+        self.assertIs(get_parser(), parse_lines)
+        self.assertIs(get_parser("default"), parse_lines)
+        self.assertIs(get_parser("combined"), get_parser("combined"))
+
+if __name__ == '__main__':
+    unittest.main()
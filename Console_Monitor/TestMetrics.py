@@ -0,0 +1,30 @@
+import unittest
+from Metrics import Histogram, SelfMetrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(.99), 0)
+        for _ in range(99):
+            histogram.observe(0.001)
+        histogram.observe(2.)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.percentile(.5), 0.001, delta=0.001)
+        self.assertEqual(histogram.percentile(1), 2.)
+
+    def test_self_metrics(self):
+        metrics = SelfMetrics()
+        metrics.incr("lines_read", 10)
+        metrics.incr("parse_failures")
+        metrics.set("tail_lag_bytes", 42)
+        metrics.observe("parse_seconds", 0.004)
+        footer = metrics.format_footer()
+        self.assertIn("10 lines read, 1 malformed", footer)
+        self.assertIn("tail lag 42B", footer)
+        dump = metrics.dump()
+        self.assertIn("lines_read 10\n", dump)
+        self.assertIn("parse_seconds count=1", dump)
+
+if __name__ == '__main__':
+    unittest.main()
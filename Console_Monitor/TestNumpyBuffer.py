@@ -0,0 +1,97 @@
+import random
+import unittest
+import NumpyBuffer
+from Buffer import BucketedLogsBuffer
+from Parser import _ParsedLine
+from Pipeline import aggregate_batch
+
+
+def make_entries(start, seconds, seed=0):
+    rng = random.Random(seed)
+    return [_ParsedLine("section%d" % min(int(rng.expovariate(.3)), 40), rng.choice(["200", "204", "404", "503"]),
+                        "10.0.%d.%d" % (rng.randrange(4), rng.randrange(256)), start + second + rng.random(),
+                        rng.randrange(1, 5000))
+            for second in range(seconds) for _ in range(rng.randrange(30))]
+
+
+@unittest.skipIf(NumpyBuffer.numpy is None, "NumPy is not installed")
+class TestNumpyLogsBuffer(unittest.TestCase):
+    def assertSameWindow(self, numpy_buffer, bucketed_buffer):
+        self.assertEqual(numpy_buffer.get_total_hits(), bucketed_buffer.get_total_hits())
+        self.assertEqual(numpy_buffer.get_total_traffic(), bucketed_buffer.get_total_traffic())
+        self.assertEqual(numpy_buffer.get_total_sections(), bucketed_buffer.get_total_sections())
+        self.assertEqual(numpy_buffer.get_total_users(), bucketed_buffer.get_total_users())
+        self.assertEqual(numpy_buffer.get_total_success(), bucketed_buffer.get_total_success())
+        self.assertDictEqual(dict(numpy_buffer.get_statuses()), dict(bucketed_buffer.get_statuses()))
+        self.assertDictEqual(dict(+numpy_buffer.get_status_classes()), dict(+bucketed_buffer.get_status_classes()))
+        self.assertDictEqual(dict(numpy_buffer.get_popular_sections()), dict(bucketed_buffer.get_popular_sections()))
+        self.assertDictEqual(dict(numpy_buffer.get_user_traffic()), dict(bucketed_buffer.get_user_traffic()))
+        for n in (1, 3, 10):
+            self.assertListEqual([hits for _, hits in numpy_buffer.get_popular_sections(n)],
+                                 [hits for _, hits in bucketed_buffer.get_popular_sections(n)])
+            self.assertListEqual([traffic for _, traffic in numpy_buffer.get_user_traffic(n)],
+                                 [traffic for _, traffic in bucketed_buffer.get_user_traffic(n)])
+
+    def test_same_stats_as_bucketed_buffer(self):
+        numpy_buffer, bucketed_buffer = NumpyBuffer.NumpyLogsBuffer(1), BucketedLogsBuffer(1)
+        entries = make_entries(1450983778, 300)
+        for i in range(0, len(entries), 97):
+            batch = entries[i:i + 97]
+            for monitor_buffer in (numpy_buffer, bucketed_buffer):
+                monitor_buffer.clean_old_entries(batch[0].utc_ts)
+                for entry in batch:
+                    monitor_buffer.add_entry(entry)
+                monitor_buffer.clean_old_entries(batch[-1].utc_ts)
+            self.assertSameWindow(numpy_buffer, bucketed_buffer)
+        self.assertEqual(numpy_buffer.snapshot(), bucketed_buffer.snapshot())
+        for monitor_buffer in (numpy_buffer, bucketed_buffer):
+            monitor_buffer.clean_old_entries(entries[-1].utc_ts + 61)
+        self.assertSameWindow(numpy_buffer, bucketed_buffer)
+        self.assertEqual(numpy_buffer.get_total_hits(), 0)
+
+    def test_identifiers_are_recycled(self):
+        # A scan: every host only sends one request
+        numpy_buffer, bucketed_buffer = NumpyBuffer.NumpyLogsBuffer(1), BucketedLogsBuffer(1)
+        start = 1450983778
+        for second in range(600):
+            for monitor_buffer in (numpy_buffer, bucketed_buffer):
+                monitor_buffer.clean_old_entries(start + second)
+                for i in range(20):
+                    monitor_buffer.add_entry(_ParsedLine("section%d" % i, "200", "10.%d.%d" % (second, i),
+                                                         start + second, second + i + 1))
+            if second % 97 == 0:
+                self.assertSameWindow(numpy_buffer, bucketed_buffer)
+        numpy_buffer.clean_old_entries(start + 600)
+        bucketed_buffer.clean_old_entries(start + 600)
+        self.assertSameWindow(numpy_buffer, bucketed_buffer)
+        self.assertEqual(numpy_buffer.snapshot(), bucketed_buffer.snapshot())
+        self.assertLessEqual(len(numpy_buffer.host_names.values), 4 * 60 * 20)
+        self.assertLessEqual(len(numpy_buffer.host_hits), 8 * 60 * 20)
+        self.assertEqual(len(numpy_buffer.section_names.values), 20)
+
+    def test_add_counts(self):
+        numpy_buffer, bucketed_buffer = NumpyBuffer.NumpyLogsBuffer(1), BucketedLogsBuffer(1)
+        entries = make_entries(1450983778, 50, seed=1)
+        lines = ['%s - - [24/12/2015:%s +00.000] "GET /%s/x" %s %d'
+                 % (entry.host, "%02d:%02d:%02d" % (int(entry.utc_ts) // 3600 % 24, int(entry.utc_ts) // 60 % 60,
+                                                    int(entry.utc_ts) % 60), entry.section, entry.status,
+                    entry.traffic) for entry in entries]
+        _, partials = aggregate_batch(lines)
+        for partial in partials:
+            numpy_buffer.add_counts(*partial)
+            bucketed_buffer.add_counts(*partial)
+        self.assertSameWindow(numpy_buffer, bucketed_buffer)
+
+
+class TestMakeBuffer(unittest.TestCase):
+    def test_fallback_without_numpy(self):
+        numpy = NumpyBuffer.numpy
+        NumpyBuffer.numpy = None
+        try:
+            self.assertIsInstance(NumpyBuffer.make_buffer(1), BucketedLogsBuffer)
+        finally:
+            NumpyBuffer.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
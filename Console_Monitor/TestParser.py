@@ -0,0 +1,51 @@
+import unittest
+from Parser import parse_logline, parse_lines, _parse_fast, _parse_regex
+
+_LINES = ['192.168.1.3 - - [20/12/2015:21:15:44 +01.000] "GET /api/browse/id" 404 1978',
+          '192.168.2.1 - - [24/12/2015:03:58:28 -02.000] "GET /pages" 200 2154',
+          '192.168.2.2 - - [24/12/2015:03:58:30 +01.000] "PUT /api/" 200 2017',
+          '10.0.0.1 - frank [24/12/2015:03:58:30 +00.000] "GET / HTTP/1.0" 301 0',
+          '10.0.0.1 - - [24/12/2015:03:58:30 +00.000] "GET /search/foo HTTP/1.1" 200 12 "extra"',
+          '10.0.0.1 - - [24/12/2015:03:58:30 +00.000] "GET /search?q=a/b HTTP/1.1" 200 12']
+
+
+class TestParser(unittest.TestCase):
+    def test_parse_logline(self):
+        parsed_line = parse_logline(_LINES[0])
+        self.assertEqual(parsed_line.section, "api")
+        self.assertEqual(parsed_line.status, "404")
+        self.assertEqual(parsed_line.host, "192.168.1.3")
+        self.assertEqual(parsed_line.traffic, 1978)
+        self.assertEqual(parse_logline(_LINES[3]).section, "")
+        self.assertEqual(parse_logline(_LINES[4]).section, "search")
+        self.assertEqual(parse_logline(_LINES[5]).section, "search")
+        self.assertEqual(parsed_line.path, "/api/browse/id")
+        self.assertEqual(parse_logline(_LINES[3]).path, "/")
+
+    def test_response_time(self):
+        self.assertIsNone(parse_logline(_LINES[0]).response_time)
+        for line in ('1.1.1.1 - - [24/12/2015:03:58:28 +01.000] "GET /a HTTP/1.1" 200 1 0.042',
+                     '1.1.1.1 - - [24/12/2015:03:58:28 +01.000] "GET /a" 200 1 0.042 "extra"'):
+            self.assertEqual(parse_logline(line).response_time, 0.042)
+            self.assertEqual(_parse_fast(line), _parse_regex(line))
+        self.assertIsNone(parse_logline('1.1.1.1 - - [24/12/2015:03:58:28 +01.000] "GET /a" 200 1 4x').response_time)
+
+    def test_offsets(self):
+        plus_one = parse_logline('1.1.1.1 - - [24/12/2015:03:58:28 +01.000] "GET /a" 200 1')
+        minus_two = parse_logline('1.1.1.1 - - [24/12/2015:03:58:28 -02.000] "GET /a" 200 1')
+        self.assertEqual(minus_two.utc_ts - plus_one.utc_ts, 3 * 3600)
+
+    def test_fast_path_matches_regex(self):
+        for line in _LINES:
+            self.assertEqual(_parse_fast(line), _parse_regex(line))
+
+    def test_malformed(self):
+        self.assertRaises(AttributeError, parse_logline, "garbage")
+        self.assertIsNone(_parse_fast('1.1.1.1 - - [24/12/2015:03:58:28 +0100] "GET /a" 200 1'))
+
+    def test_parse_lines(self):
+        parsed_lines = parse_lines(["garbage"] + _LINES + [""])
+        self.assertListEqual(parsed_lines, [parse_logline(line) for line in _LINES])
+
+if __name__ == '__main__':
+    unittest.main()
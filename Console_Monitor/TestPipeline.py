@@ -0,0 +1,149 @@
+import time
+import unittest
+from Buffer import BucketedLogsBuffer, FanoutBuffer
+from DisplayHelper import get_formatted_stats
+from Parser import parse_lines, parse_logline
+from Metrics import SelfMetrics
+from Pipeline import (SAMPLED_HOSTS, LoadShedder, ParallelAggregator, ReorderBuffer, aggregate_batch, ingest_batch,
+                      merge_partials)
+from Rollups import MinuteRollups
+from Rules import RuleEngine
+from Warden import AlertRule
+
+_LINES = ['192.168.2.%d - - [24/12/2015:03:58:%02d +01.000] "GET /%s/x" %s %d'
+          % (i % 4, i % 60, ["pages", "api", "search"][i % 3], ["200", "404", "500"][i % 5 % 3], 100 + i)
+          for i in range(600)] + ["garbage"]
+
+
+def fresh_lines(age):
+    """
+    :param age: (int) age of the oldest line, in seconds, on the clock of ingest_batch
+    :return: (list) 600 lines written during the minute following it, 10 per second
+    """
+    template = '192.168.2.%d - - [%s +00.000] "GET /%s/x" 200 %d\n'
+    oldest = time.mktime(time.gmtime()) - age
+    # Shift the dates by the timezone correction of the parser, whatever the timezone of the tests
+    shift = oldest - parse_logline(template % (0, time.strftime("%d/%m/%Y:%H:%M:%S", time.gmtime(oldest)), "a",
+                                               0)).utc_ts
+    return [template % (i % 4, time.strftime("%d/%m/%Y:%H:%M:%S", time.gmtime(oldest + shift + i // 10)),
+                        ["pages", "api", "search"][i % 3], 100 + i) for i in range(600)]
+
+
+class TestPipeline(unittest.TestCase):
+    def test_aggregate_batch(self):
+        malformed, partials = aggregate_batch(_LINES)
+        self.assertEqual(malformed, 1)
+        self.assertListEqual([partial[0] for partial in partials], sorted(partial[0] for partial in partials))
+        self.assertEqual(sum(partial[1] for partial in partials), 600)
+
+    def test_parallel_merge_matches_sequential(self):
+        sequential, parallel = BucketedLogsBuffer(100000), BucketedLogsBuffer(100000)
+        for entry in parse_lines(_LINES):
+            sequential.add_entry(entry)
+
+        aggregator = ParallelAggregator(2, max_pending=2)
+        results = []
+        try:
+            for i in range(0, len(_LINES), 50):
+                results += aggregator.submit(_LINES[i:i + 50], i)
+            results += aggregator.collect(wait=True)
+        finally:
+            aggregator.close()
+        self.assertListEqual([now for now, _, _ in results], list(range(0, len(_LINES), 50)))
+        for _, _, partials in results:
+            merge_partials(parallel, partials)
+
+        self.assertEqual(parallel.get_total_hits(), sequential.get_total_hits())
+        self.assertDictEqual(dict(parallel.hits), dict(sequential.hits))
+        self.assertDictEqual(dict(parallel.statuses), dict(sequential.statuses))
+        self.assertDictEqual(dict(parallel.host_traffic), dict(sequential.host_traffic))
+
+    def test_reorder_merges_sources_by_timestamp(self):
+        entries = parse_lines(_LINES[:60])
+        reorder = ReorderBuffer(5)
+        reorder.push(entries[1::2], "b")
+        reorder.push(entries[::2], "a")
+        released = reorder.release()
+        self.assertListEqual([entry for _, entry in released], [entry for entry in entries
+                                                                 if entry.utc_ts <= entries[-1].utc_ts - 5])
+        self.assertListEqual([source for source, _ in released[:4]], ["a", "b", "a", "b"])
+        released += reorder.flush()
+        self.assertListEqual([entry for _, entry in released], entries)
+        self.assertEqual(len(reorder), 0)
+
+    def test_reorder_releases_when_idle(self):
+        entries = parse_lines(_LINES[:10])
+        reorder = ReorderBuffer(5)
+        reorder.push(entries, "a")
+        self.assertEqual(len(reorder.release()), 5)
+        self.assertEqual(len(reorder.release(entries[-1].utc_ts + 5)), 5)
+
+    def test_load_shedder_hysteresis(self):
+        metrics = SelfMetrics()
+        load_shedder = LoadShedder(20)
+        for lag, degraded in ((10, False), (25, True), (10, True), (4, False), (15, False)):
+            load_shedder.update(lag, metrics)
+            self.assertEqual(load_shedder.degraded, degraded, lag)
+        self.assertEqual(metrics.counters["degraded_switches"], 1)
+        self.assertEqual(metrics.gauges["ingestion_lag_seconds"], 15)
+        load_shedder.update(25, metrics)
+        load_shedder.check_idle(60, metrics)
+        self.assertTrue(load_shedder.degraded)
+        load_shedder.check_idle(0, metrics)
+        self.assertFalse(load_shedder.degraded)
+
+    def test_sampling_spans_batches(self):
+        load_shedder = LoadShedder(20, 3)
+        sampled = []
+        for start, end in ((0, 7), (7, 8), (8, 20)):
+            sampled += load_shedder.sample(list(range(start, end)))
+        self.assertListEqual(sampled, list(range(0, 20, 3)))
+
+    def test_degraded_ingestion_scales_counts(self):
+        # The lines are 2 to 3 minutes old: the first batch is ingested normally, then the load is shed
+        lines = fresh_lines(180) + ["garbage"]
+        monitor_buffer, metrics = BucketedLogsBuffer(1000), SelfMetrics()
+        load_shedder = LoadShedder(60, 10)
+        ingest_batch(lines[:300], monitor_buffer, metrics, load_shedder=load_shedder)
+        self.assertTrue(load_shedder.degraded)
+        _, malformed = ingest_batch(lines[300:], monitor_buffer, metrics, load_shedder=load_shedder)
+        # 1 sampled line out of 31 is the garbage one
+        self.assertEqual(malformed, 10)
+        self.assertEqual(metrics.counters["lines_shed"], 270)
+        self.assertEqual(monitor_buffer.get_total_hits(), 600)
+        self.assertEqual(sum(monitor_buffer.statuses.values()), 600)
+        self.assertEqual(monitor_buffer.hits["pages"], 100 + 100)
+        self.assertEqual(monitor_buffer.host_traffic[SAMPLED_HOSTS], sum(100 + i for i in range(300, 600, 10)) * 10)
+        self.assertEqual(monitor_buffer.host_hits[SAMPLED_HOSTS], 300)
+
+    def test_degraded_stats_render(self):
+        monitor_buffer = BucketedLogsBuffer(1000)
+        load_shedder = LoadShedder(60, 10)
+        load_shedder.degraded = True
+        ingest_batch(fresh_lines(180), monitor_buffer, SelfMetrics(), load_shedder=load_shedder)
+        stats = get_formatted_stats("20:02:58", "Low Traffic", monitor_buffer.get_total_hits(),
+                                    monitor_buffer.get_total_sections(), monitor_buffer.get_popular_sections(10),
+                                    monitor_buffer.get_status_classes(), monitor_buffer.get_total_success(),
+                                    monitor_buffer.get_total_users(), monitor_buffer.get_user_traffic(10),
+                                    monitor_buffer.get_total_traffic())
+        self.assertIn("Low Traffic - 1 Users - 600/600 successful hits", stats)
+        self.assertIn("100%% of our traffic is with %s" % SAMPLED_HOSTS, stats)
+
+    def test_degraded_hosts_are_not_hosts(self):
+        # 600 hits within the last minute would make the sampled pseudo-host a greedy host of 5 hits/s
+        rule = AlertRule("greedy", "host_hits", 120, 1)
+        engine, rollups = RuleEngine([rule]), MinuteRollups()
+        monitor_buffer = FanoutBuffer(BucketedLogsBuffer(1000), engine, rollups)
+        load_shedder = LoadShedder(60, 10)
+        load_shedder.degraded = True
+        now, _ = ingest_batch(fresh_lines(60), monitor_buffer, SelfMetrics(), load_shedder=load_shedder)
+        self.assertEqual(monitor_buffer.host_hits[SAMPLED_HOSTS], 600)
+        self.assertListEqual(engine.update(now + 1), [])
+        self.assertEqual(engine.counters.value(rule), 0.)
+        closed = rollups.pop_closed()
+        self.assertEqual(sum(rollup.hits for rollup in closed), 600)
+        self.assertTrue(all(not rollup.host_hits and not rollup.host_traffic for rollup in closed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from Buffer import BucketedLogsBuffer
+from Parser import parse_logline
+from Replay import replay
+from Warden import AlertWarden
+
+_START = time.mktime((2015, 12, 24, 3, 0, 0, 0, 0, -1))
+
+
+def log_line(timestamp, section="pages"):
+    return '192.168.2.1 - - [%s +00.000] "GET /%s" 200 100\n' % (time.strftime("%d/%m/%Y:%H:%M:%S",
+                                                                            time.localtime(timestamp)), section)
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        # 1 hit per second for a minute, then 4 per second for a minute, then nothing but one last line
+        lines = [log_line(_START + i) for i in range(60)]
+        lines += [log_line(_START + 60 + i // 4) for i in range(240)]
+        lines += [log_line(_START + 300)]
+        self.plain_path = os.path.join(self.workdir, "logs.txt")
+        self.gzip_path = os.path.join(self.workdir, "logs.txt.gz")
+        with open(self.plain_path, 'w') as log_file:
+            log_file.writelines(lines[:150] + ["garbage\n"])
+        with gzip.open(self.gzip_path, 'wb') as log_file:
+            log_file.write("".join(lines[150:]).encode())
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_replay_drives_the_clock(self):
+        monitor_buffer, alert_warden = BucketedLogsBuffer(1), AlertWarden(1)
+        offset = parse_logline(log_line(_START).strip()).utc_ts - _START
+        events, skipped, clocks = [], 0, []
+        for now, malformed in replay([self.plain_path, self.gzip_path], monitor_buffer):
+            clocks.append(now)
+            skipped += malformed
+            message_type, _ = alert_warden.update(monitor_buffer.get_total_hits(), now)
+            if message_type != 2:
+                events.append((message_type, now - offset - _START))
+
+        self.assertEqual(skipped, 1)
+        self.assertListEqual(clocks, sorted(clocks))
+        self.assertListEqual(clocks, [clocks[0] + second for second in range(301)])
+        # At 79s, the period holds 41 hits of the first minute and 80 of the second one: over the threshold of 120
+        # During the silent gap, the alert recovers at 151s, when the period holds 116 hits of the second minute, and
+        # not with the last line at 300s
+        self.assertListEqual(events, [(1, 79), (0, 151)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+from Parser import _ParsedLine
+from Rollups import MinuteRollups, RollupStore, parse_date
+from TestNumpyBuffer import make_entries
+
+_START = 1450983600
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = RollupStore(os.path.join(self.directory, "rollups.db"), hosts_per_minute=5)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_minutes_are_closed_after_the_grace_time(self):
+        rollups = MinuteRollups(grace=5)
+        rollups.add_entry(_ParsedLine("a", "200", "h", _START + 59.5, 10))
+        rollups.add_entry(_ParsedLine("a", "200", "h", _START + 60, 10))
+        self.assertListEqual(rollups.pop_closed(_START + 64), [])
+        closed = rollups.pop_closed(_START + 65)
+        self.assertListEqual([(rollup.second, rollup.hits) for rollup in closed], [(_START, 1)])
+        self.assertListEqual([rollup.second for rollup in rollups.pop_closed()], [_START + 60])
+
+    def test_queries_match_a_recount(self):
+        entries = make_entries(_START, 600)
+        rollups = MinuteRollups()
+        for entry in entries:
+            rollups.add_entry(entry)
+        self.store.write(rollups.pop_closed(_START + 300))
+        # A late entry of a minute already written is added up with it
+        late = _ParsedLine("section0", "500", "10.0.0.1", _START + 10, 7)
+        rollups.add_entry(late)
+        self.store.write(rollups.pop_closed())
+        entries.append(late)
+
+        start, end = _START + 120, _START + 480
+        in_range = [entry for entry in entries if start <= entry.utc_ts < end]
+        totals = self.store.totals(start, end)
+        self.assertEqual(totals["minutes"], 6)
+        self.assertEqual(totals["hits"], len(in_range))
+        self.assertEqual(totals["bytes"], sum(entry.traffic for entry in in_range))
+        self.assertEqual(totals["status_4"], sum(1 for entry in in_range if entry.status == "404"))
+        sections = Counter(entry.section for entry in in_range)
+        self.assertListEqual([hits for _, hits, _ in self.store.top("section", start, end, 3)],
+                             [hits for _, hits in sections.most_common(3)])
+        self.assertEqual(self.store.totals(_START, _START + 60)["status_5"],
+                         sum(1 for entry in entries if entry.utc_ts < _START + 60 and entry.status[0] == "5"))
+
+    def test_top_hosts(self):
+        rollups = MinuteRollups()
+        for minute in range(3):
+            for host, hits in (("big", 50), ("medium", 20), ("small", 1)):
+                rollups.add_counts(_START + minute * 60, hits, Counter({"a": hits}), Counter({"200": hits}),
+                                   Counter({host: hits}), Counter({host: hits * 100}))
+        self.store.write(rollups.pop_closed())
+        self.assertListEqual(self.store.top("host", _START, _START + 180, 2),
+                             [("big", 150, 15000), ("medium", 60, 6000)])
+        self.assertListEqual(self.store.top("host", _START + 180, _START + 240), [])
+
+    def test_compacted_hours(self):
+        rollups, counts = MinuteRollups(), []
+        for minute in range(3 * 60):
+            second, section = _START + minute * 60, "s%d" % (minute % 7)
+            rollups.add_counts(second, minute + 1, Counter({section: minute + 1}), Counter({"200": minute + 1}),
+                               Counter({"h": minute + 1}), Counter({"h": 1}))
+            counts.append((second, section, minute + 1))
+            if minute % 10 == 9:
+                self.store.write(rollups.pop_closed())
+        self.assertEqual(self.store.compacted_until, _START + 2 * 3600)
+        # A late minute of a compacted hour
+        rollups.add_counts(_START + 90, 1000, Counter({"late": 1000}), Counter({"200": 1000}), Counter({"h": 1000}),
+                           Counter({"h": 0}))
+        self.store.write(rollups.pop_closed())
+        counts.append((_START + 90, "late", 1000))
+        for start, end in ((_START, _START + 3 * 3600), (_START + 1800, _START + 7300), (_START + 60, _START + 3600),
+                           (_START + 3600, _START + 7200)):
+            expected = Counter()
+            for second, section, hits in counts:
+                if start <= second < end:
+                    expected[section] += hits
+            self.assertListEqual([(name, hits) for name, hits, _ in self.store.top("section", start, end, 20)],
+                                 expected.most_common())
+            self.assertEqual(self.store.top("host", start, end)[0][1], sum(expected.values()))
+
+    def test_reopened_store(self):
+        rollups = MinuteRollups()
+        rollups.add_entry(_ParsedLine("a", "200", "h", _START, 10))
+        self.store.write(rollups.pop_closed())
+        self.store.close()
+        rollups.add_entry(_ParsedLine("a", "301", "h", _START + 60, 5))
+        self.store.write(rollups.pop_closed())
+        self.assertListEqual(self.store.top("host", _START, _START + 120), [("h", 2, 15)])
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date("1450983600"), 1450983600)
+        self.assertEqual(parse_date("2015-12-24 14:00") + 30, parse_date("2015-12-24 14:00:30"))
+        self.assertRaises(ValueError, parse_date, "yesterday")
+
+
+if __name__ == '__main__':
+    unittest.main()
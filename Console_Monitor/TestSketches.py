@@ -0,0 +1,141 @@
+import random
+import unittest
+from collections import Counter
+from Buffer import SketchLogsBuffer
+from Parser import _ParsedLine
+from Sketches import DDSketch, SpaceSaving, HyperLogLog, hash64
+
+
+def zipf_entries(start, seconds, per_second, nb_sections, nb_hosts, seed=42):
+    rng = random.Random(seed)
+    sections = ["section%d" % i for i in range(nb_sections)]
+    weights = [1. / (i + 1) for i in range(nb_sections)]
+    entries = []
+    for second in range(seconds):
+        for section in rng.choices(sections, weights, k=per_second):
+            entries.append(_ParsedLine(section, rng.choice(["200", "404", "500"]),
+                                       "10.%d" % rng.randrange(nb_hosts), start + second, rng.randrange(100, 3000)))
+    return entries
+
+
+class TestSketches(unittest.TestCase):
+    def test_space_saving_over_estimates_within_floor(self):
+        rng = random.Random(1)
+        stream = ["k%d" % min(int(rng.expovariate(0.05)), 5000) for _ in range(20000)]
+        exact = Counter(stream)
+        summary = SpaceSaving.from_error(0.01)
+        for key in stream:
+            summary.add(key)
+        self.assertLessEqual(summary.floor, 0.01 * len(stream))
+        for key, count in summary.most_common(10):
+            self.assertGreaterEqual(count, exact[key])
+            self.assertLessEqual(count, exact[key] + summary.floor)
+        self.assertListEqual([key for key, _ in summary.most_common(5)], [key for key, _ in exact.most_common(5)])
+
+    def test_hyperloglog_error(self):
+        sketch = HyperLogLog.from_error(0.02)
+        for i in range(50000):
+            sketch.add(hash64("10.0.%d" % i))
+        self.assertAlmostEqual(sketch.count(), 50000, delta=50000 * 0.02 * 3)
+        small = HyperLogLog.from_error(0.02)
+        for i in range(100):
+            small.add(hash64("host%d" % i))
+        self.assertAlmostEqual(small.count(), 100, delta=3)
+
+    def test_ddsketch_relative_accuracy(self):
+        rng = random.Random(0)
+        values = [rng.lognormvariate(7, 1.5) for _ in range(20000)]
+        sketch = DDSketch(0.01)
+        for value in values:
+            sketch.add(value)
+        values.sort()
+        for q in (.5, .9, .95, .99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=exact * 0.01)
+        self.assertIsNone(DDSketch().quantile(.5))
+
+    def test_ddsketch_merge_and_remove(self):
+        rng = random.Random(1)
+        first, second, both = DDSketch(), DDSketch(), DDSketch()
+        for sketch in first, second:
+            for _ in range(1000):
+                value = rng.expovariate(.01)
+                sketch.add(value)
+                both.add(value)
+        merged = DDSketch()
+        merged.merge(first)
+        merged.merge(second)
+        self.assertDictEqual(merged.bins, both.bins)
+        merged.merge(first, -1)
+        self.assertDictEqual(merged.bins, second.bins)
+        self.assertEqual(merged.count, second.count)
+
+    def test_ddsketch_bins_are_bounded(self):
+        sketch = DDSketch(0.01, max_bins=100)
+        for exponent in range(-300, 300):
+            sketch.add(10 ** (exponent / 10.))
+        self.assertLessEqual(len(sketch.bins), 100)
+        self.assertAlmostEqual(sketch.quantile(.99), 10 ** 29.3, delta=10 ** 29.3 * 0.01)
+
+    def test_ddsketch_remove_after_collapse(self):
+        window, seconds = DDSketch(0.01, max_bins=50), []
+        for second in range(10):
+            sketch = DDSketch(0.01, max_bins=50)
+            for exponent in range(second * 10, second * 10 + 10):
+                sketch.add(1.1 ** exponent)
+            window.merge(sketch)
+            seconds.append(sketch)
+        for sketch in seconds[:9]:
+            window.merge(sketch, -1)
+        self.assertEqual(window.count, 10)
+        self.assertTrue(all(count > 0 for count in window.bins.values()))
+        self.assertAlmostEqual(window.quantile(1), 1.1 ** 99, delta=1.1 ** 99 * 0.01)
+
+
+class TestSketchLogsBuffer(unittest.TestCase):
+    def test_accuracy_against_exact_counters(self):
+        sketch_buffer = SketchLogsBuffer(1, top_error=0.01, distinct_error=0.02)
+        entries = zipf_entries(1450983778, 100, 300, 2000, 20000)
+        for entry in entries:
+            sketch_buffer.clean_old_entries(entry.utc_ts)
+            sketch_buffer.add_entry(entry)
+        # Expiry happens by slices, so the exact counters are computed from the start of the oldest slice
+        window = [entry for entry in entries if entry.utc_ts >= sketch_buffer.slices[0].start]
+        exact_sections, exact_traffic = Counter(), Counter()
+        for entry in window:
+            exact_sections[entry.section] += 1
+            exact_traffic[entry.host] += entry.traffic
+        total_traffic = sum(exact_traffic.values())
+
+        self.assertEqual(sketch_buffer.get_total_hits(), len(window))
+        self.assertEqual(sketch_buffer.get_total_traffic(), total_traffic)
+        self.assertAlmostEqual(sketch_buffer.get_total_sections(), len(exact_sections),
+                               delta=len(exact_sections) * 0.06)
+        self.assertAlmostEqual(sketch_buffer.get_total_users(), len(exact_traffic), delta=len(exact_traffic) * 0.06)
+
+        popular = sketch_buffer.get_popular_sections(10)
+        self.assertListEqual([section for section, _ in popular][:3],
+                             [section for section, _ in exact_sections.most_common(3)])
+        for section, hits in popular:
+            self.assertGreaterEqual(hits, exact_sections[section])
+            self.assertLessEqual(hits, exact_sections[section] + 0.01 * len(window))
+        for host, traffic in sketch_buffer.get_user_traffic(10):
+            self.assertGreaterEqual(traffic, exact_traffic[host])
+            self.assertLessEqual(traffic, exact_traffic[host] + 0.01 * total_traffic)
+
+    def test_windowed_expiry(self):
+        start = 1450983775
+        sketch_buffer = SketchLogsBuffer(1, slice_seconds=5)
+        for entry in zipf_entries(start, 10, 10, 50, 50):
+            sketch_buffer.add_entry(entry)
+        sketch_buffer.clean_old_entries(start + 64)
+        self.assertEqual(sketch_buffer.get_total_hits(), 100)
+        sketch_buffer.clean_old_entries(start + 65)
+        self.assertEqual(sketch_buffer.get_total_hits(), 50)
+        sketch_buffer.clean_old_entries(start + 70)
+        self.assertEqual(sketch_buffer.get_total_hits(), 0)
+        self.assertEqual(sketch_buffer.get_total_users(), 0)
+        self.assertEqual(len(sketch_buffer.get_popular_sections()), 0)
+
+if __name__ == '__main__':
+    unittest.main()
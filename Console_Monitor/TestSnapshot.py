@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from Aggregator import combined_buffer, load_snapshots, merge_snapshots
+from Buffer import LogsBuffer, BucketedLogsBuffer
+from Parser import parse_lines
+from Snapshot import WindowSnapshot
+
+_LINES = ['192.168.2.%d - - [24/12/2015:03:%02d:%02d +01.000] "GET /%s/x" %s %d'
+          % (i % 7, 58 + i // 60 % 2, i % 60, ["pages", "api", "search", "home"][i % 4],
+             ["200", "404", "500"][i % 5 % 3], 100 + i) for i in range(900)]
+
+
+def node_buffers(buffer_class, nb_nodes):
+    """
+    :return: (list) one buffer per node, the lines being spread over the nodes
+    """
+    buffers = [buffer_class(100000) for _ in range(nb_nodes)]
+    for i, entry in enumerate(parse_lines(_LINES)):
+        buffers[i % nb_nodes].add_entry(entry)
+    return buffers
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_round_trip(self):
+        snapshot = node_buffers(LogsBuffer, 1)[0].snapshot()
+        self.assertEqual(WindowSnapshot.from_bytes(snapshot.to_bytes()), snapshot)
+        self.assertEqual(node_buffers(BucketedLogsBuffer, 1)[0].snapshot(), snapshot)
+        with self.assertRaises(ValueError):
+            WindowSnapshot.from_bytes(snapshot.to_bytes()[:-3])
+
+    def test_merge_is_associative(self):
+        a, b, c = [node_buffer.snapshot() for node_buffer in node_buffers(LogsBuffer, 3)]
+        self.assertEqual(a.merge(b).merge(c), a.merge(b.merge(c)))
+        self.assertEqual(a.merge(b), b.merge(a))
+        self.assertEqual(a.merge(WindowSnapshot()), a)
+
+    def test_merge_matches_single_node(self):
+        single = LogsBuffer(100000)
+        for entry in parse_lines(_LINES):
+            single.add_entry(entry)
+        now = single[-1].utc_ts
+        merged = combined_buffer(merge_snapshots(node.snapshot() for node in node_buffers(LogsBuffer, 3)), 100000,
+                                 now)
+        self.assertEqual(merged.get_total_hits(), single.get_total_hits())
+        self.assertEqual(merged.get_total_traffic(), single.get_total_traffic())
+        self.assertEqual(merged.get_total_users(), single.get_total_users())
+        self.assertDictEqual(dict(merged.hits), dict(single.hits))
+        self.assertDictEqual(dict(merged.statuses), dict(single.statuses))
+        self.assertDictEqual(dict(merged.status_classes), dict(single.status_classes))
+        self.assertDictEqual(dict(merged.host_traffic), dict(single.host_traffic))
+        self.assertEqual(merge_snapshots([single.snapshot()]), merge_snapshots(node.snapshot()
+                                                                               for node in node_buffers(LogsBuffer, 3)))
+
+    def test_spool_directory(self):
+        spool = tempfile.mkdtemp()
+        try:
+            for i, node_buffer in enumerate(node_buffers(BucketedLogsBuffer, 2)):
+                node_buffer.snapshot().save(os.path.join(spool, "node%d.snap" % i))
+            with open(os.path.join(spool, "broken.snap"), 'wb') as broken:
+                broken.write(b"HLS1")
+            snapshots = load_snapshots(spool, 60)
+            self.assertListEqual(sorted(snapshots), ["node0", "node1"])
+            self.assertEqual(sum(partial[1] for partial in merge_snapshots(snapshots.values()).partials()),
+                             len(_LINES))
+        finally:
+            shutil.rmtree(spool)
+
+
+if __name__ == '__main__':
+    unittest.main()
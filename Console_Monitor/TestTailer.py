@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+from Tailer import Tailer, MultiTailer, Checkpoint
+
+
+class TestTailer(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.workdir, "logs.txt")
+        self.checkpoint_path = os.path.join(self.workdir, "logs.offset")
+        open(self.log_path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def append(self, content, path=None):
+        with open(path or self.log_path, 'a') as log_file:
+            log_file.write(content)
+
+    def test_read_batches(self):
+        tailer = Tailer(self.log_path, .01, from_start=True)
+        batches = tailer.read_batches()
+        self.append("a\nb\nc")
+        self.assertListEqual(next(batches), ["a", "b"])
+        self.append("d\n")
+        self.assertListEqual(next(batches), ["cd"])
+        batches.close()
+
+    def test_rotation(self):
+        tailer = Tailer(self.log_path, .01, from_start=True)
+        batches = tailer.read_batches()
+        self.append("a\n")
+        self.assertListEqual(next(batches), ["a"])
+        self.append("b\n")
+        os.rename(self.log_path, self.log_path + ".1")
+        self.append("c\n", self.log_path + ".1")
+        self.append("d\n")
+        self.assertListEqual(next(batches), ["b", "c"])
+        self.assertListEqual(next(batches), ["d"])
+        batches.close()
+
+    def test_truncation(self):
+        tailer = Tailer(self.log_path, .01, from_start=True)
+        batches = tailer.read_batches()
+        self.append("aaaa\nbbbb\n")
+        self.assertListEqual(next(batches), ["aaaa", "bbbb"])
+        open(self.log_path, 'w').close()
+        self.append("c\n")
+        self.assertListEqual(next(batches), ["c"])
+        batches.close()
+
+    def test_start_offset(self):
+        self.append("a\nb\nc")
+        tailer = Tailer(self.log_path, .01, start_offset=2)
+        batches = tailer.read_batches()
+        self.append("\n")
+        self.assertListEqual(next(batches), ["b", "c"])
+        batches.close()
+
+    def test_checkpoint_resume(self):
+        tailer = Tailer(self.log_path, .01, from_start=True, checkpoint_path=self.checkpoint_path)
+        batches = tailer.read_batches()
+        self.append("a\n")
+        self.assertListEqual(next(batches), ["a"])
+        self.append("b\n")
+        self.assertListEqual(next(batches), ["b"])
+        batches.close()
+        # The last batch was not acknowledged by asking for the next one, so it is delivered again
+        self.assertTupleEqual(Checkpoint(self.checkpoint_path).load(), (os.stat(self.log_path).st_ino, 2))
+
+        self.append("c\n")
+        batches = Tailer(self.log_path, .01, checkpoint_path=self.checkpoint_path).read_batches()
+        self.assertListEqual(next(batches), ["b", "c"])
+        batches.close()
+
+    def test_checkpoint_resume_after_rotation(self):
+        tailer = Tailer(self.log_path, .01, from_start=True, checkpoint_path=self.checkpoint_path)
+        batches = tailer.read_batches()
+        self.append("a\n")
+        self.assertListEqual(next(batches), ["a"])
+        self.append("b\n")
+        self.assertListEqual(next(batches), ["b"])
+        batches.close()
+
+        self.append("c\n")
+        os.rename(self.log_path, self.log_path + ".1")
+        self.append("d\n")
+        batches = Tailer(self.log_path, .01, checkpoint_path=self.checkpoint_path).read_batches()
+        self.assertListEqual(next(batches), ["b", "c"])
+        self.assertListEqual(next(batches), ["d"])
+        batches.close()
+
+    def test_multi_tailer_picks_up_new_files(self):
+        self.append("a\n")
+        tailer = MultiTailer([os.path.join(self.workdir, "*.txt")], .01, rescan_interval=0, from_start=True)
+        batches = tailer.read_batches()
+        self.assertListEqual(next(batches), [(self.log_path, ["a"])])
+        other_path = os.path.join(self.workdir, "other.txt")
+        self.append("b\nc\n", other_path)
+        self.append("d\n")
+        self.assertListEqual(sorted(next(batches)), [(self.log_path, ["d"]), (other_path, ["b", "c"])])
+        self.assertListEqual(next(batches), [])
+        batches.close()
+
+    def test_multi_tailer_drops_deleted_files(self):
+        other_path = os.path.join(self.workdir, "other.txt")
+        self.append("a\n", other_path)
+        tailer = MultiTailer([os.path.join(self.workdir, "*.txt")], .01, rescan_interval=0, from_start=True)
+        batches = tailer.read_batches()
+        self.assertListEqual(next(batches), [(other_path, ["a"])])
+        self.append("b\nc", other_path)
+        os.remove(other_path)
+        self.assertListEqual(next(batches), [(other_path, ["b"])])
+        self.assertListEqual(next(batches), [(other_path, ["c"])])
+        self.assertListEqual(sorted(tailer.tailers), [self.log_path])
+        self.append("d\n", other_path)
+        self.assertListEqual(next(batches), [(other_path, ["d"])])
+        batches.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
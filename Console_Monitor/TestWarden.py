@@ -1,5 +1,12 @@
+import json
+import os
+import random
+import tempfile
 import unittest
-from Warden import AlertWarden
+from datetime import datetime
+from Parser import _ParsedLine
+from Rules import RuleEngine, WindowCounters, load_rules
+from Warden import AlertWarden, AlertRule
 
 
 class TestAlertWarden(unittest.TestCase):
@@ -35,5 +42,85 @@ class TestAlertWarden(unittest.TestCase):
         alert_warden.update(216, now)
         self.assertEqual(alert_warden.status(), 1)
 
+
+class TestAlertRule(unittest.TestCase):
+    def test_hysteresis(self):
+        rule = AlertRule("api", "section_hits", 10, 10, recovery_threshold=8, key="api")
+        now = 1450983778
+        self.assertTupleEqual(rule.update(9.9, now), (2, ()))
+        readable_now = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+        self.assertTupleEqual(rule.update(10, now), (1, (readable_now, 10, 10)))
+        self.assertTupleEqual(rule.update(9, now + 5), (2, ()))
+        self.assertTupleEqual(rule.update(12, now + 8), (2, ()))
+        self.assertTupleEqual(rule.update(7.9, now + 10), (0, ("0: 0:10", 12, 10)))
+
+
+def make_entries(start, seconds, seed=0):
+    """
+    :return: (list) random ParsedLine over a range of seconds, a few of them out of order
+    """
+    rng = random.Random(seed)
+    return [_ParsedLine(rng.choice(["api", "pages", "search"]), rng.choice(["200", "404", "500", "503"]),
+                        "10.0.0.%d" % rng.randrange(5), start + second + rng.random() - (rng.random() < .1),
+                        rng.randrange(100, 1000))
+            for second in range(seconds) for _ in range(rng.randrange(4))]
+
+
+class TestRuleEngine(unittest.TestCase):
+    def test_windows_match_recount(self):
+        start = 1450983778
+        rules = [AlertRule("hits", "hits", 10, 1), AlertRule("section", "section_hits", 60, 1),
+                 AlertRule("host", "host_hits", 10, 1), AlertRule("errors", "error_ratio", 120, 1)]
+        counters = WindowCounters(rules)
+        entries = make_entries(start, 300)
+        added, now = [], start
+        for entry in entries:
+            counters.add_entry(entry)
+            added.append(entry)
+            now = max(now, entry.utc_ts + 1)
+            counters.advance(now)
+            for window, totals in counters.totals.items():
+                inside = [old for old in added if int(now) - window <= int(old.utc_ts) < int(now)]
+                self.assertEqual(totals.hits, len(inside))
+                self.assertEqual(totals.traffic, sum(old.traffic for old in inside))
+                self.assertEqual(totals.errors, sum(1 for old in inside if old.status[0] == "5"))
+                if totals.sections is not None:
+                    self.assertDictEqual(dict(totals.sections),
+                                         dict((section, sum(1 for old in inside if old.section == section))
+                                              for section in set(old.section for old in inside)))
+        self.assertEqual(len(counters.totals), 3)
+        self.assertIsNone(counters.totals[10].sections)
+        self.assertIsNotNone(counters.totals[10].hosts)
+
+    def test_alert_and_recovery_without_entries(self):
+        start = 1450983778
+        engine = RuleEngine([AlertRule("api", "section_hits", 10, 2, recovery_threshold=1, key="api"),
+                             AlertRule("bandwidth", "bytes", 60, 10 ** 6)])
+        for second in range(5):
+            for _ in range(10):
+                engine.add_entry(_ParsedLine("api", "200", "10.0.0.1", start + second, 100))
+        changes = engine.update(start + 5)
+        self.assertListEqual([(rule.name, message_type) for rule, message_type, _ in changes], [("api", 1)])
+        self.assertListEqual(engine.update(start + 14), [])
+        changes = engine.update(start + 15)
+        self.assertListEqual([(rule.name, message_type) for rule, message_type, _ in changes], [("api", 0)])
+
+    def test_load_rules(self):
+        descriptor, path = tempfile.mkstemp()
+        os.close(descriptor)
+        try:
+            with open(path, 'w') as rules_file:
+                json.dump({"rules": [{"name": "errors", "metric": "error_ratio", "window": 60, "threshold": 0.05,
+                                      "min_hits": 100}]}, rules_file)
+            rule, = load_rules(path)
+            self.assertEqual((rule.name, rule.window, rule.alert_threshold, rule.min_hits), ("errors", 60, 0.05, 100))
+            with open(path, 'w') as rules_file:
+                json.dump({"rules": [{"name": "errors", "metric": "latency", "window": 60, "threshold": 1}]},
+                          rules_file)
+            self.assertRaises(ValueError, load_rules, path)
+        finally:
+            os.remove(path)
+
+
 if __name__ == '__main__':
     unittest.main()
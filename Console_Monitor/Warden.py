@@ -1,6 +1,7 @@
 """
 This module is the Warden of the alerts informations.
 It is used to check if an alert is happening, and remember about it until it recovers to a normal behavior
+AlertRule generalizes the warden to any metric, window and hysteresis (see Rules.py)
 """
 
 from datetime import datetime
@@ -14,6 +15,7 @@ class AlertWarden:
         self.in_alert_since = None
         self.hits_peak = 0
         self.alert_threshold = period * 60 * _BASIC_HOURLY_ALERT_THRESHOLD / 3600
+        self.recovery_threshold = self.alert_threshold
 
     def update(self, buffer_hits, now):
         """
@@ -36,7 +38,7 @@ class AlertWarden:
                 self.in_alert_since = now
                 return 1, (readable_now, self.hits_peak, self.alert_threshold)
         else:
-            if buffer_hits < self.alert_threshold:
+            if buffer_hits < self.recovery_threshold:
                 duration, peak = format_period(now - self.in_alert_since), self.hits_peak
                 self.in_alert_since = None
                 self.hits_peak = 0
@@ -50,3 +52,27 @@ class AlertWarden:
         return 0 if self.hits_peak < 0.9 * self.alert_threshold \
             else 1 if self.hits_peak < self.alert_threshold \
             else 2
+
+
+class AlertRule(AlertWarden):
+    def __init__(self, name, metric, window, threshold, recovery_threshold=None, key=None, min_hits=0):
+        """
+        Warden of a single rule of the rule engine
+        :param name: (str) name of the rule, in the alert messages
+        :param metric: (str) metric watched: "hits", "bytes" (per second), "section_hits", "host_hits" (per second, of
+                       the given key or of the busiest one), or "error_ratio" (share of 5xx statuses)
+        :param window: (int) time frame of the metric, in seconds
+        :param threshold: (float) value of the metric from which the rule alerts
+        :param recovery_threshold: (float) value of the metric under which the alert recovers, the threshold by
+                                   default (a lower value avoids flapping around the threshold)
+        :param key: (str) section or host watched by the "section_hits" and "host_hits" metrics, None for any of them
+        :param min_hits: (int) hits needed in the window for the "error_ratio" metric to be meaningful
+        """
+        AlertWarden.__init__(self, window / 60.)
+        self.name = name
+        self.metric = metric
+        self.window = window
+        self.alert_threshold = threshold
+        self.recovery_threshold = threshold if recovery_threshold is None else recovery_threshold
+        self.key = key
+        self.min_hits = min_hits
@@ -80,7 +80,49 @@ def get_zero_padded_utc_offset():
     Create a properly formatted UTC offset to represent the datetime
     :return: (str): Offset to UTC
     """
-    nb_hours = floor((time.mktime(time.localtime())-time.mktime(time.gmtime()))/3600)
+    nb_hours = int(floor((time.mktime(time.localtime())-time.mktime(time.gmtime()))/3600))
     sign = "+" if nb_hours >= 0 else "-"
-    value = "0" + str(nb_hours) if nb_hours < 10 else str(nb_hours)
-    return sign + value + "00"
+    return "%s%02d.000" % (sign, abs(nb_hours))
+
+
+def format_date(timestamp):
+    """
+    Create a properly formatted date, for any timestamp
+    :param timestamp: (float) timestamp to represent
+    :return: (str): representation of the datetime of the timestamp
+    """
+    return time.strftime("%d/%m/%Y:%H:%M:%S ", time.gmtime(timestamp)) + get_zero_padded_utc_offset()
+
+
+def create_hosts(nb_hosts):
+    """
+    Create a pool of distinct IP addresses, to control the amount of users of a simulation
+    :param nb_hosts: (int) amount of IP addresses
+    :return: (list): distinct IP addresses
+    """
+    return ["10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255) for i in range(nb_hosts)]
+
+
+def create_paths(nb_sections, rng):
+    """
+    Create a pool of paths spread over a given amount of sections, to control the cardinality of a simulation
+    :param nb_sections: (int) amount of distinct sections
+    :param rng: (Random) random generator of the simulation
+    :return: (list): paths, 4 per section
+    """
+    paths = []
+    for i in range(nb_sections):
+        section = "/section%d" % i
+        paths += [section, section + "/", section + "/item/%d" % rng.randrange(1000),
+                  section + "/item/%d/edit" % rng.randrange(1000)]
+    return paths
+
+
+def pick_skewed(values, rng):
+    """
+    Pick a value, the first ones of the list being much more likely than the last ones (like real traffic)
+    :param values: (list) values to pick from
+    :param rng: (Random) random generator of the simulation
+    :return: a value of the list
+    """
+    return values[int(len(values) * rng.random() ** 3)]
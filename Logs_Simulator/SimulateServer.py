@@ -3,9 +3,13 @@ Simulate w3c-formatted HTTP access log
 In order to observe some variance in the events we randomise the time between new lines in seconds as a sum of:
     - a float [0:1] generated every 60 seconds (to have high/low traffic frames compared to our 2mn monitoring buffer)
     - a float [0:0.2] generated every line (to have a randomised time every line)
+With --rate, the simulator becomes a load generator instead: lines are written by blocks to reach a target amount of
+lines per second, following a burst profile, over a configurable amount of hosts and sections.
+With --pregenerate, that load is written at once in a file, with timestamps spread as the rate would have.
 """
 
 import argparse
+import math
 import sys
 import random
 from time import sleep
@@ -13,6 +17,18 @@ import time
 import HTTP_log_fields
 
 _LOG_LINE_TEMPLATE = '%(remotehost)s %(rfc931)s %(authuser)s [%(date)s] "%(request)s" %(status)s %(bytes)s\n'
+_FAST_LOG_LINE_TEMPLATE = '%s - - [%s] "%s %s" %s %d\n'
+_TICK = 0.1
+
+# Multipliers of the target rate, depending on the time elapsed since the beginning of the simulation
+_BURST_PROFILES = {
+    "flat": lambda elapsed: 1.,
+    "square": lambda elapsed: 1.5 if int(elapsed // 60) % 2 == 0 else .5,
+    "spikes": lambda elapsed: 5. if elapsed % 120 < 10 else 1.,
+    "sine": lambda elapsed: 1 + .8 * math.sin(2 * math.pi * elapsed / 300),
+    # Seasonal traffic, peaking once a day (12 hours after the start) and nearly idle at night
+    "daily": lambda elapsed: 1 - .8 * math.cos(2 * math.pi * elapsed / 86400),
+}
 
 
 def add_entry(file):
@@ -29,18 +45,118 @@ def add_entry(file):
                 "bytes": HTTP_log_fields.create_bytes()
                 }
     file.write(_LOG_LINE_TEMPLATE % log_line)
-    print _LOG_LINE_TEMPLATE % log_line
+    print(_LOG_LINE_TEMPLATE % log_line)
     file.flush()
 
 
+class LoadGenerator:
+    def __init__(self, rate, profile="flat", nb_hosts=1000, nb_sections=50, seed=None):
+        """
+        Generate log lines at a high rate, reproducibly
+        :param rate: (float) target amount of lines per second
+        :param profile: (str) name of the burst profile modulating the rate (see _BURST_PROFILES)
+        :param nb_hosts: (int) amount of distinct hosts sending requests
+        :param nb_sections: (int) amount of distinct sections hit
+        :param seed: (int) seed of the random generator, None for a different simulation every time
+        """
+        self.rate = rate
+        self.profile = _BURST_PROFILES[profile]
+        self.rng = random.Random(seed)
+        self.hosts = HTTP_log_fields.create_hosts(nb_hosts)
+        self.paths = HTTP_log_fields.create_paths(nb_sections, self.rng)
+
+    def rate_at(self, elapsed):
+        """
+        :param elapsed: (float) seconds since the beginning of the simulation
+        :return: (float) target amount of lines per second at that time
+        """
+        return self.rate * self.profile(elapsed)
+
+    def lines_at(self, timestamp, count):
+        """
+        :param timestamp: (float) timestamp of the lines
+        :param count: (int) amount of lines to generate
+        :return: (list) formatted log lines
+        """
+        rng, hosts, paths = self.rng, self.hosts, self.paths
+        date = HTTP_log_fields.format_date(timestamp)
+        return [_FAST_LOG_LINE_TEMPLATE % (HTTP_log_fields.pick_skewed(hosts, rng), date,
+                                           rng.choice(HTTP_log_fields._METHODS),
+                                           HTTP_log_fields.pick_skewed(paths, rng),
+                                           rng.choice(HTTP_log_fields._STATUSES), rng.randrange(100, 3000))
+                for _ in range(count)]
+
+    def pregenerate(self, output_file, nb_lines, start=None):
+        """
+        Write nb_lines at once, timestamped as if they were written at the target rate from start
+        :param output_file: (file) File handler, needs to be open for writing
+        :param nb_lines: (int) amount of lines to write
+        :param start: (float) timestamp of the first line, now by default
+        """
+        start = time.time() if start is None else start
+        second, written, expected = 0, 0, 0.
+        while written < nb_lines:
+            expected += self.rate_at(second)
+            count = min(int(expected) - written, nb_lines - written)
+            output_file.write("".join(self.lines_at(start + second, count)))
+            written += count
+            second += 1
+
+    def run(self, output_file, nb_lines=None):
+        """
+        Write lines in real time, by blocks every _TICK seconds, to follow the target rate
+        :param output_file: (file) File handler, needs to be open for writing
+        :param nb_lines: (int) amount of lines to write, None to run forever
+        """
+        start = time.time()
+        written, expected = 0, 0.
+        last = start
+        while nb_lines is None or written < nb_lines:
+            now = time.time()
+            expected += self.rate_at(now - start) * (now - last)
+            last = now
+            count = int(expected) - written
+            if nb_lines is not None:
+                count = min(count, nb_lines - written)
+            if count > 0:
+                output_file.write("".join(self.lines_at(now, count)))
+                output_file.flush()
+                written += count
+            sleep(max(0, _TICK - (time.time() - now)))
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--lines", default=1000, type=int,
                         help="Number of log lines to write in the output")
     parser.add_argument("-o ", "--outputfile", default="logs.txt", type=str,
                         help="Where to output the logs")
+    parser.add_argument("-r", "--rate", default=None, type=float,
+                        help="Target amount of lines per second, enables the load generator")
+    parser.add_argument("--profile", default="flat", choices=sorted(_BURST_PROFILES),
+                        help="Burst profile of the load generator")
+    parser.add_argument("--hosts", default=1000, type=int,
+                        help="Amount of distinct hosts of the load generator")
+    parser.add_argument("--sections", default=50, type=int,
+                        help="Amount of distinct sections of the load generator")
+    parser.add_argument("--seed", default=None, type=int,
+                        help="Seed of the random generator, to reproduce a simulation")
+    parser.add_argument("--pregenerate", action="store_true",
+                        help="Write --lines lines at once, timestamped as if written at --rate (1000 by default)")
+    parser.add_argument("--start", default=None, type=float,
+                        help="Timestamp of the first pregenerated line, now by default")
     args = parser.parse_args()
 
+    if args.rate is not None or args.pregenerate:
+        generator = LoadGenerator(args.rate or 1000, args.profile, args.hosts, args.sections, args.seed)
+        with open(args.outputfile, 'w') as output_file:
+            if args.pregenerate:
+                generator.pregenerate(output_file, args.lines, args.start)
+            else:
+                generator.run(output_file, args.lines)
+        return 0
+
+    random.seed(args.seed)
     period = random.random()
     next_period = time.mktime(time.gmtime()) + 60
 